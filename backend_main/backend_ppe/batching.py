@@ -0,0 +1,235 @@
+"""
+Dynamic micro-batching for YOLO inference.
+
+Concurrent /ppe-scan requests are queued in front of the shared model and a
+single worker thread drains the queue in batches: it waits for the first
+image, then keeps collecting until either `max_batch_size` images are queued
+or `max_wait_ms` has passed since the oldest one arrived. One model call is
+made per batch and every caller receives its own result.
+
+The queue is bounded: once `max_queue` requests are waiting, `submit` raises
+`QueueFullError` so the API can shed load instead of letting latency grow
+without limit.
+
+Requests may carry a deadline (a `time.monotonic()` value). The queue is
+ordered earliest deadline first, a batch is flushed early enough for the
+nearest deadline to be met (its deadline minus the recent average batch run
+time) instead of waiting for the batch to fill, and requests whose deadline
+has passed are failed with `DeadlineExceededError` instead of being run:
+the client has already given up on them. Requests without a deadline are
+ordered as if due `undated_slack_ms` after they were queued, so they keep
+their place among dated ones, but they are never shed.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+BATCH_TIME_SMOOTHING = 0.2   # weight of the latest batch in the average batch run time
+
+
+class QueueFullError(Exception):
+    """Raised when the batcher queue already holds `max_queue` requests"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised for requests whose deadline passed before they reached the model"""
+
+
+class MicroBatcher:
+    """Queue single-image inference requests and run them as batches.
+
+    Parameters:
+        infer_batch (callable) -- takes a list of items, returns a list of results in the same order
+        max_batch_size (int)   -- largest batch handed to `infer_batch`
+        max_wait_ms (float)    -- how long the oldest queued item may wait for the batch to fill up
+        max_queue (int)        -- queued requests allowed before `submit` raises QueueFullError
+        name (str)             -- used for the worker thread name
+        on_batch (callable)    -- optional hook called with the queue wait (seconds) of every item in a batch
+        on_depth (callable)    -- optional hook called with the new queue depth whenever it changes
+        on_shed (callable)     -- optional hook called with the number of requests dropped for a passed deadline
+        undated_slack_ms (float) -- queue position of requests without a deadline, as if due this long after queueing
+    """
+
+    def __init__(self, infer_batch, max_batch_size=8, max_wait_ms=10.0, max_queue=64, name="ppe",
+                 on_batch=None, on_depth=None, on_shed=None, undated_slack_ms=1000.0):
+        self.infer_batch = infer_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.name = name
+        self.on_batch = on_batch
+        self.on_depth = on_depth
+        self.on_shed = on_shed
+        self.undated_slack = max(0.0, float(undated_slack_ms)) / 1000.0
+        # Heap of [due, sequence, item, future, enqueued_at, deadline]; the sequence keeps equal dues FIFO
+        self._pending = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._batch_seconds = None  # moving average of infer_batch run time, None before the first batch
+
+    @property
+    def depth(self) -> int:
+        """Number of requests waiting for a batch slot"""
+        return len(self._pending)
+
+    @property
+    def estimated_batch_seconds(self) -> float:
+        """Recent average run time of one batch, kept free for the nearest deadline when flushing"""
+        return self._batch_seconds or 0.0
+
+    def _observe_batch_time(self, seconds: float):
+        if self._batch_seconds is None:
+            self._batch_seconds = seconds
+        else:
+            self._batch_seconds += BATCH_TIME_SMOOTHING * (seconds - self._batch_seconds)
+
+    def _depth_changed(self):
+        """Report the queue depth (called with the lock held)"""
+        if self.on_depth is not None:
+            self.on_depth(len(self._pending))
+
+    def start(self):
+        """Start the batching worker thread"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the worker and fail every request that is still queued"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._cond:
+            while self._pending:
+                future = heapq.heappop(self._pending)[3]
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(RuntimeError(f"{self.name} batcher stopped"))
+            self._depth_changed()
+
+    def _shed(self, count: int):
+        if count and self.on_shed is not None:
+            self.on_shed(count)
+
+    def _push(self, item, future, now: float, deadline):
+        due = now + self.undated_slack if deadline is None else deadline
+        heapq.heappush(self._pending, [due, next(self._sequence), item, future, now, deadline])
+
+    def _check_deadline(self, now: float, deadline, count: int = 1):
+        if deadline is not None and deadline <= now:
+            self._shed(count)
+            raise DeadlineExceededError(f"deadline passed before the {self.name} queue")
+
+    def submit(self, item, deadline: float = None) -> Future:
+        """Queue one item and return a future for its result"""
+        future = Future()
+        with self._cond:
+            if not self._running:
+                raise RuntimeError(f"{self.name} batcher is not running")
+            now = time.monotonic()
+            self._check_deadline(now, deadline)
+            if len(self._pending) >= self.max_queue:
+                raise QueueFullError(f"{self.name} queue is full ({self.max_queue} requests waiting)")
+            self._push(item, future, now, deadline)
+            self._depth_changed()
+            self._cond.notify()
+        return future
+
+    def submit_many(self, items, deadline: float = None) -> list:
+        """Queue several items back to back (e.g. the tiles of one image); all or none are queued"""
+        futures = [Future() for _ in items]
+        with self._cond:
+            if not self._running:
+                raise RuntimeError(f"{self.name} batcher is not running")
+            now = time.monotonic()
+            self._check_deadline(now, deadline, len(futures))
+            if len(self._pending) + len(futures) > self.max_queue:
+                raise QueueFullError(f"{self.name} queue cannot take {len(futures)} more requests")
+            for item, future in zip(items, futures):
+                self._push(item, future, now, deadline)
+            self._depth_changed()
+            self._cond.notify()
+        return futures
+
+    async def infer(self, item, deadline: float = None):
+        """Queue one item and wait for its result without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(item, deadline))
+
+    async def infer_many(self, items, deadline: float = None) -> list:
+        """Queue several items together and wait for all of their results"""
+        futures = self.submit_many(items, deadline)
+        try:
+            return await asyncio.gather(*map(asyncio.wrap_future, futures))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _next_batch(self):
+        """Block until a batch is ready; returns None once the batcher is stopped"""
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+            if not self._running:
+                return None
+
+            # Give concurrent requests a short window to join the oldest one, but flush
+            # while a batch can still finish before the nearest deadline
+            while self._running and self._pending and len(self._pending) < self.max_batch_size:
+                oldest = min(entry[4] for entry in self._pending)
+                nearest = min((entry[5] for entry in self._pending if entry[5] is not None), default=float("inf"))
+                remaining = min(oldest + self.max_wait, nearest - self.estimated_batch_seconds) - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, shed = [], 0
+            now = time.monotonic()
+            while self._pending and len(batch) < self.max_batch_size:
+                _, _, item, future, enqueued_at, deadline = heapq.heappop(self._pending)
+                # Callers that went away while queued are dropped before inference
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if deadline is not None and deadline <= now:
+                    future.set_exception(DeadlineExceededError(f"deadline passed in the {self.name} queue"))
+                    shed += 1
+                    continue
+                batch.append((item, future, enqueued_at))
+            self._depth_changed()
+            self._shed(shed)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            if self.on_batch is not None:
+                self.on_batch([started - enqueued_at for _, _, enqueued_at in batch])
+
+            try:
+                results = self.infer_batch([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                self._observe_batch_time(time.monotonic() - started)
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
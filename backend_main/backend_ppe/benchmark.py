@@ -0,0 +1,331 @@
+"""
+Benchmarks for the PPE detection service.
+
+Usage:
+    python benchmark.py decode photos/ --repeat 5
+    python benchmark.py cascade photos/ --labels labels/ --person-model yolov8n.pt
+    python benchmark.py workers photos/p0.jpg --workers 1 2 4 --launchers prefork uvicorn
+    python benchmark.py raw photos/ --size 640
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+# Modules shared with the hazard service live in backend_main/shared
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from shared.worker_benchmark import Service, compare_launchers
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def collect_images(paths):
+    """Expand files and folders into a sorted list of image paths"""
+    images = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            images.extend(p for p in sorted(path.iterdir()) if p.suffix.lower() in IMAGE_SUFFIXES)
+        elif path.exists():
+            images.append(path)
+    return images
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (Linux reports KB)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+# ===========================
+# Decode benchmark
+# ===========================
+def decode_legacy(image_bytes: bytes, target_size: int):
+    """The original ppe_scan decode: full-resolution PIL -> NumPy -> cvtColor"""
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    image_array = np.array(Image.open(BytesIO(image_bytes)))
+    if len(image_array.shape) == 3 and image_array.shape[2] == 3:
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+    return image_array
+
+
+def decode_fast(image_bytes: bytes, target_size: int):
+    """Header-driven scaled decode used by main.py"""
+    from image_decode import decode_bgr
+    return decode_bgr(image_bytes, target_size)
+
+
+DECODERS = {"legacy": decode_legacy, "fast": decode_fast}
+
+
+def run_decoder(name, payloads, target_size, repeat, queue):
+    """Child process body: time one decoder and report its own peak RSS growth"""
+    import cv2  # noqa: F401  (imported before the baseline so it is not counted)
+    import numpy  # noqa: F401
+    import PIL.Image  # noqa: F401
+    import image_decode  # noqa: F401
+
+    decoder = DECODERS[name]
+    baseline = peak_rss_mb()
+    timings = []
+    shapes = set()
+    for _ in range(repeat):
+        for payload in payloads:
+            start = time.perf_counter()
+            image = decoder(payload, target_size)
+            timings.append((time.perf_counter() - start) * 1000)
+            shapes.add(image.shape)
+            del image
+    queue.put({
+        "name": name,
+        "mean_ms": statistics.mean(timings),
+        "p95_ms": sorted(timings)[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0],
+        "peak_rss_growth_mb": peak_rss_mb() - baseline,
+        "shapes": sorted(shapes)[:3],
+    })
+
+
+def benchmark_decode(args):
+    images = collect_images(args.images)
+    if not images:
+        print("❌ No images found")
+        return
+    payloads = [path.read_bytes() for path in images]
+    print(f"📷 {len(payloads)} images, {sum(map(len, payloads)) / 1e6:.1f} MB total, "
+          f"target size {args.target_size}, {args.repeat} repeats")
+
+    # Each decoder runs in a fresh process so peak RSS is not shared between them
+    ctx = multiprocessing.get_context("spawn")
+    for name in DECODERS:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_decoder, args=(name, payloads, args.target_size, args.repeat, queue))
+        proc.start()
+        stats = queue.get()
+        proc.join()
+        print(f"  {stats['name']:>7}: mean {stats['mean_ms']:7.1f} ms | p95 {stats['p95_ms']:7.1f} ms | "
+              f"peak RSS +{stats['peak_rss_growth_mb']:6.1f} MB | output {stats['shapes']}")
+
+
+# ===========================
+# Raw frame ingest benchmark
+# ===========================
+def time_ms(fn, payload, repeat: int) -> float:
+    """Mean milliseconds of `fn(payload)`"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(payload)
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def benchmark_raw(args):
+    import cv2
+    from image_decode import decode_bgr
+    from shared.raw_frame import pack_frame, to_bgr
+
+    images = collect_images(args.images)
+    if not images:
+        print("❌ No images found")
+        return
+    print(f"📷 {len(images)} images resized to {args.size} px on the long side, {args.repeat} repeats")
+    for path in images:
+        image = cv2.imread(str(path))
+        height, width = image.shape[:2]
+        scale = args.size / max(height, width)
+        frame = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        payloads = {
+            "jpeg": cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, args.jpeg_quality])[1].tobytes(),
+            "raw bgr": pack_frame(frame, "bgr"),
+            "raw rgb": pack_frame(frame[:, :, ::-1], "rgb"),
+            "raw gray": pack_frame(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), "gray"),
+        }
+        print(f"  {path.name} ({frame.shape[1]}x{frame.shape[0]})")
+        for name, payload in payloads.items():
+            decode = (lambda data: decode_bgr(data, args.size)) if name == "jpeg" else to_bgr
+            print(f"    {name:>8}: {len(payload) / 1024:8.1f} KB | to BGR {time_ms(decode, payload, args.repeat):7.3f} ms")
+
+
+# ===========================
+# Cascade benchmark
+# ===========================
+def load_yolo_labels(label_path: Path, width: int, height: int):
+    """(class ids, xyxy boxes in pixels) from a YOLO-format label file"""
+    import numpy as np
+
+    rows = np.loadtxt(label_path, ndmin=2) if label_path.exists() else np.zeros((0, 5))
+    if rows.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 4))
+    cx, cy, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+    return rows[:, 0].astype(np.int64), np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+def count_matches(detections, gt_cls, gt_xyxy, iou_threshold=0.5) -> int:
+    """Ground-truth boxes matched by a same-class detection at IoU >= threshold"""
+    import torch
+    from torchvision.ops import box_iou
+
+    if len(gt_cls) == 0 or len(detections.cls) == 0:
+        return 0
+    iou = box_iou(torch.from_numpy(gt_xyxy).float(), torch.from_numpy(detections.xyxy).float()).numpy()
+    iou[gt_cls[:, None] != detections.cls[None, :]] = 0
+    matched = 0
+    used = set()
+    for row in iou:
+        for det in row.argsort()[::-1]:
+            if row[det] < iou_threshold:
+                break
+            if det not in used:
+                used.add(det)
+                matched += 1
+                break
+    return matched
+
+
+def run_full_frame(model, image_bytes: bytes, imgsz: int):
+    """Baseline: decode for `imgsz` and run one full-frame pass; returns (detections, model pixels)"""
+    from compliance import Detections
+    from image_decode import decode_bgr
+
+    image = decode_bgr(image_bytes, imgsz)
+    result = model(image, imgsz=imgsz, verbose=False)[0]
+    return Detections.from_result(result), image.shape[:2], imgsz * imgsz
+
+
+def run_cascade(model, person_model, person_mask, image_bytes: bytes, args):
+    """Person detector at low resolution, then the PPE model on full-resolution crops"""
+    from cascade import crop_images, crop_windows, merge_crop_detections, person_detections
+    from compliance import Detections
+    from image_decode import decode_bgr
+
+    image = decode_bgr(image_bytes, 0)
+    height, width = image.shape[:2]
+    stage_one = Detections.from_result(person_model(image, imgsz=args.person_imgsz, verbose=False)[0])
+    persons = person_detections(stage_one, person_mask, args.person_min_conf)
+    windows = crop_windows(persons.xyxy, persons.conf, width, height, args.padding, args.max_persons)
+    pixels = args.person_imgsz ** 2
+    if not windows:
+        result = model(image, imgsz=args.imgsz, verbose=False)[0]
+        return Detections.from_result(result), (height, width), pixels + args.imgsz ** 2
+    results = model(crop_images(image, windows), imgsz=args.cascade_imgsz, verbose=False)
+    detections = merge_crop_detections([Detections.from_result(r) for r in results], windows)
+    return detections, (height, width), pixels + len(windows) * args.cascade_imgsz ** 2
+
+
+def benchmark_cascade(args):
+    from compliance import person_class_mask
+    from inference_engine import load_model
+
+    images = collect_images(args.images)
+    if not images:
+        print("❌ No images found")
+        return
+    payloads = [path.read_bytes() for path in images]
+    model, names, _ = load_model(args.weights, engine=args.engine, imgsz=args.imgsz)
+    person_model, person_names, _ = load_model(args.person_model, engine=args.engine, imgsz=args.person_imgsz)
+    person_mask = person_class_mask(person_names)
+    ppe_mask = ~person_class_mask(names)
+
+    modes = {
+        f"full-frame@{args.imgsz}": lambda data: run_full_frame(model, data, args.imgsz),
+        f"full-frame@{args.hires_imgsz}": lambda data: run_full_frame(model, data, args.hires_imgsz),
+        f"cascade@{args.cascade_imgsz}": lambda data: run_cascade(model, person_model, person_mask, data, args),
+    }
+    print(f"📷 {len(payloads)} images | person detector {args.person_imgsz} px | "
+          f"labels: {args.labels or 'none (recall not measured)'}")
+
+    for name, run in modes.items():
+        run(payloads[0])  # warm-up
+        timings, pixels, found, matched, total = [], [], 0, 0, 0
+        for path, payload in zip(images, payloads):
+            start = time.perf_counter()
+            detections, (height, width), model_pixels = run(payload)
+            timings.append((time.perf_counter() - start) * 1000)
+            pixels.append(model_pixels)
+            keep = ppe_mask[detections.cls]
+            found += int(keep.sum())
+            if args.labels:
+                gt_cls, gt_xyxy = load_yolo_labels(Path(args.labels) / f"{path.stem}.txt", width, height)
+                gt_keep = ppe_mask[gt_cls]
+                matched += count_matches(detections, gt_cls[gt_keep], gt_xyxy[gt_keep])
+                total += int(gt_keep.sum())
+        recall = f"{matched / total:6.1%}" if total else "   n/a"
+        print(f"  {name:>18}: mean {statistics.mean(timings):7.1f} ms | "
+              f"model input {statistics.mean(pixels) / 1e6:5.2f} MP/image | "
+              f"PPE boxes {found / len(payloads):5.1f}/image | recall {recall}")
+
+
+# ===========================
+# Worker-count benchmark
+# ===========================
+def benchmark_workers(args):
+    images = collect_images([args.image])
+    if not images:
+        print("❌ No image found")
+        return
+    print(f"📷 {images[0].name} | {args.concurrency} clients x {args.duration:g} s | {os.cpu_count()} CPUs")
+    service = Service(os.path.dirname(os.path.abspath(__file__)), "main:app", "PPE_WORKERS", "/", "/ppe-scan",
+                      {"department": args.department},
+                      # Every request sends the same photo, which the detection cache would answer
+                      {"PPE_CACHE_SIZE": "0"})
+    compare_launchers(service, images[0].read_bytes(), args.launchers, args.workers, args.port, args.timeout,
+                      args.concurrency, args.duration, unit="scans/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PPE service benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    decode_parser = subparsers.add_parser("decode", help="compare full-resolution and scaled JPEG decoding")
+    decode_parser.add_argument("images", nargs="+", help="image files or folders")
+    decode_parser.add_argument("--target-size", type=int, default=640, help="model input size")
+    decode_parser.add_argument("--repeat", type=int, default=3, help="passes over the image set")
+    decode_parser.set_defaults(func=benchmark_decode)
+
+    cascade_parser = subparsers.add_parser("cascade", help="compare full-frame inference with the person-crop cascade")
+    cascade_parser.add_argument("images", nargs="+", help="image files or folders")
+    cascade_parser.add_argument("--labels", help="folder of YOLO-format .txt labels (same stem as each image) to measure recall")
+    cascade_parser.add_argument("--weights", default="model/yolov8s_custom.pt", help="PPE model weights")
+    cascade_parser.add_argument("--person-model", default="yolov8n.pt", help="stage-one person detector")
+    cascade_parser.add_argument("--engine", default="torch", help="torch, onnx or openvino")
+    cascade_parser.add_argument("--imgsz", type=int, default=640, help="standard full-frame input size")
+    cascade_parser.add_argument("--hires-imgsz", type=int, default=1280, help="high-resolution full-frame input size")
+    cascade_parser.add_argument("--person-imgsz", type=int, default=320, help="person detector input size")
+    cascade_parser.add_argument("--person-min-conf", type=float, default=0.3, help="minimum person confidence")
+    cascade_parser.add_argument("--cascade-imgsz", type=int, default=800, help="PPE model input size for crops")
+    cascade_parser.add_argument("--padding", type=float, default=0.15, help="crop padding as a fraction of the box")
+    cascade_parser.add_argument("--max-persons", type=int, default=16, help="crops per image")
+    cascade_parser.set_defaults(func=benchmark_cascade)
+
+    workers_parser = subparsers.add_parser("workers", help="memory and throughput of the API versus worker count")
+    workers_parser.add_argument("image", help="image sent with every request")
+    workers_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to test")
+    workers_parser.add_argument("--launchers", nargs="+", default=["prefork", "uvicorn"], choices=["prefork", "uvicorn"],
+                                help="prefork.py (shared model) and/or uvicorn --workers (model per worker)")
+    workers_parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    workers_parser.add_argument("--duration", type=float, default=20, help="seconds of load per configuration")
+    workers_parser.add_argument("--department", default="mining", help="department sent with each scan")
+    workers_parser.add_argument("--port", type=int, default=8899, help="port for the benchmarked server")
+    workers_parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the server to start")
+    workers_parser.set_defaults(func=benchmark_workers)
+
+    raw_parser = subparsers.add_parser("raw", help="payload size and decode time of JPEG uploads versus raw frames")
+    raw_parser.add_argument("images", nargs="+", help="image files or folders")
+    raw_parser.add_argument("--size", type=int, default=640, help="long side of the frames a device would send")
+    raw_parser.add_argument("--jpeg-quality", type=int, default=90, help="JPEG quality of the compared upload")
+    raw_parser.add_argument("--repeat", type=int, default=50, help="decodes timed per payload")
+    raw_parser.set_defaults(func=benchmark_raw)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Two-stage person-crop cascade for PPE detection.
+
+A small COCO detector finds workers on a low-resolution view of the photo.
+Each worker box is padded and cropped from the full-resolution decode, and
+all crops go through the PPE model in one batch at a higher input size.
+A helmet that is 20 px wide after shrinking the whole 4000 px frame to
+640 px stays 100+ px wide inside a 640 px worker crop, so small items are
+found without running the PPE model over the full frame at high resolution.
+"""
+
+import numpy as np
+
+from compliance import Detections
+from tiling import merge_detections
+
+
+def person_detections(detections: Detections, person_mask: np.ndarray, min_conf: float = 0.25) -> Detections:
+    """Keep the confident person boxes of a stage-one pass"""
+    keep = person_mask[detections.cls] & (detections.conf >= min_conf)
+    return Detections(detections.xyxy[keep], detections.conf[keep], detections.cls[keep])
+
+
+def crop_windows(person_xyxy: np.ndarray, person_conf: np.ndarray, width: int, height: int,
+                 padding: float = 0.15, max_crops: int = 16):
+    """Padded, clipped (x0, y0, x1, y1) crops around the most confident persons
+
+    Parameters:
+        person_xyxy (ndarray) -- (N, 4) person boxes in full-resolution pixels
+        person_conf (ndarray) -- (N,) confidences used to pick the crops kept under `max_crops`
+        padding (float)       -- margin added on every side, as a fraction of the box size
+    """
+    order = np.argsort(-person_conf, kind="stable")[:max(0, max_crops)]
+    boxes = person_xyxy[order]
+    pad = (boxes[:, 2:] - boxes[:, :2]) * padding
+    x0y0 = np.floor(np.maximum(boxes[:, :2] - pad, 0))
+    x1y1 = np.ceil(np.minimum(boxes[:, 2:] + pad, (width, height)))
+    windows = np.hstack([x0y0, x1y1]).astype(int)
+    # Drop degenerate crops (boxes entirely outside the frame)
+    windows = windows[(windows[:, 2] > windows[:, 0] + 1) & (windows[:, 3] > windows[:, 1] + 1)]
+    return [tuple(window) for window in windows.tolist()]
+
+
+def crop_images(image: np.ndarray, windows) -> list:
+    """Crop views into the full-resolution image (no pixel copies)"""
+    return [image[y0:y1, x0:x1] for x0, y0, x1, y1 in windows]
+
+
+def merge_crop_detections(crop_detections, windows, persons: Detections = None,
+                          person_class_id: int = None, iou_threshold: float = 0.5) -> Detections:
+    """Map crop detections back to the image and merge duplicates from overlapping crops
+
+    When `person_class_id` is given, the stage-one person boxes are added under
+    that PPE-model class so per-worker scoring can use them.
+    """
+    extra = []
+    if persons is not None and person_class_id is not None and len(persons.cls):
+        extra.append(persons._replace(cls=np.full(len(persons.cls), person_class_id, dtype=np.int64)))
+    return merge_detections(crop_detections, windows, iou_threshold, extra=extra)
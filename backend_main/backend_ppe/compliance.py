@@ -0,0 +1,226 @@
+"""
+Compiled PPE compliance rules.
+
+The rules file maps PPE categories to lists of raw YOLO class names and each
+(site, department, set) to the categories it requires. It is compiled once
+against `model.names`: every category becomes one bit, every class id gets
+the bits of the categories it proves, and every set becomes a required mask.
+Scoring a frame is then an OR over the detected class ids and
+`missing = required & ~present`.
+
+Per-worker scoring attributes each PPE box to the person box that contains
+it, using one containment matrix per image instead of nested loops.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+class Detections(NamedTuple):
+    """Raw detections of one image as plain NumPy arrays"""
+    xyxy: np.ndarray   # (N, 4) float32 boxes in image pixels
+    conf: np.ndarray   # (N,) float32 confidences
+    cls: np.ndarray    # (N,) int64 class ids
+
+    @classmethod
+    def from_result(cls, result) -> "Detections":
+        """Copy the boxes of an ultralytics `Results` object to the CPU once"""
+        boxes = result.boxes
+        return cls(
+            xyxy=boxes.xyxy.cpu().numpy().astype(np.float32, copy=False),
+            conf=boxes.conf.cpu().numpy().astype(np.float32, copy=False),
+            cls=boxes.cls.cpu().numpy().astype(np.int64),
+        )
+
+
+class PPESetRule(NamedTuple):
+    """One compiled (site, department, set) requirement"""
+    department: str
+    name: str
+    categories: tuple      # required categories in display order
+    bits: np.ndarray       # (len(categories),) uint64 bit of each category
+    required: int          # OR of `bits`
+
+
+class CompiledRules(NamedTuple):
+    """Rules file compiled against the model's class ids; looked up in O(1) per request"""
+    categories: tuple      # category name per bit position
+    class_bits: np.ndarray  # (num_classes,) uint64 category bits proven by each class id
+    sets: dict             # (site, department, set) -> PPESetRule
+    set_names: dict        # (site, department) -> set names, the first one is the default
+    departments: dict      # site -> department names
+    aliases: dict          # (site, lowercased name) -> department
+    sites: frozenset       # sites with their own rules ("" is the global rule set)
+
+
+MAX_CATEGORIES = 64
+
+
+def is_negative_class(class_name: str) -> bool:
+    """True for "no-helmet" style classes that report a missing item"""
+    lower = class_name.lower()
+    return "no-" in lower or "no_" in lower or lower.startswith("no ")
+
+
+def negative_class_mask(class_names: dict) -> np.ndarray:
+    """Boolean mask over class ids marking the "no-" variants"""
+    mask = np.zeros(len(class_names), dtype=bool)
+    for class_id, name in class_names.items():
+        mask[class_id] = is_negative_class(name)
+    return mask
+
+
+def compile_class_bits(categories: dict, class_names: dict) -> np.ndarray:
+    """Category bits per class id from {category: [class name variants]}"""
+    negative_mask = negative_class_mask(class_names)
+    class_bits = np.zeros(len(class_names), dtype=np.uint64)
+    for bit, variants in enumerate(categories.values()):
+        variants = set(variants)
+        for class_id, name in class_names.items():
+            if name in variants and not negative_mask[class_id]:
+                class_bits[class_id] |= np.uint64(1 << bit)
+    return class_bits
+
+
+def compile_rules(rules: dict, class_names: dict) -> CompiledRules:
+    """Compile a parsed rules file; raises ValueError when it is inconsistent
+
+    Each site inherits the global departments and aliases and may add sets or
+    replace them by name. Rules are shared between sites, not copied.
+    """
+    categories = rules.get("categories") or {}
+    if not categories:
+        raise ValueError("Rules define no PPE categories")
+    if len(categories) > MAX_CATEGORIES:
+        raise ValueError(f"At most {MAX_CATEGORIES} PPE categories are supported, got {len(categories)}")
+    category_bits = {name: 1 << bit for bit, name in enumerate(categories)}
+
+    def compile_sets(site, departments, sets, set_names):
+        for department, dept_sets in departments.items():
+            if not dept_sets:
+                raise ValueError(f"Department '{department}' ({site or 'global'}) has no PPE sets")
+            names = list(set_names.get((site, department), ()))
+            for set_name, required in dept_sets.items():
+                unknown = [c for c in required if c not in category_bits]
+                if unknown:
+                    raise ValueError(f"Set '{department}/{set_name}' uses unknown categories: {', '.join(unknown)}")
+                bits = np.array([category_bits[c] for c in required], dtype=np.uint64)
+                sets[(site, department, set_name)] = PPESetRule(
+                    department, set_name, tuple(required), bits, int(np.bitwise_or.reduce(bits, initial=np.uint64(0)))
+                )
+                if set_name not in names:
+                    names.append(set_name)
+            set_names[(site, department)] = tuple(names)
+
+    sets, set_names, aliases = {}, {}, {}
+    compile_sets("", rules.get("departments") or {}, sets, set_names)
+    for alias, department in (rules.get("department_aliases") or {}).items():
+        aliases[("", alias.lower())] = department
+    departments = {"": tuple(dict.fromkeys(dept for _, dept in set_names))}
+
+    global_sets = dict(sets)
+    global_set_names = dict(set_names)
+    for site, site_rules in (rules.get("sites") or {}).items():
+        # Start from the global rules, then apply the site's own sets
+        for (_, department, set_name), rule in global_sets.items():
+            sets[(site, department, set_name)] = rule
+        for (_, department), names in global_set_names.items():
+            set_names[(site, department)] = names
+        compile_sets(site, site_rules.get("departments") or {}, sets, set_names)
+        for alias, department in (site_rules.get("department_aliases") or {}).items():
+            aliases[(site, alias.lower())] = department
+        departments[site] = tuple(dict.fromkeys([*departments[""], *(site_rules.get("departments") or {})]))
+
+    for (site, alias), department in aliases.items():
+        if (site, department) not in set_names and ("", department) not in set_names:
+            raise ValueError(f"Alias '{alias}' points to unknown department '{department}'")
+
+    return CompiledRules(
+        categories=tuple(categories),
+        class_bits=compile_class_bits(categories, class_names),
+        sets=sets,
+        set_names=set_names,
+        departments=departments,
+        aliases=aliases,
+        sites=frozenset(departments),
+    )
+
+
+def present_mask(class_bits: np.ndarray, class_ids: np.ndarray) -> int:
+    """Bits of every category proven by the detected class ids of one image"""
+    return int(np.bitwise_or.reduce(class_bits[class_ids], initial=np.uint64(0)))
+
+
+def category_flags(rule: PPESetRule, present: int) -> list:
+    """Presence of each required category of `rule`, in display order"""
+    return [bool(present & int(bit)) for bit in rule.bits]
+
+
+def category_confidences(rule: PPESetRule, class_bits: np.ndarray, detections: Detections) -> list:
+    """Highest confidence of a detection proving each required category of `rule` (0 when absent)"""
+    if not len(detections.cls):
+        return [0.0] * len(rule.bits)
+    proven = (class_bits[detections.cls][None, :] & rule.bits[:, None]) != 0
+    return np.where(proven, detections.conf[None, :], 0).max(axis=1).astype(float).tolist()
+
+
+# ===========================
+# Per-worker compliance
+# ===========================
+PERSON_CLASS_NAMES = {"person", "worker", "people", "human"}
+
+
+def person_class_mask(class_names: dict) -> np.ndarray:
+    """Boolean mask over class ids marking person/worker classes"""
+    mask = np.zeros(len(class_names), dtype=bool)
+    for class_id, name in class_names.items():
+        mask[class_id] = name.lower() in PERSON_CLASS_NAMES
+    return mask
+
+
+def assign_items_to_persons(person_boxes: np.ndarray, item_boxes: np.ndarray,
+                            min_containment: float = 0.5) -> np.ndarray:
+    """Index of the person box each PPE box belongs to, -1 when no person covers enough of it
+
+    Builds the (persons, items) containment matrix (intersection / item area)
+    in one broadcast. When workers overlap and several person boxes contain an
+    item equally, the one with the higher IoU (the tighter fit) wins.
+    """
+    if len(person_boxes) == 0 or len(item_boxes) == 0:
+        return np.full(len(item_boxes), -1, dtype=np.intp)
+
+    persons = person_boxes[:, None, :]
+    items = item_boxes[None, :, :]
+    inter_w = np.minimum(persons[..., 2], items[..., 2]) - np.maximum(persons[..., 0], items[..., 0])
+    inter_h = np.minimum(persons[..., 3], items[..., 3]) - np.maximum(persons[..., 1], items[..., 1])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+
+    item_area = (items[..., 2] - items[..., 0]) * (items[..., 3] - items[..., 1])
+    person_area = (persons[..., 2] - persons[..., 0]) * (persons[..., 3] - persons[..., 1])
+    containment = inter / np.maximum(item_area, 1e-6)
+    iou = inter / np.maximum(person_area + item_area - inter, 1e-6)
+
+    best = np.argmax(containment + 1e-3 * iou, axis=0)
+    covered = containment[best, np.arange(len(item_boxes))] >= min_containment
+    return np.where(covered, best, -1)
+
+
+def present_masks_per_person(class_bits: np.ndarray, detections: Detections,
+                             person_mask: np.ndarray, min_containment: float = 0.5):
+    """Per-person category bits for one image
+
+    Returns (person_indices, masks, unassigned): indices of the person
+    detections, the (persons,) uint64 category bits proven inside each
+    person box, and the number of PPE boxes that could not be attributed
+    to anyone.
+    """
+    is_person = person_mask[detections.cls]
+    persons = np.flatnonzero(is_person)
+    item_bits = class_bits[detections.cls]
+    items = np.flatnonzero((item_bits != 0) & ~is_person)
+
+    owners = assign_items_to_persons(detections.xyxy[persons], detections.xyxy[items], min_containment)
+    assigned = owners >= 0
+    masks = np.zeros(len(persons), dtype=np.uint64)
+    np.bitwise_or.at(masks, owners[assigned], item_bits[items][assigned])
+    return persons, masks, int((~assigned).sum())
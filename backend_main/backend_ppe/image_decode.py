@@ -0,0 +1,89 @@
+"""
+Fast image decoding for PPE scans.
+
+Phone cameras upload 12-48 MP photos, but YOLO letterboxes every frame to
+~640 px. For JPEGs we read the header first and let libjpeg decode at 1/2,
+1/4 or 1/8 scale in the DCT domain (`cv2.IMREAD_REDUCED_COLOR_*`), picking
+the smallest scale that still covers the model input size. OpenCV returns
+BGR directly, so the only extra copy is an EXIF rotation when one is needed.
+"""
+
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# libjpeg scale factor -> OpenCV reduced-decode flag
+REDUCED_COLOR_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    1: cv2.IMREAD_COLOR,
+}
+
+
+def read_header(image_bytes: bytes):
+    """Return (format, width, height, exif_orientation) without decoding pixels"""
+    with Image.open(BytesIO(image_bytes)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        return img.format, img.width, img.height, orientation
+
+
+def pick_scale(width: int, height: int, target_size: int) -> int:
+    """Largest libjpeg scale factor that keeps the long side at or above `target_size`"""
+    if not target_size:
+        return 1
+    long_side = max(width, height)
+    for scale in (8, 4, 2):
+        if long_side // scale >= target_size:
+            return scale
+    return 1
+
+
+def apply_orientation(image: np.ndarray, orientation: int) -> np.ndarray:
+    """Rotate/flip a decoded array according to its EXIF orientation tag"""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def decode_with_pil(image_bytes: bytes, target_size: int = 640) -> np.ndarray:
+    """Fallback for formats OpenCV cannot read; still uses JPEG draft mode when possible"""
+    with Image.open(BytesIO(image_bytes)) as img:
+        if target_size:
+            img.draft("RGB", (target_size, target_size))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+
+
+def decode_bgr(image_bytes: bytes, target_size: int = 640) -> np.ndarray:
+    """Decode uploaded bytes into an upright BGR array no smaller than needed for `target_size`
+
+    Parameters:
+        image_bytes (bytes) -- encoded image (JPEG, PNG, WebP, ...)
+        target_size (int)   -- model input size; 0 decodes at full resolution
+    """
+    image_format, width, height, orientation = read_header(image_bytes)
+
+    scale = pick_scale(width, height, target_size) if image_format == "JPEG" else 1
+    flags = REDUCED_COLOR_FLAGS[scale] | cv2.IMREAD_IGNORE_ORIENTATION
+
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+    if image is None:
+        return decode_with_pil(image_bytes, target_size)
+    return apply_orientation(image, orientation)
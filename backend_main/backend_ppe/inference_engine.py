@@ -0,0 +1,164 @@
+"""
+Selectable CPU inference engines for the PPE YOLO model.
+
+`torch` runs the .pt weights in eager PyTorch. `onnx` and `openvino` export
+the weights once (next to the .pt file, reused until the .pt changes) and run
+them through ONNX Runtime or OpenVINO. Ultralytics wraps both runtimes in the
+same predictor, so letterboxing, NMS and the `Results` objects we score are
+identical to the PyTorch path.
+
+With `int8=True` the exported model is statically quantized to INT8,
+calibrated on the images in a local folder: ONNX Runtime QDQ quantization
+for `onnx`, NNCF post-training quantization for `openvino`.
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+ENGINES = ("torch", "onnx", "openvino")
+CALIBRATION_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def is_fresh(artifact: Path, weights: Path) -> bool:
+    """An exported artifact is reused while it is newer than the weights it came from"""
+    return artifact.exists() and artifact.stat().st_mtime >= weights.stat().st_mtime
+
+
+def calibration_images(calibration_dir: str, imgsz: int, limit: int):
+    """Yield letterboxed, normalized (1, 3, imgsz, imgsz) float32 tensors from a folder of photos"""
+    from ultralytics.data.augment import LetterBox
+
+    if not calibration_dir or not os.path.isdir(calibration_dir):
+        raise FileNotFoundError(f"INT8 calibration needs a folder of sample images, got '{calibration_dir}'")
+
+    letterbox = LetterBox((imgsz, imgsz), auto=False)
+    paths = sorted(p for p in Path(calibration_dir).iterdir() if p.suffix.lower() in CALIBRATION_SUFFIXES)
+    if not paths:
+        raise FileNotFoundError(f"No calibration images found in '{calibration_dir}'")
+
+    for path in paths[:limit]:
+        image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        image = letterbox(image=image)
+        # Same preprocessing as the ultralytics predictor: BGR->RGB, HWC->CHW, 0-1 range
+        tensor = np.ascontiguousarray(image[..., ::-1].transpose(2, 0, 1), dtype=np.float32) / 255.0
+        yield tensor[None]
+
+
+def export_onnx(weights: Path, imgsz: int) -> Path:
+    artifact = weights.with_suffix(".onnx")
+    if not is_fresh(artifact, weights):
+        print(f"🔄 Exporting {weights.name} to ONNX (one-time)...")
+        # Dynamic axes so the micro-batcher can send any batch size
+        YOLO(str(weights)).export(format="onnx", imgsz=imgsz, dynamic=True)
+    return artifact
+
+
+def export_openvino(weights: Path, imgsz: int) -> Path:
+    artifact = weights.parent / f"{weights.stem}_openvino_model"
+    if not is_fresh(artifact, weights):
+        print(f"🔄 Exporting {weights.name} to OpenVINO IR (one-time)...")
+        YOLO(str(weights)).export(format="openvino", imgsz=imgsz, dynamic=True)
+    return artifact
+
+
+def quantize_onnx(model_path: Path, calibration_dir: str, imgsz: int, limit: int) -> Path:
+    """Static INT8 (QDQ) quantization of the convolution layers with ONNX Runtime"""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    artifact = model_path.with_name(f"{model_path.stem}_int8.onnx")
+    if is_fresh(artifact, model_path):
+        return artifact
+
+    class FolderReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter({"images": tensor} for tensor in calibration_images(calibration_dir, imgsz, limit))
+
+        def get_next(self):
+            return next(self.batches, None)
+
+    print(f"🔄 Calibrating INT8 ONNX model on images from {calibration_dir}...")
+    quantize_static(
+        str(model_path),
+        str(artifact),
+        FolderReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        # Detection head maths (DFL softmax, sigmoid, box decoding) stays in FP32
+        op_types_to_quantize=["Conv"],
+    )
+    return artifact
+
+
+def quantize_openvino(model_dir: Path, calibration_dir: str, imgsz: int, limit: int) -> Path:
+    """Post-training INT8 quantization of an OpenVINO IR with NNCF"""
+    import nncf
+    import openvino as ov
+
+    artifact = model_dir.parent / model_dir.name.replace("_openvino_model", "_int8_openvino_model")
+    if is_fresh(artifact, model_dir):
+        return artifact
+
+    print(f"🔄 Calibrating INT8 OpenVINO model on images from {calibration_dir}...")
+    xml_path = next(model_dir.glob("*.xml"))
+    ov_model = ov.Core().read_model(str(xml_path))
+    dataset = nncf.Dataset(list(calibration_images(calibration_dir, imgsz, limit)))
+    quantized = nncf.quantize(
+        ov_model,
+        dataset,
+        preset=nncf.QuantizationPreset.MIXED,
+        # Same ops ultralytics leaves in FP32 for its own INT8 export
+        ignored_scope=nncf.IgnoredScope(types=["Multiply", "Subtract", "Sigmoid"]),
+    )
+    artifact.mkdir(parents=True, exist_ok=True)
+    ov.save_model(quantized, str(artifact / xml_path.name))
+    shutil.copy(model_dir / "metadata.yaml", artifact / "metadata.yaml")
+    return artifact
+
+
+def load_model(weights_path: str, engine: str = "torch", imgsz: int = 640, int8: bool = False,
+               calibration_dir: str = None, calibration_limit: int = 100):
+    """Load the YOLO model for the requested engine; returns (model, class_names, artifact_path)
+
+    Parameters:
+        weights_path (str)    -- trained .pt weights
+        engine (str)          -- one of ENGINES
+        imgsz (int)           -- model input size used for export and calibration
+        int8 (bool)           -- quantize the exported model (onnx/openvino only)
+        calibration_dir (str) -- folder of representative photos for INT8 calibration
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown inference engine '{engine}'. Choose one of: {', '.join(ENGINES)}")
+    if engine == "torch":
+        if int8:
+            print("⚠️  INT8 is only available for the onnx and openvino engines; using FP32 PyTorch")
+        model = YOLO(weights_path)
+        return model, model.names, weights_path
+
+    weights = Path(weights_path)
+    if not weights.exists():
+        # Fetches the default weights so there is something to export
+        YOLO(weights_path)
+
+    if engine == "onnx":
+        artifact = export_onnx(weights, imgsz)
+        if int8:
+            artifact = quantize_onnx(artifact, calibration_dir, imgsz, calibration_limit)
+    else:
+        artifact = export_openvino(weights, imgsz)
+        if int8:
+            artifact = quantize_openvino(artifact, calibration_dir, imgsz, calibration_limit)
+
+    model = YOLO(str(artifact), task="detect")
+    # Exported models only expose class names once the runtime session exists,
+    # and creating it here keeps that cost out of the first request
+    model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+    return model, model.predictor.model.names, str(artifact)
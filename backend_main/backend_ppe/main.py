@@ -1,18 +1,37 @@
+import asyncio
+import json
+import logging
 import os
-from io import BytesIO
+import sys
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import partial
+from typing import List
 
-import cv2
 import numpy as np
 import torch
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, FastAPI, File, Form, Header, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 # Load environment variables
 load_dotenv()
 
+# Modules shared with the hazard service live in backend_main/shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Per-scan details are logged at DEBUG; set PPE_LOG_LEVEL=DEBUG to see them
+logging.basicConfig(
+    level=os.getenv("PPE_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("ppe")
+
 # Monkey-patch torch.load to use weights_only=False for compatibility with older YOLO models
 _original_torch_load = torch.load
 def patched_torch_load(*args, **kwargs):
@@ -20,129 +39,121 @@ def patched_torch_load(*args, **kwargs):
     return _original_torch_load(*args, **kwargs)
 torch.load = patched_torch_load
 
-from ultralytics import YOLO
-
-# Department-based PPE Requirements
-DEPARTMENT_PPE_SETS = {
-    "mining_operations": {
-        "set_a_basic": {
-            "helmet": ["Helmet", "helmet", "hardhat", "hard-hat"],
-            "gloves": ["Gloves", "glove"],
-            "vest": ["Vest", "Safety-Vest", "vest", "jacket", "safety-vest"],
-            "eye_protection": ["Goggles", "goggles", "Glasses", "glasses", "Glass", "glass", "eyewear"],
-            "safety_boots": ["Safety-Boot", "Shoes", "shoes", "boots", "boot"]
-        },
-        "set_b_dust_drilling": {
-            "helmet": ["Helmet", "helmet", "hardhat", "hard-hat"],
-            "gloves": ["Gloves", "glove"],
-            "vest": ["Vest", "Safety-Vest", "vest", "jacket", "safety-vest"],
-            "eye_protection": ["Goggles", "goggles", "Glasses", "glasses", "Glass", "glass", "eyewear"],
-            "safety_boots": ["Safety-Boot", "Shoes", "shoes", "boots", "boot"],
-            "protective_suit": ["Suit", "suit", "coverall", "overall"]
-        }
-    },
-    "blasting": {
-        "set_a_mandatory": {
-            "helmet": ["Helmet", "helmet", "hardhat", "hard-hat"],
-            "gloves": ["Gloves", "glove"],
-            "vest": ["Vest", "Safety-Vest", "vest", "jacket", "safety-vest"],
-            "eye_protection": ["Goggles", "goggles", "Glasses", "glasses", "Glass", "glass", "eyewear"],
-            "safety_boots": ["Safety-Boot", "Shoes", "shoes", "boots", "boot"]
-        },
-        "set_b_full_protection": {
-            "helmet": ["Helmet", "helmet", "hardhat", "hard-hat"],
-            "gloves": ["Gloves", "glove"],
-            "vest": ["Vest", "Safety-Vest", "vest", "jacket", "safety-vest"],
-            "eye_protection": ["Goggles", "goggles", "Glasses", "glasses", "Glass", "glass", "eyewear"],
-            "safety_boots": ["Safety-Boot", "Shoes", "shoes", "boots", "boot"],
-            "protective_suit": ["Suit", "suit", "coverall", "overall"]
-        }
-    },
-    "equipment_maintenance": {
-        "set_a_standard": {
-            "helmet": ["Helmet", "helmet", "hardhat", "hard-hat"],
-            "gloves": ["Gloves", "glove"],
-            "eye_protection": ["Goggles", "goggles", "Glasses", "glasses", "Glass", "glass", "eyewear"],
-            "safety_boots": ["Safety-Boot", "Shoes", "shoes", "boots", "boot"]
-        },
-        "set_b_chemical_oil": {
-            "helmet": ["Helmet", "helmet", "hardhat", "hard-hat"],
-            "gloves": ["Gloves", "glove"],
-            "eye_protection": ["Goggles", "goggles", "Glasses", "glasses", "Glass", "glass", "eyewear"],
-            "safety_boots": ["Safety-Boot", "Shoes", "shoes", "boots", "boot"],
-            "protective_suit": ["Suit", "suit", "coverall", "overall"],
-            "vest": ["Vest", "Safety-Vest", "vest", "jacket", "safety-vest"]
-        }
-    },
-    "safety_inspection": {
-        "set_a_inspection": {
-            "helmet": ["Helmet", "helmet", "hardhat", "hard-hat"],
-            "vest": ["Vest", "Safety-Vest", "vest", "jacket", "safety-vest"],
-            "safety_boots": ["Safety-Boot", "Shoes", "shoes", "boots", "boot"]
-        },
-        "set_b_risky_zone": {
-            "helmet": ["Helmet", "helmet", "hardhat", "hard-hat"],
-            "vest": ["Vest", "Safety-Vest", "vest", "jacket", "safety-vest"],
-            "safety_boots": ["Safety-Boot", "Shoes", "shoes", "boots", "boot"],
-            "eye_protection": ["Goggles", "goggles", "Glasses", "glasses", "Glass", "glass", "eyewear"],
-            "gloves": ["Gloves", "glove"]
-        }
-    }
-}
-
-# Department name mapping (friendly names to backend keys)
-DEPARTMENT_NAME_MAPPING = {
-    # Exact matches
-    "mining_operations": "mining_operations",
-    "blasting": "blasting",
-    "equipment_maintenance": "equipment_maintenance",
-    "safety_inspection": "safety_inspection",
-    # Friendly name mappings
-    "mining operations": "mining_operations",
-    "mining": "mining_operations",
-    "blasting operations": "blasting",
-    "blast": "blasting",
-    "equipment": "equipment_maintenance",
-    "maintenance": "equipment_maintenance",
-    "safety": "safety_inspection",
-    "inspection": "safety_inspection",
-    "test department": "mining_operations",  # Default for test users
-    "default": "mining_operations",
-}
-
-def normalize_department(department: str) -> str:
-    """Normalize department name to backend format"""
-    dept_lower = department.lower().strip()
-    return DEPARTMENT_NAME_MAPPING.get(dept_lower, dept_lower)
+from batching import DeadlineExceededError, MicroBatcher, QueueFullError
+from cascade import crop_images, crop_windows, merge_crop_detections, person_detections
+from compliance import (
+    Detections, category_confidences, category_flags, person_class_mask, present_mask, present_masks_per_person
+)
+from image_decode import decode_bgr
+from inference_engine import load_model
+from metrics import (
+    BATCH_SIZE, IN_FLIGHT, QUALITY_REJECTIONS, QUEUE_DEPTH, REQUEST_SECONDS, REQUESTS_TOTAL, SHED_REQUESTS,
+    TIER_IMAGE_SECONDS, TIER_SCANS, UPLOAD_REJECTIONS, observe_stage, observe_yolo_speed, stage_timer
+)
+from shared.metrics_export import render_latest
+from shared.raw_frame import RawFrameError, read_header as read_raw_header, to_bgr as raw_frame_to_bgr
+from shared.quality import PoorImageQuality, QualityThresholds, assess_quality, retake_response
+from result_cache import DetectionCache, content_hash
+from streaming import StreamSession, VideoFrameSampler
+from rules import RulesStore
+from scan_log import ScanLog, ShiftCalendar
+from tiers import TierSelector, build_ladder, parse_sizes
+from tiling import merge_detections, slice_image, tile_windows
+from shared.upload_stream import UploadLimits, image_upload_route
 
-# Helper function to get PPE requirements for a department/set
-def get_ppe_requirements(department: str, ppe_set: str = None):
-    """
-    Get PPE requirements for a specific department and set.
-    If ppe_set is not specified, returns the first set (basic/mandatory/standard).
-    """
-    # Normalize department name
-    department = normalize_department(department)
-    
-    if department not in DEPARTMENT_PPE_SETS:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid department. Valid departments: {', '.join(DEPARTMENT_PPE_SETS.keys())}"
-        )
-    
-    dept_sets = DEPARTMENT_PPE_SETS[department]
-    
-    # If no set specified, use the first available set
-    if ppe_set is None:
-        ppe_set = list(dept_sets.keys())[0]
-    
-    if ppe_set not in dept_sets:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid PPE set for {department}. Valid sets: {', '.join(dept_sets.keys())}"
-        )
-    
-    return dept_sets[ppe_set]
+# Micro-batching settings for YOLO inference
+MAX_BATCH_SIZE = int(os.getenv("PPE_MAX_BATCH_SIZE", 8))
+MAX_BATCH_WAIT_MS = float(os.getenv("PPE_MAX_BATCH_WAIT_MS", 10))
+
+# Worker pool and backpressure settings
+DECODE_WORKERS = int(os.getenv("PPE_DECODE_WORKERS", 2))
+MAX_PENDING_SCANS = int(os.getenv("PPE_MAX_PENDING_SCANS", 32))
+RETRY_AFTER_SECONDS = int(os.getenv("PPE_RETRY_AFTER_SECONDS", 2))
+MAX_FILES_PER_BATCH = int(os.getenv("PPE_MAX_FILES_PER_BATCH", 50))
+# Largest frame accepted by /ppe-scan/raw (width x height)
+RAW_MAX_PIXELS = int(os.getenv("PPE_RAW_MAX_PIXELS", 1920 * 1080))
+# Uploads to /ppe-scan and /ppe-scan/batch are vetted while they stream in (0 = no limit)
+MAX_UPLOAD_BYTES = int(os.getenv("PPE_MAX_UPLOAD_BYTES", 32 * 1024 * 1024))
+MAX_UPLOAD_PIXELS = int(os.getenv("PPE_MAX_UPLOAD_PIXELS", 50_000_000))
+# Deadline for scans that do not send X-Deadline-Ms / deadline_ms (0 = none)
+DEFAULT_DEADLINE_MS = float(os.getenv("PPE_DEFAULT_DEADLINE_MS", 0))
+
+# Inference engine: torch (eager PyTorch), onnx (ONNX Runtime) or openvino
+INFERENCE_ENGINE = os.getenv("PPE_ENGINE", "torch").lower()
+USE_INT8 = os.getenv("PPE_INT8", "false").lower() in ("1", "true", "yes")
+CALIBRATION_DIR = os.getenv("PPE_CALIBRATION_DIR")
+MODEL_IMGSZ = int(os.getenv("PPE_IMGSZ", 640))
+
+# Images are decoded just large enough for this model input size (0 = full resolution)
+DECODE_SIZE = int(os.getenv("PPE_DECODE_SIZE", MODEL_IMGSZ))
+
+# Load-adaptive tiers for standard scans: input sizes of the main model, then of an optional
+# smaller model with the same classes; the most accurate tier meeting the latency SLO is used
+TIER_SIZES = parse_sizes(os.getenv("PPE_TIER_SIZES", ",".join(
+    str(size) for size in (MODEL_IMGSZ, 480, 320) if size <= MODEL_IMGSZ
+)))
+FAST_MODEL_PATH = os.getenv("PPE_FAST_MODEL")
+FAST_TIER_SIZES = parse_sizes(os.getenv("PPE_FAST_TIER_SIZES", "320"))
+LATENCY_SLO_MS = float(os.getenv("PPE_LATENCY_SLO_MS", 1000))
+
+# Detection cache for retried uploads (0 entries disables it)
+CACHE_SIZE = int(os.getenv("PPE_CACHE_SIZE", 256))
+CACHE_TTL_SECONDS = float(os.getenv("PPE_CACHE_TTL_SECONDS", 300))
+
+# Sliced inference (mode=sliced): overlapping full-resolution tiles for small items
+TILE_SIZE = int(os.getenv("PPE_TILE_SIZE", 640))
+TILE_OVERLAP = float(os.getenv("PPE_TILE_OVERLAP", 0.2))
+# The tiles of one scan are queued together, so they must fit in the batching queue
+MAX_TILES = max(1, min(int(os.getenv("PPE_MAX_TILES", 16)), MAX_PENDING_SCANS - 1))
+TILE_FULL_FRAME = os.getenv("PPE_TILE_FULL_FRAME", "true").lower() in ("1", "true", "yes")
+TILE_NMS_IOU = float(os.getenv("PPE_TILE_NMS_IOU", 0.5))
+
+# Person-crop cascade (mode=cascade): a cheap person detector picks the workers,
+# then the PPE model runs on full-resolution crops of them at a larger input size
+CASCADE_ENABLED = os.getenv("PPE_CASCADE", "false").lower() in ("1", "true", "yes")
+PERSON_MODEL_PATH = os.getenv("PPE_PERSON_MODEL", "yolov8n.pt")
+PERSON_IMGSZ = int(os.getenv("PPE_PERSON_IMGSZ", 320))
+PERSON_MIN_CONF = float(os.getenv("PPE_PERSON_MIN_CONF", 0.3))
+CASCADE_IMGSZ = int(os.getenv("PPE_CASCADE_IMGSZ", 800))
+CASCADE_PADDING = float(os.getenv("PPE_CASCADE_PADDING", 0.15))
+CASCADE_MAX_PERSONS = max(1, min(int(os.getenv("PPE_CASCADE_MAX_PERSONS", 16)), MAX_PENDING_SCANS - 1))
+
+# Per-worker mode: share of a PPE box that must lie inside a person box to count for that worker
+PERSON_MIN_CONTAINMENT = float(os.getenv("PPE_PERSON_MIN_CONTAINMENT", 0.5))
+
+# Video / frame-stream scanning
+STREAM_SAMPLE_FPS = float(os.getenv("PPE_STREAM_SAMPLE_FPS", 5))
+STREAM_WINDOW = int(os.getenv("PPE_STREAM_WINDOW", 8))
+STREAM_MIN_FRAMES = int(os.getenv("PPE_STREAM_MIN_FRAMES", 3))
+STREAM_PRESENCE_RATIO = float(os.getenv("PPE_STREAM_PRESENCE_RATIO", 0.5))
+STREAM_TRACK_IOU = float(os.getenv("PPE_STREAM_TRACK_IOU", 0.3))
+STREAM_MAX_MISSED = int(os.getenv("PPE_STREAM_MAX_MISSED", 5))
+MAX_STREAMS = int(os.getenv("PPE_MAX_STREAMS", 4))
+VIDEO_MAX_FRAMES = int(os.getenv("PPE_VIDEO_MAX_FRAMES", 900))
+# Video frames run a model batch at a time, and never more than the pending-scan limit can admit
+VIDEO_CHUNK_FRAMES = max(1, min(MAX_BATCH_SIZE, MAX_PENDING_SCANS))
+
+# Department/set requirements, reloaded when the file changes
+RULES_FILE = os.getenv("PPE_RULES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ppe_rules.json"))
+RULES_POLL_SECONDS = float(os.getenv("PPE_RULES_POLL_SECONDS", 2))
+
+# Local scan history for supervisor dashboards (empty path disables it)
+SCAN_LOG_PATH = os.getenv("PPE_SCAN_LOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan_log.sqlite3"))
+SHIFTS = os.getenv("PPE_SHIFTS", "morning=06:00,night=18:00")
+SCAN_LOG_QUEUE = int(os.getenv("PPE_SCAN_LOG_QUEUE", 10000))
+STATS_DEFAULT_DAYS = int(os.getenv("PPE_STATS_DEFAULT_DAYS", 7))
+
+# Image quality gate: uploads too dark, overexposed or blurred to scan get a
+# "retake photo" answer instead of a model pass (a threshold of 0 disables that check)
+QUALITY_GATE = os.getenv("PPE_QUALITY_GATE", "true").lower() in ("1", "true", "yes")
+QUALITY_SIZE = int(os.getenv("PPE_QUALITY_SIZE", 320))
+QUALITY_THRESHOLDS = QualityThresholds(
+    min_brightness=float(os.getenv("PPE_QUALITY_MIN_BRIGHTNESS", 30)),
+    max_brightness=float(os.getenv("PPE_QUALITY_MAX_BRIGHTNESS", 240)),
+    max_dark_fraction=float(os.getenv("PPE_QUALITY_MAX_DARK_FRACTION", 0.85)),
+    max_clipped_fraction=float(os.getenv("PPE_QUALITY_MAX_CLIPPED_FRACTION", 0.4)),
+    min_sharpness=float(os.getenv("PPE_QUALITY_MIN_SHARPNESS", 15)),
+)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -160,22 +171,285 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Image upload endpoints parse their multipart body as it streams in (shared/upload_stream.py)
+image_uploads = APIRouter(route_class=image_upload_route(UploadLimits(
+    max_file_bytes=MAX_UPLOAD_BYTES,
+    max_pixels=MAX_UPLOAD_PIXELS,
+    max_files=MAX_FILES_PER_BATCH,
+    on_reject=lambda reason: UPLOAD_REJECTIONS.labels(reason).inc(),
+)))
+
 # Load YOLOv8 model from local path or use default
 model_path = os.path.join(os.path.dirname(__file__), "model", "yolov8s_custom.pt")
 
 if os.path.exists(model_path):
-    print(f"🔄 Loading custom YOLO model from {model_path}...")
-    model = YOLO(model_path)
+    print(f"🔄 Loading custom YOLO model from {model_path} ({INFERENCE_ENGINE} engine)...")
 else:
     print(f"⚠️  Custom model not found at {model_path}")
-    print("🔄 Loading default YOLOv8s model (will download if needed)...")
-    model = YOLO("yolov8s.pt")  # Will auto-download if not present
-    
+    print(f"🔄 Loading default YOLOv8s model ({INFERENCE_ENGINE} engine, will download if needed)...")
+    model_path = "yolov8s.pt"  # Will auto-download if not present
+
+model, MODEL_NAMES, model_artifact = load_model(
+    model_path,
+    engine=INFERENCE_ENGINE,
+    imgsz=MODEL_IMGSZ,
+    int8=USE_INT8,
+    calibration_dir=CALIBRATION_DIR
+)
+
+def describe_model_version(path: str) -> str:
+    """Identify the loaded weights so cached detections never outlive a model swap"""
+    if os.getenv("PPE_MODEL_VERSION"):
+        return os.getenv("PPE_MODEL_VERSION")
+    try:
+        stat = os.stat(path)
+        return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        return os.path.basename(path)
+
+MODEL_VERSION = describe_model_version(model_path)
+if INFERENCE_ENGINE != "torch":
+    MODEL_VERSION += f"+{INFERENCE_ENGINE}{'-int8' if USE_INT8 else ''}"
+
 print("✅ Model loaded successfully!")
-print(f"📋 Model has {len(model.names)} classes")
-for idx, name in model.names.items():
+print(f"📋 Model has {len(MODEL_NAMES)} classes")
+for idx, name in MODEL_NAMES.items():
     print(f"  Class {idx}: {name}")
 
+# Rules compiled against the model's class ids (category bitmasks per class and per set)
+rules_store = RulesStore(RULES_FILE, MODEL_NAMES, poll_seconds=RULES_POLL_SECONDS)
+print(f"📐 Loaded {len(rules_store.current.sets)} PPE sets from {RULES_FILE}")
+PERSON_CLASS_MASK = person_class_mask(MODEL_NAMES)
+# PPE-model class used for cascade person boxes (None if the model has no person class)
+PERSON_CLASS_ID = int(np.flatnonzero(PERSON_CLASS_MASK)[0]) if PERSON_CLASS_MASK.any() else None
+
+# Smaller model (e.g. yolov8n trained on the same classes) for the fastest tiers
+if FAST_MODEL_PATH:
+    print(f"🔄 Loading fast model {FAST_MODEL_PATH} for the low-latency tiers...")
+    fast_model, FAST_MODEL_NAMES, _ = load_model(FAST_MODEL_PATH, engine=INFERENCE_ENGINE, imgsz=max(FAST_TIER_SIZES))
+    if dict(FAST_MODEL_NAMES) != dict(MODEL_NAMES):
+        raise ValueError(f"PPE_FAST_MODEL {FAST_MODEL_PATH} must have the same classes as the main model")
+    FAST_MODEL_VERSION = describe_model_version(FAST_MODEL_PATH)
+    print("✅ Fast model loaded")
+
+tier_selector = TierSelector(
+    build_ladder(TIER_SIZES, FAST_TIER_SIZES if FAST_MODEL_PATH else ()),
+    slo_seconds=LATENCY_SLO_MS / 1000.0
+)
+print(f"🎚️  Inference tiers: {', '.join(tier.name for tier in tier_selector.ladder)} (SLO {LATENCY_SLO_MS:g} ms)")
+
+# Stage-one person detector for the cascade (COCO weights, downloaded if needed)
+if CASCADE_ENABLED:
+    print(f"🔄 Loading person detector {PERSON_MODEL_PATH} for cascade mode...")
+    person_model, PERSON_MODEL_NAMES, _ = load_model(PERSON_MODEL_PATH, engine=INFERENCE_ENGINE, imgsz=PERSON_IMGSZ)
+    PERSON_MODEL_MASK = person_class_mask(PERSON_MODEL_NAMES)
+    print(f"✅ Person detector loaded ({PERSON_IMGSZ} px, crops at {CASCADE_IMGSZ} px)")
+
+def warm_up_models():
+    """Run one dummy image through the PyTorch models so their fused layers and
+    predictors exist before prefork.py forks the workers (and are shared by them)"""
+    blank = np.zeros((MODEL_IMGSZ, MODEL_IMGSZ, 3), dtype=np.uint8)
+    model(blank, imgsz=MODEL_IMGSZ, verbose=False)
+    if FAST_MODEL_PATH:
+        fast_model(blank, imgsz=max(FAST_TIER_SIZES), verbose=False)
+    if CASCADE_ENABLED:
+        person_model(blank, imgsz=PERSON_IMGSZ, verbose=False)
+
+def run_yolo_batch(items, yolo=None, model_key="main"):
+    """Run queued (BGR image, input size) items through YOLO, one forward pass per input size"""
+    yolo = yolo or model
+    detections = [None] * len(items)
+    for imgsz in sorted({size for _, size in items}):
+        indices = [i for i, (_, size) in enumerate(items) if size == imgsz]
+        BATCH_SIZE.observe(len(indices))
+        start = time.perf_counter()
+        results = yolo([items[i][0] for i in indices], imgsz=imgsz, verbose=False)
+        # Per-image model time drives the tier selection
+        seconds_per_image = (time.perf_counter() - start) / len(indices)
+        tier_selector.observe(model_key, imgsz, seconds_per_image)
+        TIER_IMAGE_SECONDS.labels(f"{model_key}@{imgsz}").observe(seconds_per_image)
+        for i, result in zip(indices, results):
+            observe_yolo_speed(result.speed)
+            detections[i] = Detections.from_result(result)
+    return detections
+
+def run_person_batch(images):
+    """Stage one of the cascade: low-resolution person detection"""
+    with stage_timer("person_detection"):
+        return [
+            Detections.from_result(result)
+            for result in person_model(images, imgsz=PERSON_IMGSZ, verbose=False)
+        ]
+
+def record_queue_wait(waits):
+    """Batcher hook: time each image spent queued before its batch started"""
+    for wait in waits:
+        observe_stage("queue_wait", wait)
+
+# All /ppe-scan requests share one queue in front of the model
+ppe_batcher = MicroBatcher(
+    run_yolo_batch,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_BATCH_WAIT_MS,
+    max_queue=MAX_PENDING_SCANS,
+    name="ppe",
+    on_batch=record_queue_wait,
+    on_depth=QUEUE_DEPTH.labels("ppe").set,
+    on_shed=SHED_REQUESTS.labels("queue").inc
+)
+
+# The fast model has its own queue and worker thread
+fast_batcher = MicroBatcher(
+    lambda items: run_yolo_batch(items, fast_model, "fast"),
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_BATCH_WAIT_MS,
+    max_queue=MAX_PENDING_SCANS,
+    name="fast",
+    on_batch=record_queue_wait,
+    on_depth=QUEUE_DEPTH.labels("fast").set,
+    on_shed=SHED_REQUESTS.labels("queue").inc
+) if FAST_MODEL_PATH else None
+
+# The person detector has its own queue and worker thread
+person_batcher = MicroBatcher(
+    run_person_batch,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_BATCH_WAIT_MS,
+    max_queue=MAX_PENDING_SCANS,
+    name="person",
+    on_depth=QUEUE_DEPTH.labels("person").set,
+    on_shed=SHED_REQUESTS.labels("queue").inc
+) if CASCADE_ENABLED else None
+
+# Image decoding runs on its own threads so the event loop stays responsive
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="ppe-decode")
+
+# Raw detections keyed by upload content, shared across departments and retries
+detection_cache = DetectionCache(max_entries=CACHE_SIZE, ttl_seconds=CACHE_TTL_SECONDS)
+
+# /ppe-scan inference modes
+SCAN_MODES = ("standard", "sliced", "cascade")
+
+# Video files are read on their own threads, one per active stream
+video_pool = ThreadPoolExecutor(max_workers=MAX_STREAMS, thread_name_prefix="ppe-video")
+
+# Open video uploads and WebSocket streams (event loop only)
+active_streams = 0
+
+# Scored scans are appended to the scan log by a background writer
+scan_log = ScanLog(SCAN_LOG_PATH, ShiftCalendar(SHIFTS), max_queue=SCAN_LOG_QUEUE) if SCAN_LOG_PATH else None
+
+# Scans admitted but not yet answered (decoding, queued or in inference).
+# Only touched from the event loop, so no lock is needed.
+pending_scans = 0
+
+def server_busy_error() -> HTTPException:
+    """503 response telling the client when to retry"""
+    return HTTPException(
+        status_code=503,
+        detail="PPE scanner is busy. Please retry shortly.",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+def deadline_exceeded_error() -> HTTPException:
+    """504 response for a scan whose client deadline passed before it reached the model"""
+    return HTTPException(
+        status_code=504,
+        detail="Scan deadline passed before the image could be analysed. Please scan again."
+    )
+
+def request_deadline(request: Request, header_ms, form_ms):
+    """time.monotonic() deadline from X-Deadline-Ms or deadline_ms (milliseconds the client will
+    wait, counted from when the request arrived), PPE_DEFAULT_DEADLINE_MS, or None"""
+    budget_ms = header_ms if header_ms is not None else form_ms
+    if budget_ms is None and DEFAULT_DEADLINE_MS > 0:
+        budget_ms = DEFAULT_DEADLINE_MS
+    if budget_ms is None:
+        return None
+    if budget_ms <= 0:
+        raise HTTPException(status_code=400, detail="deadline_ms must be a positive number of milliseconds.")
+    received_at = getattr(request.state, "received_at", None) or time.monotonic()
+    return received_at + budget_ms / 1000.0
+
+def check_deadline(deadline, count: int = 1):
+    """Shed a scan at admission when its deadline has already passed"""
+    if deadline is not None and time.monotonic() >= deadline:
+        SHED_REQUESTS.labels("admission").inc(count)
+        raise deadline_exceeded_error()
+
+def decode_image(image_bytes: bytes, size: int = DECODE_SIZE) -> np.ndarray:
+    """Decode uploaded image bytes into an upright BGR array sized for YOLO"""
+    with stage_timer("decode"):
+        return decode_bgr(image_bytes, size)
+
+def check_image_quality(image: np.ndarray):
+    """Raise PoorImageQuality when a decoded upload is too dark, overexposed or blurred to scan"""
+    if not QUALITY_GATE:
+        return
+    with stage_timer("quality_check"):
+        report = assess_quality(image, QUALITY_THRESHOLDS, QUALITY_SIZE)
+    if report.problems:
+        for problem in report.problems:
+            QUALITY_REJECTIONS.labels(problem).inc()
+        raise PoorImageQuality(report)
+
+def decode_scan_image(image_bytes: bytes, size: int = DECODE_SIZE) -> np.ndarray:
+    """Decode an upload for /ppe-scan and pass it through the quality gate (size 0 = full resolution)"""
+    image = decode_image(image_bytes, size)
+    check_image_quality(image)
+    return image
+
+def decode_raw_scan_image(frame: bytes, size: int = DECODE_SIZE) -> np.ndarray:
+    """BGR view of a /ppe-scan/raw body (already sized by the device) after the quality gate"""
+    with stage_timer("decode"):
+        image = raw_frame_to_bgr(frame, RAW_MAX_PIXELS)
+    check_image_quality(image)
+    return image
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """End-to-end latency and status counts for the scan endpoints"""
+    if not request.url.path.startswith("/ppe-scan"):
+        return await call_next(request)
+    # Client deadlines count from here, before the upload is read
+    request.state.received_at = time.monotonic()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUEST_SECONDS.labels(request.url.path).observe(time.perf_counter() - start)
+        REQUESTS_TOTAL.labels(request.url.path, str(status)).inc()
+
+@app.on_event("startup")
+def start_batcher():
+    """Start the inference batching worker"""
+    ppe_batcher.start()
+    rules_store.start()
+    if fast_batcher is not None:
+        fast_batcher.start()
+    if scan_log is not None:
+        scan_log.start()
+    if person_batcher is not None:
+        person_batcher.start()
+    print(f"📦 Batching up to {MAX_BATCH_SIZE} images, waiting at most {MAX_BATCH_WAIT_MS:g} ms")
+
+@app.on_event("shutdown")
+def stop_batcher():
+    """Stop the inference batching worker"""
+    ppe_batcher.stop()
+    rules_store.stop()
+    if fast_batcher is not None:
+        fast_batcher.stop()
+    if scan_log is not None:
+        scan_log.stop()
+    if person_batcher is not None:
+        person_batcher.stop()
+    decode_pool.shutdown(wait=False)
+    video_pool.shutdown(wait=False)
+
 @app.get("/")
 def health_check():
     """Health check endpoint"""
@@ -183,33 +457,363 @@ def health_check():
         "status": "running",
         "message": "PPE Detection API is online",
         "endpoint": "/ppe-scan",
-        "model_classes": model.names
+        "batch_endpoint": "/ppe-scan/batch",
+        "raw_endpoint": "/ppe-scan/raw",
+        "model_version": MODEL_VERSION,
+        "inference_engine": {
+            "engine": INFERENCE_ENGINE,
+            "int8": USE_INT8 and INFERENCE_ENGINE != "torch",
+            "artifact": os.path.basename(model_artifact)
+        },
+        "model_classes": MODEL_NAMES,
+        "rules": rules_store.info(),
+        "active_streams": active_streams,
+        "scan_modes": [mode for mode in SCAN_MODES if mode != "cascade" or CASCADE_ENABLED],
+        "inference_tiers": tier_selector.info(),
+        "scan_log": scan_log.info() if scan_log is not None else None,
+        "quality_gate": {"size": QUALITY_SIZE, **QUALITY_THRESHOLDS._asdict()} if QUALITY_GATE else None,
+        "upload_limits": {"max_bytes": MAX_UPLOAD_BYTES, "max_pixels": MAX_UPLOAD_PIXELS},
+        "detection_cache": detection_cache.stats()
     }
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: per-stage latency histograms, queue depth and in-flight scans"""
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/departments")
-def get_departments():
+def get_departments(site: str = ""):
     """
     List all available departments and their PPE sets
     """
+    rules = rules_store.current
+    site = site if site in rules.sites else ""
     departments_info = {}
-    for dept, sets in DEPARTMENT_PPE_SETS.items():
+    for dept in rules.departments[site]:
+        set_names = rules.set_names[(site, dept)]
         departments_info[dept] = {
-            "available_sets": list(sets.keys()),
+            "available_sets": list(set_names),
             "ppe_requirements": {
-                set_name: list(set_config.keys())
-                for set_name, set_config in sets.items()
+                set_name: list(rules.sets[(site, dept, set_name)].categories)
+                for set_name in set_names
             }
         }
     return {
         "departments": departments_info,
-        "total_departments": len(DEPARTMENT_PPE_SETS)
+        "total_departments": len(departments_info)
+    }
+
+def check_scan_log_enabled():
+    if scan_log is None:
+        raise HTTPException(status_code=404, detail="The scan log is disabled on this server (PPE_SCAN_LOG).")
+
+def stats_date_range(since: str, until: str) -> tuple:
+    """Validated (since, until) shift dates; the last PPE_STATS_DEFAULT_DAYS days by default"""
+    check_scan_log_enabled()
+    try:
+        until = datetime.strptime(until, "%Y-%m-%d").date() if until else date.today()
+        since = datetime.strptime(since, "%Y-%m-%d").date() if since else until - timedelta(days=STATS_DEFAULT_DAYS - 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be given as YYYY-MM-DD.")
+    return since.isoformat(), until.isoformat()
+
+def stats_department(department: str) -> str:
+    """Department filter with the same aliases as /ppe-scan"""
+    if not department:
+        return ""
+    name = department.lower().strip()
+    return rules_store.current.aliases.get(("", name)) or name
+
+@app.get("/stats/departments")
+def get_department_stats(since: str = "", until: str = "", site: str = None):
+    """Scans, compliance rate, latency and missing items per site and department over a range of shift dates"""
+    since, until = stats_date_range(since, until)
+    departments = scan_log.department_stats(since, until, site)
+    return {"since": since, "until": until, "departments": departments}
+
+@app.get("/stats/shifts")
+def get_shift_stats(since: str = "", until: str = "", department: str = "", site: str = None):
+    """The same figures per shift, site and department, newest shift first"""
+    since, until = stats_date_range(since, until)
+    shifts = scan_log.shift_stats(since, until, stats_department(department), site)
+    return {"since": since, "until": until, "shifts": shifts}
+
+@app.get("/stats/scans")
+def get_recent_scans(department: str = "", since: float = None, limit: int = 100):
+    """Most recent logged scans, optionally for one department and after a unix timestamp"""
+    check_scan_log_enabled()
+    scans = scan_log.recent_scans(stats_department(department), since, min(max(limit, 1), 1000))
+    return {"scans": scans, "count": len(scans)}
+
+def check_per_person_supported():
+    if not PERSON_CLASS_MASK.any():
+        raise HTTPException(
+            status_code=400,
+            detail="Per-person mode needs a model with a person/worker class."
+        )
+
+def score_workers(detections: Detections, rule, class_bits: np.ndarray) -> dict:
+    """Per-person compliance: each PPE box counts only for the worker whose box contains it"""
+    persons, masks, unassigned = present_masks_per_person(
+        class_bits, detections, PERSON_CLASS_MASK, PERSON_MIN_CONTAINMENT
+    )
+    presence = (masks[:, None] & rule.bits[None, :]) != 0
+    
+    # Number workers left to right so the list matches the photo
+    order = np.argsort(detections.xyxy[persons, 0], kind="stable")
+    boxes = detections.xyxy[persons].astype(float).round(1).tolist()
+    confidences = detections.conf[persons].astype(float).round(4).tolist()
+    compliant = presence.all(axis=1)
+    
+    workers = []
+    for worker_id, row in enumerate(order.tolist(), start=1):
+        workers.append({
+            "worker_id": worker_id,
+            "box": boxes[row],
+            "confidence": confidences[row],
+            "ppe_items": dict(zip(rule.categories, presence[row].tolist())),
+            "missing": [ppe_type for ppe_type, ok in zip(rule.categories, presence[row]) if not ok],
+            "is_compliant": bool(compliant[row])
+        })
+    
+    return {
+        "workers": workers,
+        "worker_summary": {
+            "total_workers": len(workers),
+            "compliant_workers": int(compliant.sum()),
+            "unassigned_items": unassigned
+        }
     }
 
-@app.post("/ppe-scan")
+def score_ppe_result(detections: Detections, rule, class_bits: np.ndarray, per_person: bool = False) -> dict:
+    """Turn the detections of one image into the department-specific /ppe-scan response"""
+    with stage_timer("scoring"):
+        present = present_mask(class_bits, detections.cls)
+        missing_bits = rule.required & ~present
+        workers = score_workers(detections, rule, class_bits) if per_person else None
+    
+    ppe_results = {
+        ppe_type: {"required": True, "present": is_present}
+        for ppe_type, is_present in zip(rule.categories, category_flags(rule, present))
+    }
+    
+    # Calculate compliance
+    total_required = len(ppe_results)
+    total_present = total_required - bin(missing_bits).count("1")
+    compliance_percentage = (total_present / total_required * 100) if total_required > 0 else 0
+    is_compliant = compliance_percentage == 100
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        # Summarize raw detections per class rather than per box
+        class_ids, counts = np.unique(detections.cls, return_counts=True)
+        detected_classes = [f"{MODEL_NAMES[int(c)]} x{n}" for c, n in zip(class_ids, counts)]
+        missing = [ppe_type for ppe_type, data in ppe_results.items() if not data["present"]]
+        logger.debug(
+            "Department: %s | Set: %s | Raw detections: %s | Missing: %s | Compliance: %.1f%% (%d/%d)",
+            rule.department, rule.name, ", ".join(detected_classes) or "None", ", ".join(missing) or "None",
+            compliance_percentage, total_present, total_required
+        )
+    
+    response = {
+        "department": rule.department,
+        "ppe_set": rule.name,
+        "ppe_items": ppe_results,
+        "compliance": {
+            "is_compliant": is_compliant,
+            "percentage": round(compliance_percentage, 1),
+            "items_present": total_present,
+            "items_required": total_required
+        }
+    }
+    if workers is not None:
+        response.update(workers)
+    return response
+
+def log_scan(response: dict, rule, detections: Detections, class_bits: np.ndarray, site: str,
+             started: float, mode: str = "standard", tier=None):
+    """Append a scored scan to the scan log (no-op when the log is disabled)"""
+    if scan_log is None:
+        return
+    worker_summary = response.get("worker_summary") or {}
+    scan_log.record(
+        time.time(), site, rule.department, rule.name, rule.categories,
+        [item["present"] for item in response["ppe_items"].values()],
+        category_confidences(rule, class_bits, detections),
+        (time.perf_counter() - started) * 1000, mode, tier.name if tier is not None else None,
+        worker_summary.get("total_workers"), worker_summary.get("compliant_workers")
+    )
+
+def resolve_ppe_set(rules, department: str, ppe_set: str = None, site: str = ""):
+    """
+    Get the compiled PPE rule for a site/department/set.
+    If ppe_set is not specified, the department's first set (basic/mandatory/standard) is used.
+    Sites without their own rules use the global ones.
+    """
+    site = site if site in rules.sites else ""
+    
+    # Normalize department name (friendly names to backend keys)
+    dept_lower = department.lower().strip()
+    department = rules.aliases.get((site, dept_lower)) or rules.aliases.get(("", dept_lower)) or dept_lower
+    
+    set_names = rules.set_names.get((site, department))
+    if set_names is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid department. Valid departments: {', '.join(rules.departments[site])}"
+        )
+    
+    # If no set specified, use the first available set
+    rule = rules.sets.get((site, department, ppe_set or set_names[0]))
+    if rule is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid PPE set for {department}. Valid sets: {', '.join(set_names)}"
+        )
+    return rule
+
+def parse_tier(tier: str):
+    """The requested InferenceTier, or None for automatic selection"""
+    if not tier or tier.lower() == "auto":
+        return None
+    if tier not in tier_selector.by_name:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid tier. Valid tiers: auto, {', '.join(tier_selector.by_name)}"
+        )
+    return tier_selector.by_name[tier]
+
+def select_tier(requested=None, deadline=None):
+    """Tier for one standard scan: the requested one, or the most accurate one the current load
+    and the client's deadline allow. Scans that cannot make their deadline on any tier are shed."""
+    queued = ppe_batcher.depth + (fast_batcher.depth if fast_batcher is not None else 0)
+    # This scan is already counted in pending_scans
+    scans_ahead = max(pending_scans - 1, queued)
+    budget = None if deadline is None else deadline - time.monotonic()
+    if requested is not None:
+        tier, choice = requested, "override"
+    else:
+        tier, choice = tier_selector.choose(scans_ahead, budget), "auto"
+    if budget is not None:
+        predicted = tier_selector.predict(tier, scans_ahead)
+        if budget <= 0 or (predicted is not None and predicted > budget):
+            SHED_REQUESTS.labels("admission").inc()
+            raise deadline_exceeded_error()
+    TIER_SCANS.labels(tier.name, choice).inc()
+    return tier
+
+async def run_detection(image_bytes: bytes, tier=None, deadline=None, decode=decode_scan_image) -> Detections:
+    """Decode an uploaded image on the decode pool and run it through the batched model"""
+    tier = tier or tier_selector.ladder[0]
+    # Smaller tiers need less pixels, so the JPEG can be decoded at a smaller scale
+    decode_size = min(DECODE_SIZE, tier.imgsz) if DECODE_SIZE else 0
+    loop = asyncio.get_running_loop()
+    image_array = await loop.run_in_executor(decode_pool, decode, image_bytes, decode_size)
+    
+    # Run YOLO inference (batched with concurrent requests)
+    batcher = fast_batcher if tier.model == "fast" else ppe_batcher
+    try:
+        return await batcher.infer((image_array, tier.imgsz), deadline)
+    except QueueFullError:
+        raise server_busy_error()
+    except DeadlineExceededError:
+        raise deadline_exceeded_error()
+
+async def run_sliced_detection(image_bytes: bytes, deadline=None) -> Detections:
+    """Run overlapping full-resolution tiles (plus the whole frame) through the model and merge them"""
+    loop = asyncio.get_running_loop()
+    image_array = await loop.run_in_executor(decode_pool, decode_scan_image, image_bytes, 0)
+    
+    height, width = image_array.shape[:2]
+    windows = tile_windows(width, height, TILE_SIZE, TILE_OVERLAP, MAX_TILES)
+    if len(windows) == 1:
+        # Small image: one tile is the whole frame
+        windows, frames = [], [image_array]
+    else:
+        frames = slice_image(image_array, windows) + ([image_array] if TILE_FULL_FRAME else [])
+    
+    # All tiles are queued together so they fill the same model batches
+    try:
+        results = await ppe_batcher.infer_many([(frame, MODEL_IMGSZ) for frame in frames], deadline)
+    except QueueFullError:
+        raise server_busy_error()
+    except DeadlineExceededError:
+        raise deadline_exceeded_error()
+    
+    with stage_timer("tile_merge"):
+        return merge_detections(results[:len(windows)], windows, TILE_NMS_IOU, extra=results[len(windows):])
+
+async def run_cascade_detection(image_bytes: bytes, deadline=None) -> Detections:
+    """Find workers at low resolution, then run the PPE model on full-resolution crops of them"""
+    loop = asyncio.get_running_loop()
+    image_array = await loop.run_in_executor(decode_pool, decode_scan_image, image_bytes, 0)
+    height, width = image_array.shape[:2]
+    
+    try:
+        persons = person_detections(await person_batcher.infer(image_array, deadline), PERSON_MODEL_MASK,
+                                    PERSON_MIN_CONF)
+        windows = crop_windows(persons.xyxy, persons.conf, width, height, CASCADE_PADDING, CASCADE_MAX_PERSONS)
+        if not windows:
+            # Nobody found: one full-frame pass so PPE in the photo is still reported
+            return await ppe_batcher.infer((image_array, MODEL_IMGSZ), deadline)
+        crops = crop_images(image_array, windows)
+        results = await ppe_batcher.infer_many([(crop, CASCADE_IMGSZ) for crop in crops], deadline)
+    except QueueFullError:
+        raise server_busy_error()
+    except DeadlineExceededError:
+        raise deadline_exceeded_error()
+    
+    with stage_timer("crop_merge"):
+        return merge_crop_detections(results, windows, persons, PERSON_CLASS_ID, TILE_NMS_IOU)
+
+def detection_signature(mode: str, tier=None) -> tuple:
+    """Settings that change the detections of a given upload, for the cache key"""
+    if mode == "sliced":
+        return (mode, TILE_SIZE, TILE_OVERLAP, MAX_TILES, TILE_FULL_FRAME, TILE_NMS_IOU)
+    if mode == "cascade":
+        return (mode, PERSON_MODEL_PATH, PERSON_IMGSZ, PERSON_MIN_CONF, CASCADE_IMGSZ,
+                CASCADE_PADDING, CASCADE_MAX_PERSONS, TILE_NMS_IOU)
+    tier = tier or tier_selector.ladder[0]
+    return (mode, DECODE_SIZE, tier.name, FAST_MODEL_VERSION if tier.model == "fast" else None)
+
+def detection_runner(mode: str, tier=None, deadline=None):
+    """Coroutine function that runs the detection of one upload for `mode`"""
+    return {
+        "sliced": partial(run_sliced_detection, deadline=deadline),
+        "cascade": partial(run_cascade_detection, deadline=deadline),
+        "raw": partial(run_detection, tier=tier, deadline=deadline, decode=decode_raw_scan_image),
+    }.get(mode, partial(run_detection, tier=tier, deadline=deadline))
+
+async def detect_ppe(image_bytes: bytes, mode: str = "standard", tier=None, deadline=None) -> Detections:
+    """Detections for an upload, served from the content cache when the same bytes were seen before"""
+    # Live raw frames almost never repeat, so hashing their megabytes of pixels would only cost CPU
+    if detection_cache.max_entries == 0 or mode == "raw":
+        return await detection_runner(mode, tier, deadline)(image_bytes)
+    
+    # Department and set only affect scoring, so they are not part of the key
+    loop = asyncio.get_running_loop()
+    digest = await loop.run_in_executor(decode_pool, content_hash, image_bytes)
+    key = (digest, MODEL_VERSION) + detection_signature(mode, tier)
+    # Identical uploads share one inference that carries the deadline of the caller who started it;
+    # each caller stops waiting at its own deadline and reruns if it outlives a shed shared run
+    try:
+        return await detection_cache.get_or_compute(
+            key, lambda run_deadline: detection_runner(mode, tier, run_deadline)(image_bytes), deadline)
+    except asyncio.TimeoutError:
+        raise deadline_exceeded_error()
+
+@image_uploads.post("/ppe-scan")
 async def ppe_scan(
+    request: Request,
     file: UploadFile = File(...),
     department: str = Form(...),
-    ppe_set: str = Form(None)
+    ppe_set: str = Form(None),
+    per_person: bool = Form(False),
+    mode: str = Form("standard"),
+    site: str = Form(""),
+    tier: str = Form("auto"),
+    deadline_ms: float = Form(None),
+    x_deadline_ms: float = Header(None)
 ):
     """
     Department-Specific PPE Detection Endpoint
@@ -218,13 +822,28 @@ async def ppe_scan(
       - file: image file
       - department: one of [mining_operations, blasting, equipment_maintenance, safety_inspection]
       - ppe_set: optional specific set (e.g., set_a_basic, set_b_dust_drilling)
+      - per_person: if true, also score every detected worker separately
+      - mode: "standard" (one pass at model size), "sliced" (overlapping full-resolution tiles)
+              or "cascade" (person detector, then PPE model on worker crops)
+      - site: optional site whose own PPE rules apply (global rules otherwise)
+      - tier: "auto" (picked from the current load) or a fixed inference tier such as "main@640";
+              standard mode only
+      - deadline_ms (or X-Deadline-Ms header): how long the client will wait for the answer; scans that
+              cannot be analysed in time are dropped before inference and answered with 504
     
-    Returns: PPE status based on department requirements with compliance flag
+    Returns: PPE status based on department requirements with compliance flag,
+             or 422 with retake_photo=true when the photo is too dark, overexposed or blurred to scan
     """
+    global pending_scans
+    started = time.perf_counter()
+    
+    # Shed load up front instead of queueing without bound
+    if pending_scans >= MAX_PENDING_SCANS:
+        raise server_busy_error()
+    pending_scans += 1
+    IN_FLIGHT.inc()
+    
     try:
-        # Normalize department name first
-        department = normalize_department(department)
-        
         # Validate content type
         if not file.content_type or not file.content_type.startswith("image/"):
             raise HTTPException(
@@ -232,90 +851,479 @@ async def ppe_scan(
                 detail="Invalid file type. Please upload an image file."
             )
         
-        # Get department-specific PPE requirements
-        ppe_requirements = get_ppe_requirements(department, ppe_set)
-        
-        # Determine which set is being used
-        actual_set = ppe_set if ppe_set else list(DEPARTMENT_PPE_SETS[department].keys())[0]
-        
-        # Read and process image
-        image_bytes = await file.read()
-        pil_image = Image.open(BytesIO(image_bytes))
-        
-        # Convert PIL image to numpy array
-        image_array = np.array(pil_image)
-        
-        # Convert RGB to BGR for OpenCV/YOLO
-        if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-        
-        # Run YOLO inference
-        results = model(image_array)
-        
-        # Initialize PPE results based on department requirements
-        ppe_results = {
-            ppe_type: {"required": True, "present": False}
-            for ppe_type in ppe_requirements.keys()
-        }
+        mode = mode.lower()
+        if mode not in SCAN_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid mode. Valid modes: {', '.join(SCAN_MODES)}"
+            )
+        if mode == "cascade" and not CASCADE_ENABLED:
+            raise HTTPException(
+                status_code=400,
+                detail="Cascade mode is disabled on this server (set PPE_CASCADE=true)."
+            )
+        requested_tier = parse_tier(tier)
+        if requested_tier is not None and mode != "standard":
+            raise HTTPException(
+                status_code=400,
+                detail="A fixed tier can only be used with mode=standard."
+            )
         
-        # Update with YOLO detections
-        detected_classes = []
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                # Get raw class name and confidence from YOLO model
-                class_id = int(box.cls[0])
-                raw_class = result.names[class_id]
-                confidence = float(box.conf[0])
-                
-                detected_classes.append(f"{raw_class} ({confidence:.2%})")
-                
-                # Skip "no-" variants (duplicates)
-                if "no-" in raw_class.lower() or "no_" in raw_class.lower() or raw_class.lower().startswith("no "):
-                    continue
-                
-                # Map to PPE category using department-specific requirements
-                for ppe_type, variants in ppe_requirements.items():
-                    if raw_class in variants:
-                        # Mark as present (binary detection)
-                        ppe_results[ppe_type]["present"] = True
-                        print(f"✓ Detected: {ppe_type} -> {raw_class} ({confidence:.2%})")
-                        break
+        # One rules snapshot for the whole scan, even if the file is reloaded meanwhile
+        rules = rules_store.current
+        rule = resolve_ppe_set(rules, department, ppe_set, site)
+        if per_person:
+            check_per_person_supported()
         
-        # Calculate compliance
-        total_required = len(ppe_results)
-        total_present = sum(1 for item in ppe_results.values() if item["present"])
-        compliance_percentage = (total_present / total_required * 100) if total_required > 0 else 0
-        is_compliant = compliance_percentage == 100
+        deadline = request_deadline(request, x_deadline_ms, deadline_ms)
         
-        print(f"\n📊 Department: {department} | Set: {actual_set}")
-        print(f"📊 Raw Detections: {', '.join(detected_classes) if detected_classes else 'None'}")
-        print("\n📊 Final Results (Department-Specific):")
-        for ppe_type, data in ppe_results.items():
-            status = "✓ PRESENT" if data["present"] else "✗ MISSING"
-            print(f"  {ppe_type}: {status} (Required)")
-        print(f"\n{'✓' if is_compliant else '✗'} Compliance: {compliance_percentage:.1f}% ({total_present}/{total_required})")
+        # Read image and run detection
+        with stage_timer("upload_read"):
+            image_bytes = await file.read()
+        check_deadline(deadline)
+        chosen_tier = select_tier(requested_tier, deadline) if mode == "standard" else None
+        detections = await detect_ppe(image_bytes, mode, chosen_tier, deadline)
         
-        return {
-            "department": department,
-            "ppe_set": actual_set,
-            "ppe_items": ppe_results,
-            "compliance": {
-                "is_compliant": is_compliant,
-                "percentage": round(compliance_percentage, 1),
-                "items_present": total_present,
-                "items_required": total_required
-            }
-        }
+        response = score_ppe_result(detections, rule, rules.class_bits, per_person)
+        log_scan(response, rule, detections, rules.class_bits, site if site in rules.sites else "",
+                 started, mode, chosen_tier)
+        if mode != "standard":
+            response["mode"] = mode
+        else:
+            response["tier"] = chosen_tier.name
+        with stage_timer("serialization"):
+            return JSONResponse(content=response)
     
+    except PoorImageQuality as e:
+        return JSONResponse(status_code=422, content=retake_response(e.report))
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        logger.exception("PPE scan failed")
         raise HTTPException(
             status_code=500, 
             detail=f"Failed to process image: {str(e)}"
         )
+    finally:
+        pending_scans -= 1
+        IN_FLIGHT.dec()
+
+@app.post("/ppe-scan/raw")
+async def ppe_scan_raw(
+    request: Request,
+    department: str,
+    ppe_set: str = None,
+    per_person: bool = False,
+    site: str = "",
+    tier: str = "auto",
+    deadline_ms: float = None,
+    x_deadline_ms: float = Header(None)
+):
+    """
+    Raw-Frame PPE Detection Endpoint for edge devices
+    
+    Accepts: an application/octet-stream body holding one raw frame (16-byte RAWF header, then
+    GRAY8/RGB24/BGR24 pixels; see shared/raw_frame.py) and the /ppe-scan options as query parameters:
+    department, ppe_set, per_person, site, tier, deadline_ms (or the X-Deadline-Ms header).
+    The frame goes through the same quality gate, tier selection and inference queue as /ppe-scan
+    in standard mode, without any image decoding.
+    
+    Returns: the same response as /ppe-scan
+    """
+    global pending_scans
+    started = time.perf_counter()
+    
+    if pending_scans >= MAX_PENDING_SCANS:
+        raise server_busy_error()
+    pending_scans += 1
+    IN_FLIGHT.inc()
+    
+    try:
+        requested_tier = parse_tier(tier)
+        rules = rules_store.current
+        rule = resolve_ppe_set(rules, department, ppe_set, site)
+        if per_person:
+            check_per_person_supported()
+        deadline = request_deadline(request, x_deadline_ms, deadline_ms)
+        
+        with stage_timer("upload_read"):
+            frame = await request.body()
+        # Header problems are reported before the frame is queued
+        try:
+            read_raw_header(frame, RAW_MAX_PIXELS)
+        except RawFrameError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        check_deadline(deadline)
+        chosen_tier = select_tier(requested_tier, deadline)
+        detections = await detect_ppe(frame, "raw", chosen_tier, deadline)
+        
+        response = score_ppe_result(detections, rule, rules.class_bits, per_person)
+        log_scan(response, rule, detections, rules.class_bits, site if site in rules.sites else "",
+                 started, "raw", chosen_tier)
+        response["tier"] = chosen_tier.name
+        with stage_timer("serialization"):
+            return JSONResponse(content=response)
+    
+    except PoorImageQuality as e:
+        return JSONResponse(status_code=422, content=retake_response(e.report))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Raw PPE scan failed")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to process frame: {str(e)}"
+        )
+    finally:
+        pending_scans -= 1
+        IN_FLIGHT.dec()
+
+@image_uploads.post("/ppe-scan/batch")
+async def ppe_scan_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    department: List[str] = Form(...),
+    ppe_set: List[str] = Form(None),
+    stream: bool = Form(False),
+    per_person: bool = Form(False),
+    site: str = Form(""),
+    tier: str = Form("auto"),
+    deadline_ms: float = Form(None),
+    x_deadline_ms: float = Header(None)
+):
+    """
+    Multi-Image PPE Detection Endpoint
+    
+    Accepts: multipart/form-data with:
+      - files: one or more image files (repeat the field)
+      - department: one shared department, or one per file in upload order
+      - ppe_set: optional; one shared set, or one per file in upload order
+      - stream: if true, results are streamed as NDJSON lines as they finish
+      - per_person: if true, also score every detected worker separately
+      - site: optional site whose own PPE rules apply (global rules otherwise)
+      - tier: "auto" (picked per image from the current load) or a fixed inference tier
+      - deadline_ms (or X-Deadline-Ms header): one deadline for the whole batch; images that cannot be
+              analysed in time get a 504 result
+    
+    Returns: one /ppe-scan style result per image, tagged with its index and filename
+    """
+    if len(files) > MAX_FILES_PER_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. At most {MAX_FILES_PER_BATCH} images per batch."
+        )
+    if len(department) not in (1, len(files)):
+        raise HTTPException(
+            status_code=400,
+            detail="Provide one department for all files or one per file."
+        )
+    ppe_set = ppe_set or [None]
+    if len(ppe_set) not in (1, len(files)):
+        raise HTTPException(
+            status_code=400,
+            detail="Provide one ppe_set for all files or one per file."
+        )
+    if per_person:
+        check_per_person_supported()
+    requested_tier = parse_tier(tier)
+    deadline = request_deadline(request, x_deadline_ms, deadline_ms)
+    
+    # Validate everything before any image is decoded
+    rules = rules_store.current
+    jobs = []
+    for index, file in enumerate(files):
+        if not file.content_type or not file.content_type.startswith("image/"):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file type for '{file.filename}'. Please upload image files."
+            )
+        file_department = department[index] if len(department) > 1 else department[0]
+        file_set = ppe_set[index] if len(ppe_set) > 1 else ppe_set[0]
+        jobs.append((index, file.filename, resolve_ppe_set(rules, file_department, file_set or None, site)))
+    
+    # A batch occupies at most one model batch worth of scan slots at a time
+    window = min(len(files), MAX_BATCH_SIZE)
+    if pending_scans + window > MAX_PENDING_SCANS:
+        raise server_busy_error()
+    
+    # Read uploads now; the streaming response outlives the request body
+    with stage_timer("upload_read"):
+        images = [await file.read() for file in files]
+    slots = asyncio.Semaphore(window)
+    
+    async def scan_one(index, filename, rule):
+        global pending_scans
+        async with slots:
+            pending_scans += 1
+            IN_FLIGHT.inc()
+            started = time.perf_counter()
+            try:
+                check_deadline(deadline)
+                chosen_tier = select_tier(requested_tier, deadline)
+                detections = await detect_ppe(images[index], "standard", chosen_tier, deadline)
+                response = score_ppe_result(detections, rule, rules.class_bits, per_person)
+                log_scan(response, rule, detections, rules.class_bits, site if site in rules.sites else "",
+                         started, "standard", chosen_tier)
+                response["tier"] = chosen_tier.name
+            except PoorImageQuality as e:
+                response = {"status_code": 422, **retake_response(e.report)}
+            except HTTPException as he:
+                response = {"status_code": he.status_code, "error": he.detail}
+            except Exception as e:
+                logger.exception("PPE scan failed for %s", filename)
+                response = {"status_code": 500, "error": f"Failed to process image: {str(e)}"}
+            finally:
+                pending_scans -= 1
+                IN_FLIGHT.dec()
+        return {"index": index, "filename": filename, **response}
+    
+    tasks = [asyncio.create_task(scan_one(*job)) for job in jobs]
+    
+    if stream:
+        async def ndjson_lines():
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    yield json.dumps(await finished) + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+    
+    results = await asyncio.gather(*tasks)
+    with stage_timer("serialization"):
+        return JSONResponse(content={
+            "total_images": len(results),
+            "results": results
+        })
+
+def new_stream_session(rule, class_bits) -> StreamSession:
+    return StreamSession(
+        rule,
+        class_bits,
+        PERSON_CLASS_MASK,
+        window=STREAM_WINDOW,
+        min_frames=STREAM_MIN_FRAMES,
+        presence_ratio=STREAM_PRESENCE_RATIO,
+        iou_threshold=STREAM_TRACK_IOU,
+        max_missed=STREAM_MAX_MISSED,
+        min_containment=PERSON_MIN_CONTAINMENT
+    )
+
+def save_upload(upload: UploadFile) -> str:
+    """Copy an uploaded video to a temporary file (OpenCV can only read from a path)"""
+    suffix = os.path.splitext(upload.filename or "")[1] or ".mp4"
+    with tempfile.NamedTemporaryFile(prefix="ppe-video-", suffix=suffix, delete=False) as tmp:
+        shutil.copyfileobj(upload.file, tmp, 1024 * 1024)
+        return tmp.name
+
+def open_video(path: str, sample_fps: float) -> VideoFrameSampler:
+    return VideoFrameSampler(path, sample_fps, max_side=DECODE_SIZE, max_frames=VIDEO_MAX_FRAMES)
+
+@app.post("/ppe-scan/video")
+async def ppe_scan_video(
+    file: UploadFile = File(...),
+    department: str = Form(...),
+    ppe_set: str = Form(None),
+    site: str = Form(""),
+    sample_fps: float = Form(None)
+):
+    """
+    Video PPE Compliance Endpoint
+    
+    Accepts: multipart/form-data with:
+      - file: video file (mp4, avi, mov, ...)
+      - department / ppe_set / site: as for /ppe-scan
+      - sample_fps: frames analysed per second of video (default PPE_STREAM_SAMPLE_FPS)
+    
+    Returns: NDJSON stream of compliance events (only when a worker's smoothed
+    compliance changes), followed by a summary line
+    """
+    global active_streams
+    
+    if active_streams >= MAX_STREAMS:
+        raise server_busy_error()
+    if file.content_type and not file.content_type.startswith(("video/", "application/octet-stream")):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload a video file."
+        )
+    rules = rules_store.current
+    rule = resolve_ppe_set(rules, department, ppe_set, site)
+    sample_fps = sample_fps or STREAM_SAMPLE_FPS
+    
+    active_streams += 1
+    loop = asyncio.get_running_loop()
+    path = None
+    try:
+        path = await loop.run_in_executor(video_pool, save_upload, file)
+        sampler = await loop.run_in_executor(video_pool, open_video, path, sample_fps)
+    except Exception as e:
+        active_streams -= 1
+        if path:
+            os.unlink(path)
+        if isinstance(e, ValueError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise
+    
+    session = new_stream_session(rule, rules.class_bits)
+    
+    async def ndjson_events():
+        global active_streams, pending_scans
+        try:
+            while True:
+                # Read a model batch worth of sampled frames, then run them together
+                chunk = await loop.run_in_executor(video_pool, sampler.read, VIDEO_CHUNK_FRAMES)
+                if not chunk:
+                    break
+                # Single scans keep priority; wait until the frames fit in the pending-scan limit
+                while pending_scans + len(chunk) > MAX_PENDING_SCANS:
+                    await asyncio.sleep(MAX_BATCH_WAIT_MS / 1000.0 * 5)
+                pending_scans += len(chunk)
+                try:
+                    while True:
+                        try:
+                            results = await ppe_batcher.infer_many([(frame, MODEL_IMGSZ) for _, frame in chunk])
+                            break
+                        except QueueFullError:
+                            # Wait for the queue to drain
+                            await asyncio.sleep(MAX_BATCH_WAIT_MS / 1000.0 * 5)
+                finally:
+                    pending_scans -= len(chunk)
+                for (timestamp, _), detections in zip(chunk, results):
+                    with stage_timer("tracking"):
+                        events = session.update(detections, timestamp)
+                    for event in events:
+                        yield json.dumps(event) + "\n"
+            summary = session.summary()
+            summary.update({
+                "department": rule.department,
+                "ppe_set": rule.name,
+                "sample_fps": sample_fps,
+                "video_seconds": round(sampler.duration, 3)
+            })
+            yield json.dumps(summary) + "\n"
+        finally:
+            active_streams -= 1
+            sampler.close()
+            os.unlink(path)
+    
+    return StreamingResponse(ndjson_events(), media_type="application/x-ndjson")
+
+@app.websocket("/ppe-scan/stream")
+async def ppe_scan_stream(
+    websocket: WebSocket,
+    department: str,
+    ppe_set: str = None,
+    site: str = "",
+    sample_fps: float = None
+):
+    """
+    Live Frame-Stream PPE Compliance (WebSocket)
+    
+    Query parameters: department, ppe_set, site, sample_fps (as for /ppe-scan/video).
+    The client sends JPEG frames as binary messages and the text message "end"
+    to finish. The server answers with JSON compliance events when a worker's
+    smoothed compliance changes, and a summary after "end".
+    
+    Frames are analysed at most `sample_fps` times per second; while a frame is
+    being analysed only the newest incoming frame is kept, so a fast camera
+    never builds a backlog.
+    """
+    global active_streams, pending_scans
+    
+    await websocket.accept()
+    if active_streams >= MAX_STREAMS:
+        await websocket.send_json({"event": "error", "status_code": 503, "error": "Too many active streams."})
+        await websocket.close(code=1013)
+        return
+    try:
+        rules = rules_store.current
+        rule = resolve_ppe_set(rules, department, ppe_set, site)
+    except HTTPException as he:
+        await websocket.send_json({"event": "error", "status_code": he.status_code, "error": he.detail})
+        await websocket.close(code=1008)
+        return
+    
+    active_streams += 1
+    session = new_stream_session(rule, rules.class_bits)
+    interval = 1.0 / (sample_fps or STREAM_SAMPLE_FPS)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    latest = None
+    frame_ready = asyncio.Event()
+    stats = {"received": 0, "dropped": 0, "failed": 0, "analysed": 0}
+    
+    async def receive_frames():
+        nonlocal latest
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return False
+            if message.get("bytes"):
+                stats["received"] += 1
+                if latest is not None:
+                    stats["dropped"] += 1
+                latest = (message["bytes"], loop.time())
+                frame_ready.set()
+            elif message.get("text") == "end":
+                return True
+    
+    receiver = asyncio.create_task(receive_frames())
+    receiver.add_done_callback(lambda _: frame_ready.set())
+    next_sample_at = started
+    try:
+        while True:
+            if latest is None:
+                if receiver.done():
+                    break
+                await frame_ready.wait()
+                frame_ready.clear()
+                continue
+            
+            image_bytes, arrived_at = latest
+            latest = None
+            if arrived_at < next_sample_at:
+                stats["dropped"] += 1
+                continue
+            next_sample_at = arrived_at + interval
+            
+            # The frame in analysis holds a pending-scan slot; at the limit single scans keep priority
+            if pending_scans >= MAX_PENDING_SCANS:
+                stats["dropped"] += 1
+                continue
+            pending_scans += 1
+            try:
+                # Not quality-gated: one dark or blurred frame of a stream is simply outweighed by the next
+                detections = await run_detection(image_bytes, decode=decode_image)
+            except (HTTPException, OSError, ValueError):
+                # Busy queue or undecodable frame: skip it, the next one is coming
+                stats["dropped"] += 1
+                continue
+            except Exception:
+                logger.exception("Stream frame analysis failed")
+                stats["failed"] += 1
+                continue
+            finally:
+                pending_scans -= 1
+            stats["analysed"] += 1
+            with stage_timer("tracking"):
+                events = session.update(detections, arrived_at - started)
+            for event in events:
+                await websocket.send_json(event)
+        
+        if not receiver.cancelled() and receiver.exception() is None and receiver.result():
+            summary = session.summary()
+            summary.update(stats)
+            await websocket.send_json(summary)
+            await websocket.close()
+    except (WebSocketDisconnect, OSError):
+        # Client went away mid-stream
+        pass
+    finally:
+        receiver.cancel()
+        active_streams -= 1
+
+app.include_router(image_uploads)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8888))
@@ -0,0 +1,98 @@
+"""
+Prometheus metrics for the PPE detection service.
+
+Every scan is broken into stages (upload read, decode, queue wait,
+preprocess, inference, postprocess, scoring, serialization) and each stage
+is recorded in one histogram labelled by stage. `GET /metrics` exposes them
+together with queue depth, in-flight scans, batch sizes and the inference
+tier chosen for each scan. Multi-worker merging is in
+shared/metrics_export.py.
+"""
+
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Sub-millisecond decode/scoring up to multi-second queue waits under burst load
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+STAGE_SECONDS = Histogram(
+    "ppe_stage_seconds",
+    "Time spent in each stage of a PPE scan",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "ppe_request_seconds",
+    "End-to-end latency of PPE scan requests",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_TOTAL = Counter(
+    "ppe_requests_total",
+    "PPE scan requests by endpoint and HTTP status",
+    ["endpoint", "status"],
+)
+BATCH_SIZE = Histogram(
+    "ppe_batch_size",
+    "Images per YOLO forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+TIER_SCANS = Counter(
+    "ppe_tier_scans_total",
+    "Standard scans by inference tier and whether it was picked automatically or requested",
+    ["tier", "choice"],
+)
+TIER_IMAGE_SECONDS = Histogram(
+    "ppe_tier_image_seconds",
+    "Model time per image in a batch, by inference tier",
+    ["tier"],
+    buckets=LATENCY_BUCKETS,
+)
+SHED_REQUESTS = Counter(
+    "ppe_shed_requests_total",
+    "Images dropped because the client's deadline passed (or could not be met) before inference",
+    ["stage"],
+)
+QUALITY_REJECTIONS = Counter(
+    "ppe_quality_rejections_total",
+    "Uploads answered with a retake-photo response, by quality problem",
+    ["problem"],
+)
+UPLOAD_REJECTIONS = Counter(
+    "ppe_upload_rejections_total",
+    "Uploads refused while streaming in: too_large, too_many_pixels or unsupported_format",
+    ["reason"],
+)
+# Gauges are set explicitly (not via set_function) so multi-worker scrapes can sum them
+QUEUE_DEPTH = Gauge(
+    "ppe_queue_depth",
+    "Images waiting for an inference batch, by batcher (ppe, fast or person)",
+    ["batcher"],
+    multiprocess_mode="livesum",
+)
+IN_FLIGHT = Gauge("ppe_in_flight_scans", "Scans admitted and not yet answered", multiprocess_mode="livesum")
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time the enclosed block as one stage of the current scan"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def observe_yolo_speed(speed: dict):
+    """Record ultralytics' per-image preprocess/inference/postprocess timings (milliseconds)"""
+    for stage in ("preprocess", "inference", "postprocess"):
+        if speed.get(stage) is not None:
+            STAGE_SECONDS.labels(stage).observe(speed[stage] / 1000.0)
@@ -0,0 +1,46 @@
+"""
+Pre-fork multi-worker serving for the PPE detection API.
+
+The parent imports main.py once (loading the model and rules) and runs a
+warm-up image so the fused layers exist before the workers are forked; the
+fork, thread split and supervision are in shared/prefork.py.
+
+Only the PyTorch engine is shared this way. ONNX Runtime and OpenVINO
+sessions own native thread pools that do not survive a fork, so with those
+engines every worker loads its own model after forking.
+
+Usage:
+    PPE_WORKERS=4 python prefork.py
+"""
+
+import os
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Modules shared with the hazard service live in backend_main/shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.prefork import serve
+
+WORKERS = max(1, int(os.getenv("PPE_WORKERS", 2)))
+TORCH_THREADS = int(os.getenv("PPE_TORCH_THREADS", 0))  # 0 = split the cores evenly
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8888))
+SHARE_MODEL = os.getenv("PPE_ENGINE", "torch").lower() == "torch"
+
+
+def load_app():
+    """Import main.py (loads the model and rules) and warm the PyTorch models up"""
+    import main
+    if SHARE_MODEL:
+        main.warm_up_models()
+    return main.app
+
+
+if __name__ == "__main__":
+    serve(load_app, "PPE Detection API", int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS, HOST, PORT,
+          torch_threads=TORCH_THREADS, share=SHARE_MODEL, metrics_prefix="ppe-metrics-",
+          log_level=os.getenv("PPE_LOG_LEVEL", "info").lower())
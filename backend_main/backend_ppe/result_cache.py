@@ -0,0 +1,123 @@
+"""
+Content-addressed cache for PPE detections.
+
+The mobile app retries /ppe-scan on flaky underground Wi-Fi and usually sends
+the exact same bytes again. Detections are cached by a hash of the upload
+plus the model/inference signature, so a retry (or the same photo scored
+against another department) skips YOLO entirely. Identical requests that
+arrive while the first one is still running share its inference. The shared
+inference carries the deadline of the caller that started it, so a scan
+whose client gave up is still shed in the queue. Each caller applies its
+own deadline to its wait, and a caller with a later (or no) deadline starts
+a fresh run when the shared one was dropped at the starter's deadline, so
+one client's short deadline never fails another's request.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+
+def content_hash(data: bytes) -> str:
+    """Fast 128-bit digest of an upload (hashlib releases the GIL on large buffers)"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class DetectionCache:
+    """LRU + TTL cache with single-flight coalescing of in-progress computations.
+
+    Only used from the event loop, so plain dicts are enough.
+
+    Parameters:
+        max_entries (int)     -- entries kept before the least recently used one is evicted; 0 disables caching
+        ttl_seconds (float)   -- how long an entry stays valid
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=300.0):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return a fresh cached value or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key, compute, deadline: float = None):
+        """Return the cached value for `key`, or run `compute(deadline)` once for all concurrent callers
+
+        `compute` is called with the deadline (time.monotonic()) of the caller that
+        starts the run. A caller whose own `deadline` passes first gets
+        asyncio.TimeoutError while the computation carries on for the others and
+        for the cache. If the run fails after its deadline passed, callers that
+        can still wait longer retry with their own deadline.
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            entry = self._inflight.get(key)
+            if entry is None:
+                self.misses += 1
+                task = asyncio.ensure_future(self._compute(key, compute, deadline))
+                # Mark failures as retrieved even if every waiter has gone away
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                entry = self._inflight[key] = (task, deadline)
+            else:
+                self.coalesced += 1
+            task, run_deadline = entry
+
+            try:
+                # Shielded so one caller disconnecting or timing out does not cancel the others' result
+                if deadline is None:
+                    return await asyncio.shield(task)
+                return await asyncio.wait_for(asyncio.shield(task), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise
+            except Exception:
+                outlives_run = run_deadline is not None and (deadline is None or deadline > run_deadline)
+                if not (outlives_run and time.monotonic() >= run_deadline):
+                    raise
+
+    async def _compute(self, key, compute, deadline):
+        try:
+            value = await compute(deadline)
+            self.put(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
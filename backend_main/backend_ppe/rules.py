@@ -0,0 +1,106 @@
+"""
+Hot-reloadable PPE rules.
+
+The department/set requirements live in a JSON file (`ppe_rules.json` by
+default) instead of code. A watcher thread polls the file's mtime and size;
+when they change the file is parsed and compiled off the request path and
+the new `CompiledRules` replaces the old one in a single reference swap.
+Requests take one snapshot of `store.current` and use it throughout, so a
+reload never mixes old and new rules within a scan. A file that fails to
+parse or compile is logged and ignored; the previous rules stay active.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from compliance import CompiledRules, compile_rules
+
+logger = logging.getLogger("ppe.rules")
+
+
+def load_rules_file(path: str, class_names: dict) -> CompiledRules:
+    with open(path, "r", encoding="utf-8") as f:
+        return compile_rules(json.load(f), class_names)
+
+
+class RulesStore:
+    """Holds the active compiled rules and swaps in new ones when the file changes.
+
+    Parameters:
+        path (str)            -- JSON rules file
+        class_names (dict)    -- model class names the rules are compiled against
+        poll_seconds (float)  -- how often the watcher checks the file; 0 disables reloading
+    """
+
+    def __init__(self, path: str, class_names: dict, poll_seconds: float = 2.0):
+        self.path = path
+        self.class_names = class_names
+        self.poll_seconds = float(poll_seconds)
+        self.reloads = 0
+        self.last_error = None
+        self.loaded_at = None
+        self._signature = self._file_signature()
+        # Startup fails loudly on a bad rules file
+        self.current = load_rules_file(path, class_names)
+        self.loaded_at = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload_if_changed(self) -> bool:
+        """Recompile the rules if the file changed; returns True when new rules were swapped in"""
+        signature = self._file_signature()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            compiled = load_rules_file(self.path, self.class_names)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.error("Ignoring invalid PPE rules file %s: %s", self.path, self.last_error)
+            return False
+        self.current = compiled
+        self.reloads += 1
+        self.last_error = None
+        self.loaded_at = time.time()
+        logger.info("Reloaded PPE rules from %s (%d sets)", self.path, len(compiled.sets))
+        return True
+
+    def start(self):
+        """Start watching the rules file"""
+        if self.poll_seconds <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="ppe-rules-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.poll_seconds + 1)
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.reload_if_changed()
+
+    def info(self) -> dict:
+        rules = self.current
+        return {
+            "file": os.path.basename(self.path),
+            "sites": len(rules.sites),
+            "sets": len(rules.sets),
+            "categories": len(rules.categories),
+            "reloads": self.reloads,
+            "loaded_at": self.loaded_at,
+            "last_error": self.last_error,
+        }
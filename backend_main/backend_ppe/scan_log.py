@@ -0,0 +1,417 @@
+"""
+Persistent PPE scan log with per-shift rollups.
+
+Every scored scan is appended to a local SQLite database (WAL mode) so
+supervisor dashboards get history without re-deriving it elsewhere. The
+request path only puts a tuple on a bounded queue; a writer thread drains
+the queue in batches and, in the same transaction, inserts the raw rows and
+upserts the rollups. The rollups are one row per (shift date, shift, site,
+department) plus one row per required PPE item, so the /stats queries read
+a few thousand rows at most, however many scans have been logged. Sites
+are kept apart because each site may have its own rules for a department.
+
+PPE items are stored as bitmasks over the log's own category table. Bits
+are assigned on first use and never change, so history stays readable
+after the rules file is edited. Per-item confidences are packed as float16
+values in ascending bit order of the required mask.
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+logger = logging.getLogger("ppe.scan_log")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    bit INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    shift_date TEXT NOT NULL,
+    shift TEXT NOT NULL,
+    site TEXT NOT NULL,
+    department TEXT NOT NULL,
+    ppe_set TEXT NOT NULL,
+    required_mask INTEGER NOT NULL,
+    present_mask INTEGER NOT NULL,
+    is_compliant INTEGER NOT NULL,
+    confidences BLOB,
+    latency_ms REAL NOT NULL,
+    mode TEXT,
+    tier TEXT,
+    workers INTEGER,
+    compliant_workers INTEGER
+);
+CREATE INDEX IF NOT EXISTS scans_department_ts ON scans (department, ts);
+CREATE INDEX IF NOT EXISTS scans_ts ON scans (ts);
+"""
+
+ROLLUP_TABLES = (
+    """CREATE TABLE IF NOT EXISTS shift_rollups (
+    shift_date TEXT NOT NULL,
+    shift TEXT NOT NULL,
+    site TEXT NOT NULL,
+    department TEXT NOT NULL,
+    scans INTEGER NOT NULL,
+    compliant INTEGER NOT NULL,
+    latency_ms_sum REAL NOT NULL,
+    latency_ms_max REAL NOT NULL,
+    PRIMARY KEY (shift_date, shift, site, department)
+) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS item_rollups (
+    shift_date TEXT NOT NULL,
+    shift TEXT NOT NULL,
+    site TEXT NOT NULL,
+    department TEXT NOT NULL,
+    category TEXT NOT NULL,
+    required INTEGER NOT NULL,
+    missing INTEGER NOT NULL,
+    PRIMARY KEY (shift_date, shift, site, department, category)
+) WITHOUT ROWID""",
+)
+
+# Rollups recomputed from the raw scans, for logs written before rollups were kept per site
+REBUILD_ROLLUPS = (
+    "INSERT INTO shift_rollups SELECT shift_date, shift, site, department, COUNT(*), SUM(is_compliant), "
+    "SUM(latency_ms), MAX(latency_ms) FROM scans GROUP BY shift_date, shift, site, department",
+    "INSERT INTO item_rollups SELECT s.shift_date, s.shift, s.site, s.department, c.name, COUNT(*), "
+    "SUM((s.present_mask >> c.bit) & 1 = 0) FROM scans s JOIN categories c ON (s.required_mask >> c.bit) & 1 "
+    "GROUP BY s.shift_date, s.shift, s.site, s.department, c.name",
+)
+
+# Attempts at claiming a category bit while other workers claim the same one
+BIT_ATTEMPTS = 10
+
+
+class ShiftCalendar:
+    """Map timestamps to (shift date, shift name) from shift start times.
+
+    `spec` lists shift starts in local time, e.g. "morning=06:00,night=18:00".
+    A shift lasts until the next one starts; a shift that runs past midnight
+    belongs to the date it started on.
+    """
+
+    def __init__(self, spec: str):
+        starts = []
+        for part in spec.replace(" ", "").split(","):
+            if not part:
+                continue
+            name, _, start = part.partition("=")
+            hours, _, minutes = start.partition(":")
+            starts.append((int(hours) * 60 + int(minutes or 0), name))
+        if not starts:
+            raise ValueError("At least one shift start is required (e.g. 'day=00:00')")
+        self.starts = sorted(starts)
+
+    def shift_of(self, ts: float) -> tuple:
+        local = time.localtime(ts)
+        minute = local.tm_hour * 60 + local.tm_min
+        day = datetime(local.tm_year, local.tm_mon, local.tm_mday)
+        current = None
+        for start, name in self.starts:
+            if start <= minute:
+                current = name
+        if current is None:
+            # Before the first start of the day: still the previous day's last shift
+            return (day - timedelta(days=1)).strftime("%Y-%m-%d"), self.starts[-1][1]
+        return day.strftime("%Y-%m-%d"), current
+
+
+class ScanLog:
+    """Append-only scan store with incrementally maintained rollups.
+
+    Parameters:
+        path (str)             -- SQLite database file
+        shifts (ShiftCalendar) -- how timestamps map to shifts
+        max_queue (int)        -- scans buffered for the writer; more are dropped and counted
+        batch_size (int)       -- most scans written per transaction
+    """
+
+    def __init__(self, path: str, shifts: ShiftCalendar, max_queue: int = 10000, batch_size: int = 500):
+        self.path = path
+        self.shifts = shifts
+        self.batch_size = max(1, int(batch_size))
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._thread = None
+        self._local = threading.local()
+        self._bits = {}
+
+    # ----- request path -----
+    def record(self, ts: float, site: str, department: str, ppe_set: str, categories, present, confidences,
+               latency_ms: float, mode: str = None, tier: str = None, workers: int = None,
+               compliant_workers: int = None):
+        """Queue one scored scan; never blocks (the scan is dropped if the writer is behind)"""
+        try:
+            self._queue.put_nowait((ts, site, department, ppe_set, tuple(categories), tuple(present),
+                                    tuple(confidences), latency_ms, mode, tier, workers, compliant_workers))
+        except queue.Full:
+            self.dropped += 1
+
+    # ----- writer thread -----
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._create_rollups(conn)
+        self._thread = threading.Thread(target=self._run, name="ppe-scan-log", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush what is queued and stop the writer"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _create_rollups(self, conn: sqlite3.Connection):
+        """Create the rollup tables, rebuilding ones from before rollups were kept per site"""
+        # Immediate, so that only one worker process rebuilds
+        conn.execute("BEGIN IMMEDIATE")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(shift_rollups)")]
+        rebuild = bool(columns) and "site" not in columns
+        if rebuild:
+            conn.execute("DROP TABLE shift_rollups")
+            conn.execute("DROP TABLE IF EXISTS item_rollups")
+        for statement in ROLLUP_TABLES:
+            conn.execute(statement)
+        if rebuild:
+            for statement in REBUILD_ROLLUPS:
+                conn.execute(statement)
+            logger.info("Rebuilt the scan log rollups per site in %s", self.path)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        self._bits = dict((name, bit) for bit, name in conn.execute("SELECT bit, name FROM categories"))
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+            batch = [entry for entry in batch if entry is not None]
+            if not batch:
+                continue
+            try:
+                with conn:
+                    self._write(conn, batch)
+                self.written += len(batch)
+            except Exception:
+                # Keep the writer alive; the batch is lost, later scans are still logged
+                logger.exception("Could not write %d scans to %s", len(batch), self.path)
+                self._reload_bits(conn)
+        conn.close()
+
+    def _reload_bits(self, conn: sqlite3.Connection):
+        """Forget bits claimed by a rolled-back transaction"""
+        try:
+            self._bits = dict((name, bit) for bit, name in conn.execute("SELECT bit, name FROM categories"))
+        except sqlite3.Error:
+            self._bits = {}
+
+    def _bit(self, conn: sqlite3.Connection, category: str) -> int:
+        bit = self._bits.get(category)
+        if bit is None:
+            # Another worker process may have added categories meanwhile, or taken the bit we try
+            # to claim (the insert is then ignored and the next free bit is tried)
+            for _ in range(BIT_ATTEMPTS):
+                conn.execute("INSERT OR IGNORE INTO categories (bit, name) "
+                             "VALUES ((SELECT COALESCE(MAX(bit) + 1, 0) FROM categories), ?)", (category,))
+                row = conn.execute("SELECT bit FROM categories WHERE name = ?", (category,)).fetchone()
+                if row is not None:
+                    break
+            else:
+                raise sqlite3.OperationalError(f"could not assign a bit to PPE item {category!r}")
+            bit = self._bits[category] = row[0]
+        return bit
+
+    def _write(self, conn: sqlite3.Connection, batch):
+        rows = []
+        shifts = {}
+        items = {}
+        for (ts, site, department, ppe_set, categories, present, confidences,
+             latency_ms, mode, tier, workers, compliant_workers) in batch:
+            shift_date, shift = self.shifts.shift_of(ts)
+            bits = [self._bit(conn, category) for category in categories]
+            required_mask = sum(1 << bit for bit in set(bits))
+            present_mask = sum(1 << bit for bit, ok in zip(bits, present) if ok)
+            compliant = all(present)
+            order = np.argsort(bits, kind="stable")
+            packed = np.asarray(confidences, dtype=np.float16)[order].tobytes()
+            rows.append((ts, shift_date, shift, site, department, ppe_set, required_mask, present_mask,
+                         int(compliant), packed, latency_ms, mode, tier, workers, compliant_workers))
+
+            key = (shift_date, shift, site, department)
+            scans, ok, latency_sum, latency_max = shifts.get(key, (0, 0, 0.0, 0.0))
+            shifts[key] = (scans + 1, ok + compliant, latency_sum + latency_ms, max(latency_max, latency_ms))
+            for category, ok in zip(categories, present):
+                required, missing = items.get(key + (category,), (0, 0))
+                items[key + (category,)] = (required + 1, missing + (not ok))
+
+        conn.executemany(
+            "INSERT INTO scans (ts, shift_date, shift, site, department, ppe_set, required_mask, present_mask, "
+            "is_compliant, confidences, latency_ms, mode, tier, workers, compliant_workers) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.executemany(
+            "INSERT INTO shift_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (shift_date, shift, site, department) DO UPDATE SET "
+            "scans = scans + excluded.scans, compliant = compliant + excluded.compliant, "
+            "latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum, "
+            "latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)",
+            [key + value for key, value in shifts.items()]
+        )
+        conn.executemany(
+            "INSERT INTO item_rollups VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (shift_date, shift, site, department, category) DO UPDATE SET "
+            "required = required + excluded.required, missing = missing + excluded.missing",
+            [key + value for key, value in items.items()]
+        )
+
+    # ----- queries (any thread) -----
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+        return conn
+
+    def shift_stats(self, since: str, until: str, department: str = None, site: str = None) -> list:
+        """Per shift, site and department rollups between two shift dates (inclusive)"""
+        where, params = "shift_date BETWEEN ? AND ?", [since, until]
+        if department:
+            where += " AND department = ?"
+            params.append(department)
+        if site is not None:
+            where += " AND site = ?"
+            params.append(site)
+        conn = self._reader()
+        missing = {}
+        for shift_date, shift, site_name, dept, category, required, count in conn.execute(
+            f"SELECT shift_date, shift, site, department, category, required, missing FROM item_rollups "
+            f"WHERE {where}",
+            params
+        ):
+            missing.setdefault((shift_date, shift, site_name, dept), {})[category] = {
+                "required": required, "missing": count
+            }
+        rows = []
+        for shift_date, shift, site_name, dept, scans, compliant, latency_sum, latency_max in conn.execute(
+            f"SELECT shift_date, shift, site, department, scans, compliant, latency_ms_sum, latency_ms_max "
+            f"FROM shift_rollups WHERE {where} ORDER BY shift_date DESC, shift, site, department",
+            params
+        ):
+            rows.append({
+                "shift_date": shift_date,
+                "shift": shift,
+                "site": site_name,
+                "department": dept,
+                **summarize(scans, compliant, latency_sum, latency_max),
+                "items": missing.get((shift_date, shift, site_name, dept), {}),
+            })
+        return rows
+
+    def department_stats(self, since: str, until: str, site: str = None) -> list:
+        """Per site and department totals between two shift dates (inclusive), summed from the shift rollups"""
+        where, params = "shift_date BETWEEN ? AND ?", [since, until]
+        if site is not None:
+            where += " AND site = ?"
+            params.append(site)
+        conn = self._reader()
+        items = {}
+        for site_name, dept, category, required, count in conn.execute(
+            f"SELECT site, department, category, SUM(required), SUM(missing) FROM item_rollups "
+            f"WHERE {where} GROUP BY site, department, category",
+            params
+        ):
+            items.setdefault((site_name, dept), {})[category] = {"required": required, "missing": count}
+        return [
+            {"site": site_name, "department": dept, **summarize(scans, compliant, latency_sum, latency_max),
+             "items": items.get((site_name, dept), {})}
+            for site_name, dept, scans, compliant, latency_sum, latency_max in conn.execute(
+                f"SELECT site, department, SUM(scans), SUM(compliant), SUM(latency_ms_sum), MAX(latency_ms_max) "
+                f"FROM shift_rollups WHERE {where} GROUP BY site, department ORDER BY site, department",
+                params
+            )
+        ]
+
+    def recent_scans(self, department: str = None, since: float = None, limit: int = 100) -> list:
+        """Newest raw scans first, optionally for one department and after a unix timestamp"""
+        conn = self._reader()
+        names = dict(conn.execute("SELECT bit, name FROM categories"))
+        where, params = [], []
+        if department:
+            where.append("department = ?")
+            params.append(department)
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        query = ("SELECT id, ts, shift_date, shift, site, department, ppe_set, required_mask, present_mask, "
+                 "is_compliant, confidences, latency_ms, mode, tier, workers, compliant_workers FROM scans")
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY ts DESC LIMIT ?"
+        params.append(max(1, int(limit)))
+
+        scans = []
+        for (scan_id, ts, shift_date, shift, site, dept, ppe_set, required_mask, present_mask, compliant,
+             packed, latency_ms, mode, tier, workers, compliant_workers) in conn.execute(query, params):
+            bits = [bit for bit in range(required_mask.bit_length()) if required_mask >> bit & 1]
+            confidences = np.frombuffer(packed or b"", dtype=np.float16).astype(float).round(3).tolist()
+            scans.append({
+                "id": scan_id,
+                "timestamp": datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds"),
+                "shift_date": shift_date,
+                "shift": shift,
+                "site": site,
+                "department": dept,
+                "ppe_set": ppe_set,
+                "ppe_items": {
+                    names.get(bit, str(bit)): {"present": bool(present_mask >> bit & 1), "confidence": conf}
+                    for bit, conf in zip(bits, confidences)
+                },
+                "is_compliant": bool(compliant),
+                "latency_ms": round(latency_ms, 1),
+                "mode": mode,
+                "tier": tier,
+                "workers": workers,
+                "compliant_workers": compliant_workers,
+            })
+        return scans
+
+    def info(self) -> dict:
+        return {"written": self.written, "queued": self._queue.qsize(), "dropped": self.dropped}
+
+
+def summarize(scans: int, compliant: int, latency_sum: float, latency_max: float) -> dict:
+    return {
+        "scans": scans,
+        "compliant": compliant,
+        "compliance_rate": round(compliant / scans * 100, 1) if scans else 0.0,
+        "avg_latency_ms": round(latency_sum / scans, 1) if scans else 0.0,
+        "max_latency_ms": round(latency_max, 1),
+    }
@@ -0,0 +1,247 @@
+"""
+Temporal PPE compliance for video and frame streams.
+
+Single-frame results flicker: a glove is missed in one frame, a helmet is
+hidden by a hand in the next. A `StreamSession` tracks workers across
+sampled frames with greedy IoU matching, keeps a sliding window of each
+worker's PPE category bits, and calls an item present when it was seen in
+at least `presence_ratio` of the window. Events are only emitted when a
+worker's smoothed compliance changes, so a steady stream costs nothing on
+the wire.
+
+Models without a person class fall back to one frame-wide "track", i.e.
+image-level compliance smoothed over time.
+"""
+
+from collections import deque
+
+import cv2
+import numpy as np
+
+from compliance import Detections, present_mask, present_masks_per_person
+
+
+def box_iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(len(a), len(b)) IoU of two sets of xyxy boxes"""
+    a, b = a[:, None, :], b[None, :, :]
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+def greedy_match(iou: np.ndarray, threshold: float):
+    """(row, col) pairs matched by descending IoU, each row and column used once"""
+    if iou.size == 0:
+        return []
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    used_rows, used_cols, pairs = set(), set(), []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row not in used_rows and col not in used_cols:
+            used_rows.add(row)
+            used_cols.add(col)
+            pairs.append((row, col))
+    return pairs
+
+
+class Track:
+    """One worker followed across frames with a sliding window of PPE observations"""
+
+    def __init__(self, track_id: int, box: np.ndarray, num_categories: int, window: int):
+        self.track_id = track_id
+        self.box = box
+        self.missed = 0
+        self.history = deque(maxlen=window)
+        self.counts = np.zeros(num_categories, dtype=np.int32)
+        self.reported = None   # last emitted tuple of smoothed flags
+
+    def observe(self, flags: np.ndarray):
+        """Add one frame's per-category presence, dropping the oldest frame once the window is full"""
+        if len(self.history) == self.history.maxlen:
+            self.counts -= self.history[0]
+        self.history.append(flags)
+        self.counts += flags
+
+    def smoothed(self, presence_ratio: float) -> tuple:
+        return tuple((self.counts >= presence_ratio * len(self.history)).tolist())
+
+
+class StreamSession:
+    """Per-stream tracker and smoother; feed it the detections of every sampled frame.
+
+    Parameters:
+        rule (PPESetRule)        -- requirement the stream is checked against
+        class_bits (ndarray)     -- category bits per class id from the compiled rules
+        person_mask (ndarray)    -- person classes of the PPE model
+        window (int)             -- frames kept per worker for smoothing
+        min_frames (int)         -- frames a worker must be seen before its first event
+        presence_ratio (float)   -- share of the window an item must be seen in to count as worn
+        iou_threshold (float)    -- minimum IoU to continue a track
+        max_missed (int)         -- sampled frames a worker may be missing before the track ends
+        min_containment (float)  -- see `assign_items_to_persons`
+    """
+
+    def __init__(self, rule, class_bits, person_mask, window=8, min_frames=3, presence_ratio=0.5,
+                 iou_threshold=0.3, max_missed=5, min_containment=0.5):
+        self.rule = rule
+        self.class_bits = class_bits
+        self.person_mask = person_mask
+        self.frame_level = not person_mask.any()
+        self.window = max(1, int(window))
+        self.min_frames = max(1, min(int(min_frames), self.window))
+        self.presence_ratio = float(presence_ratio)
+        self.iou_threshold = float(iou_threshold)
+        self.max_missed = max(0, int(max_missed))
+        self.min_containment = float(min_containment)
+        self.tracks = []
+        self.next_track_id = 1
+        self.frames = 0
+
+    def _flags(self, masks: np.ndarray) -> np.ndarray:
+        """(N, categories) presence of the rule's categories for N category-bit masks"""
+        return ((masks[:, None] & self.rule.bits[None, :]) != 0).astype(np.int32)
+
+    def update(self, detections: Detections, timestamp: float = None) -> list:
+        """Advance by one sampled frame; returns the events it caused"""
+        self.frames += 1
+        if self.frame_level:
+            # One constant box so the frame-wide track always matches itself
+            boxes = np.array([[0, 0, 1, 1]], dtype=np.float32)
+            masks = np.array([present_mask(self.class_bits, detections.cls)], dtype=np.uint64)
+        else:
+            persons, masks, _ = present_masks_per_person(
+                self.class_bits, detections, self.person_mask, self.min_containment
+            )
+            boxes = detections.xyxy[persons]
+        flags = self._flags(masks)
+
+        seen = set()
+        matched = set()
+        if self.tracks and len(boxes):
+            track_boxes = np.stack([track.box for track in self.tracks])
+            for row, col in greedy_match(box_iou_matrix(track_boxes, boxes), self.iou_threshold):
+                track = self.tracks[row]
+                track.box = boxes[col]
+                track.observe(flags[col])
+                seen.add(track.track_id)
+                matched.add(col)
+        for col in range(len(boxes)):
+            if col not in matched:
+                track = Track(self.next_track_id, boxes[col], len(self.rule.categories), self.window)
+                self.next_track_id += 1
+                track.observe(flags[col])
+                seen.add(track.track_id)
+                self.tracks.append(track)
+
+        events = []
+        alive = []
+        for track in self.tracks:
+            track.missed = 0 if track.track_id in seen else track.missed + 1
+            if track.missed > self.max_missed:
+                if track.reported is not None:
+                    events.append(self._event("track_lost", track, timestamp))
+                continue
+            alive.append(track)
+            if track.missed == 0 and len(track.history) >= self.min_frames:
+                state = track.smoothed(self.presence_ratio)
+                if state != track.reported:
+                    track.reported = state
+                    events.append(self._event("compliance_changed", track, timestamp))
+        self.tracks = alive
+        return events
+
+    def _event(self, kind: str, track: Track, timestamp) -> dict:
+        flags = track.reported
+        event = {
+            "event": kind,
+            "track_id": track.track_id,
+            "frame": self.frames,
+            "timestamp": None if timestamp is None else round(float(timestamp), 3),
+        }
+        if kind == "compliance_changed":
+            event.update({
+                "is_compliant": all(flags),
+                "ppe_items": dict(zip(self.rule.categories, flags)),
+                "missing": [c for c, ok in zip(self.rule.categories, flags) if not ok],
+            })
+        if not self.frame_level:
+            event["box"] = np.asarray(track.box, dtype=float).round(1).tolist()
+        return event
+
+    def summary(self) -> dict:
+        return {
+            "event": "summary",
+            "frames": self.frames,
+            "tracks": self.next_track_id - 1,
+            "active_tracks": len(self.tracks),
+        }
+
+
+# ===========================
+# Video files
+# ===========================
+def fit_long_side(frame: np.ndarray, max_side: int) -> np.ndarray:
+    """Downscale a frame so its long side is at most `max_side` (0 keeps it as is)"""
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width) if max_side else 1.0
+    if scale >= 1.0:
+        return frame
+    return cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+class VideoFrameSampler:
+    """Read a video file at `sample_fps`, decoding only the frames that are kept.
+
+    Skipped frames are only grabbed (demuxed and decoded by FFmpeg, never
+    converted or copied), and kept frames are shrunk to `max_side` right
+    away, so the work per sampled frame does not depend on the video size.
+
+    Parameters:
+        path (str)          -- video file readable by OpenCV/FFmpeg
+        sample_fps (float)  -- frames kept per second of video
+        max_side (int)      -- long side of the returned frames
+        max_frames (int)    -- stop after this many sampled frames
+    """
+
+    def __init__(self, path: str, sample_fps: float, max_side: int = 640, max_frames: int = 900):
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError("Could not open the uploaded video")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 0.0
+        self.interval = 1.0 / sample_fps if sample_fps > 0 else 0.0
+        self.max_side = max_side
+        self.max_frames = max_frames
+        self.frame_index = 0
+        self.sampled = 0
+        self.next_sample_at = 0.0
+        self.duration = 0.0
+
+    def _timestamp(self) -> float:
+        if self.fps > 0:
+            return self.frame_index / self.fps
+        return self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+    def read(self, count: int) -> list:
+        """Up to `count` (timestamp_seconds, BGR frame) pairs; an empty list at the end"""
+        frames = []
+        while len(frames) < count and self.sampled < self.max_frames:
+            if not self.capture.grab():
+                break
+            timestamp = self._timestamp()
+            self.frame_index += 1
+            self.duration = timestamp
+            if timestamp + 1e-6 < self.next_sample_at:
+                continue
+            ok, frame = self.capture.retrieve()
+            if not ok:
+                continue
+            self.next_sample_at = timestamp + self.interval
+            self.sampled += 1
+            frames.append((timestamp, fit_long_side(frame, self.max_side)))
+        return frames
+
+    def close(self):
+        self.capture.release()
@@ -0,0 +1,114 @@
+"""
+Load-adaptive inference tiers for standard PPE scans.
+
+A tier is one model at one input size. The ladder is ordered from the most
+accurate tier (the main model at full size) to the fastest (smaller input
+sizes, then an optional smaller model). For every scan the selector
+predicts how long the scan would take on each tier from the scans already
+ahead of it and a running average of each tier's per-image model time,
+and picks the most accurate tier that still meets the latency SLO. When
+nothing meets the SLO the fastest tier is used: under peak gate load a
+slightly less accurate answer beats a timeout.
+"""
+
+import threading
+from typing import NamedTuple
+
+
+class InferenceTier(NamedTuple):
+    name: str    # e.g. "main@640", used in responses, metrics and the `tier` override
+    model: str   # "main" or "fast"
+    imgsz: int
+
+
+def build_ladder(main_sizes, fast_sizes=()) -> list:
+    """Tiers from most accurate to fastest: main model sizes, then fast model sizes, each descending"""
+    ladder = []
+    for model, sizes in (("main", main_sizes), ("fast", fast_sizes)):
+        for imgsz in sorted({int(size) for size in sizes if int(size) > 0}, reverse=True):
+            ladder.append(InferenceTier(f"{model}@{imgsz}", model, imgsz))
+    if not ladder:
+        raise ValueError("The inference tier ladder is empty")
+    return ladder
+
+
+def parse_sizes(spec: str) -> list:
+    """'640,480,320' -> [640, 480, 320]"""
+    return [int(part) for part in spec.replace(" ", "").split(",") if part]
+
+
+class TierSelector:
+    """Pick a tier per scan from the current load and a latency SLO.
+
+    Parameters:
+        ladder (list)         -- InferenceTier list, most accurate first
+        slo_seconds (float)   -- target model latency per scan; 0 always picks the first tier
+        smoothing (float)     -- weight of the newest measurement in the per-image time average
+    """
+
+    def __init__(self, ladder, slo_seconds: float, smoothing: float = 0.2):
+        self.ladder = list(ladder)
+        self.by_name = {tier.name: tier for tier in self.ladder}
+        self.slo = max(0.0, float(slo_seconds))
+        self.smoothing = float(smoothing)
+        self._seconds_per_image = {}   # (model, imgsz) -> running average
+        self._warmed_up = set()
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, imgsz: int, seconds_per_image: float):
+        """Record the model time per image of one batch (called from the batcher threads)"""
+        key = (model, imgsz)
+        with self._lock:
+            # The first batch of a model/size pays one-off setup (layer fusion, allocator growth)
+            if key not in self._warmed_up:
+                self._warmed_up.add(key)
+                return
+            previous = self._seconds_per_image.get(key)
+            if previous is None:
+                self._seconds_per_image[key] = seconds_per_image
+            else:
+                self._seconds_per_image[key] = previous + self.smoothing * (seconds_per_image - previous)
+
+    def estimate(self, tier: InferenceTier):
+        """Per-image seconds for a tier; unmeasured tiers are scaled by pixel count from a measured one"""
+        with self._lock:
+            measured = dict(self._seconds_per_image)
+        if (tier.model, tier.imgsz) in measured:
+            return measured[(tier.model, tier.imgsz)]
+        # Prefer a measurement of the same model; another model's only as a fallback
+        candidates = sorted(measured.items(), key=lambda item: item[0][0] != tier.model)
+        if not candidates:
+            return None
+        (_, imgsz), seconds = candidates[0]
+        return seconds * (tier.imgsz / imgsz) ** 2
+
+    def predict(self, tier: InferenceTier, scans_ahead: int):
+        """Predicted model seconds until a scan on `tier` is answered, or None before any measurement"""
+        seconds = self.estimate(tier)
+        return None if seconds is None else (scans_ahead + 1) * seconds
+
+    def choose(self, scans_ahead: int, budget: float = None) -> InferenceTier:
+        """Most accurate tier whose predicted time (scans ahead plus this one) meets the SLO
+        and, when given, the seconds the client is still willing to wait"""
+        target = self.slo
+        if budget is not None:
+            target = min(target, budget) if target > 0 else budget
+        if target <= 0 and budget is None:
+            return self.ladder[0]
+        for tier in self.ladder:
+            seconds = self.predict(tier, scans_ahead)
+            if seconds is None or seconds <= target:
+                return tier
+        return self.ladder[-1]
+
+    def info(self) -> dict:
+        tiers = []
+        for tier in self.ladder:
+            seconds = self.estimate(tier)
+            tiers.append({
+                "name": tier.name,
+                "model": tier.model,
+                "imgsz": tier.imgsz,
+                "ms_per_image": None if seconds is None else round(seconds * 1000, 1),
+            })
+        return {"slo_ms": round(self.slo * 1000, 1), "tiers": tiers}
@@ -0,0 +1,74 @@
+"""
+Sliced (tiled) inference helpers for wide-angle PPE scans.
+
+Goggles and gloves cover a few dozen pixels in a 4000 px tunnel shot and
+disappear when the whole frame is letterboxed to 640 px. In sliced mode the
+full-resolution image is cut into overlapping tiles, every tile goes through
+YOLO at the normal input size, and the tile detections are shifted back into
+image coordinates and merged with class-aware NMS. An optional extra pass
+over the whole frame keeps large objects (workers, vests) that span tiles.
+"""
+
+import math
+
+import numpy as np
+import torch
+from torchvision.ops import batched_nms
+
+from compliance import Detections
+
+
+def tile_grid(length: int, tile: int, overlap: float) -> int:
+    """Number of tiles needed along one side"""
+    if length <= tile:
+        return 1
+    stride = tile * (1.0 - overlap)
+    return math.ceil((length - tile) / stride) + 1
+
+
+def tile_windows(width: int, height: int, tile_size: int = 640, overlap: float = 0.2, max_tiles: int = 16):
+    """Overlapping (x0, y0, x1, y1) windows covering the image, at most `max_tiles` of them
+
+    When the image needs more tiles than the budget allows, the tile size is
+    grown until the grid fits; each tile is still resized to the model input,
+    so latency stays bounded and only the effective resolution drops.
+    """
+    tile = tile_size
+    while tile_grid(width, tile, overlap) * tile_grid(height, tile, overlap) > max(1, max_tiles):
+        tile = int(tile * 1.1) + 1
+
+    tile_w, tile_h = min(tile, width), min(tile, height)
+    xs = np.linspace(0, width - tile_w, tile_grid(width, tile, overlap)).round().astype(int)
+    ys = np.linspace(0, height - tile_h, tile_grid(height, tile, overlap)).round().astype(int)
+    return [(int(x), int(y), int(x) + tile_w, int(y) + tile_h) for y in ys for x in xs]
+
+
+def slice_image(image: np.ndarray, windows) -> list:
+    """Tile views into the decoded image (no pixel copies)"""
+    return [image[y0:y1, x0:x1] for x0, y0, x1, y1 in windows]
+
+
+def merge_detections(tile_detections, windows, iou_threshold: float = 0.5, extra=()) -> Detections:
+    """Shift tile detections into image coordinates and merge duplicates with class-aware NMS
+
+    Parameters:
+        tile_detections (list) -- one Detections per window, in tile pixels
+        windows (list)         -- the (x0, y0, x1, y1) window of each tile
+        iou_threshold (float)  -- overlapping boxes of the same class above this IoU are merged
+        extra (iterable)       -- Detections already in image coordinates (e.g. a full-frame pass)
+    """
+    parts = list(extra)
+    for detections, (x0, y0, _, _) in zip(tile_detections, windows):
+        if len(detections.cls):
+            offset = np.array([x0, y0, x0, y0], dtype=np.float32)
+            parts.append(detections._replace(xyxy=detections.xyxy + offset))
+    if not parts:
+        return Detections(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64))
+
+    xyxy = np.concatenate([p.xyxy for p in parts])
+    conf = np.concatenate([p.conf for p in parts])
+    cls = np.concatenate([p.cls for p in parts])
+    keep = batched_nms(
+        torch.from_numpy(xyxy), torch.from_numpy(conf), torch.from_numpy(cls), iou_threshold
+    ).numpy()
+    return Detections(xyxy[keep], conf[keep], cls[keep])
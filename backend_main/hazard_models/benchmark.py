@@ -0,0 +1,207 @@
+"""
+Benchmarks for the hazard detection service (hazard.py).
+
+Usage:
+    python benchmark.py workers test.jpeg --hazard-type crack --workers 1 2 4 --launchers prefork uvicorn
+    python benchmark.py encode test.jpeg --hazard-type crack --repeat 50
+    python benchmark.py preprocess test.jpeg --batch 4 --repeat 100
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+# Modules shared with the PPE service live in backend_main/shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.worker_benchmark import Service, compare_launchers
+
+
+# ===========================
+# Worker-count benchmark
+# ===========================
+def benchmark_workers(args):
+    with open(args.image, "rb") as f:
+        payload = f.read()
+    print(f"📷 {os.path.basename(args.image)} | {args.hazard_type} | "
+          f"{args.concurrency} clients x {args.duration:g} s | {os.cpu_count()} CPUs")
+    service = Service(os.path.dirname(os.path.abspath(__file__)), "hazard:app", "HAZARD_WORKERS", "/health",
+                      "/predict", {"hazard_type": args.hazard_type})
+    compare_launchers(service, payload, args.launchers, args.workers, args.port, args.timeout,
+                      args.concurrency, args.duration)
+
+
+# ===========================
+# Response encoding benchmark
+# ===========================
+# Name -> output_spec() options; "legacy" is the response before outputs= existed
+ENCODE_CONFIGS = {
+    "legacy": None,
+    "preview": {},
+    "preview-jpeg": {"image_format": "jpeg"},
+    "preview-webp": {"image_format": "webp"},
+    "mask-png": {"outputs": "mask"},
+    "mask-rle": {"outputs": "mask", "mask_format": "rle"},
+    "mask-bitpack": {"outputs": "mask", "mask_format": "bitpack"},
+    "all": {"outputs": "all"},
+    "all-compact": {"outputs": "all", "image_format": "webp", "mask_format": "rle"},
+    "all-multipart": {"outputs": "all", "response_format": "multipart"},
+}
+
+
+def legacy_payload(result: dict) -> bytes:
+    """JSON body as it was before outputs=: every image a base64 3-channel PNG"""
+    import cv2
+
+    encoded = {}
+    for field, img in result["images"].items():
+        if id(img) not in encoded:  # the crack preview was the fused PNG again
+            img = img() if callable(img) else img
+            if img.ndim == 2:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            encoded[id(result["images"][field])] = base64.b64encode(cv2.imencode(".png", img)[1]).decode("utf-8")
+    images = {field: encoded[id(img)] for field, img in result["images"].items()}
+    content = {key: value for key, value in result.items() if key != "images"}
+    content["processed_image"] = images.pop("processed_image")
+    content["extra_outputs"] = {**content["extra_outputs"], **images}
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+def encoded_payload(result: dict, spec) -> bytes:
+    """Response body of `result` as /predict sends it for `spec`"""
+    from response_encoding import encode_result, multipart_body
+
+    parts = []
+    content = encode_result(result, spec, parts)
+    if spec.response_format == "multipart":
+        return multipart_body(content, parts)[0]
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+def benchmark_encode(args):
+    import cv2
+    import hazard
+    from response_encoding import OutputSpec, output_spec
+
+    img = cv2.imread(args.image)
+    if img is None:
+        raise SystemExit(f"Could not read {args.image}")
+    hazard.load_all_models()
+    # One model pass; every configuration then encodes the same result
+    result = hazard.scheduler.queues[args.hazard_type].run_batch([img])[0]
+    print(f"📷 {os.path.basename(args.image)} | {args.hazard_type} | {args.repeat} encodes per configuration")
+
+    for name in args.configs:
+        options = ENCODE_CONFIGS[name]
+        if options is None:
+            encode = legacy_payload
+        else:
+            spec = output_spec(OutputSpec(quality=args.quality), **options)
+            encode = lambda result, spec=spec: encoded_payload(result, spec)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            payload = encode(result)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"  {name:>14}: encode mean {sum(timings) / len(timings) * 1000:7.2f} ms | "
+              f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:7.2f} ms | payload {len(payload) / 1024:8.1f} KB")
+
+
+# ===========================
+# Crack preprocessing benchmark
+# ===========================
+def legacy_crack_batch(images: list, dim: tuple):
+    """DeepCrack input as it was built before crack_preprocess: per image cvtColor, resize, PIL, ToTensor, Normalize"""
+    import cv2
+    import torch
+    import torchvision.transforms as transforms
+    from PIL import Image
+
+    tensors = []
+    for img in images:
+        img_transforms = transforms.Compose([
+            transforms.ToTensor(),
+            transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
+        ])
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img = cv2.resize(img, dim, interpolation=cv2.INTER_CUBIC)
+        tensors.append(img_transforms(Image.fromarray(img.copy())))
+    return torch.stack(tensors)
+
+
+def benchmark_preprocess(args):
+    import tracemalloc
+
+    import cv2
+    from crack_preprocess import CrackInputBuffer
+
+    img = cv2.imread(args.image)
+    if img is None:
+        raise SystemExit(f"Could not read {args.image}")
+    images = [img] * args.batch
+    dim = (args.size, args.size)
+    buffer = CrackInputBuffer(args.batch, dim)
+    pipelines = {"legacy": lambda: legacy_crack_batch(images, dim), "fused": lambda: buffer.batch(images)}
+    difference = (pipelines["legacy"]() - pipelines["fused"]()).abs().max().item()
+    print(f"📷 {os.path.basename(args.image)} {img.shape[1]}x{img.shape[0]} -> {args.size}x{args.size} | "
+          f"batches of {args.batch} | max difference {difference:.2e}")
+
+    for name, pipeline in pipelines.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            pipeline()
+            timings.append(time.perf_counter() - start)
+        # NumPy and PIL buffers only: torch's own allocator is not traced, so legacy is under-counted
+        tracemalloc.start()
+        pipeline()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        timings.sort()
+        print(f"  {name:>6}: {sum(timings) / len(timings) / args.batch * 1000:6.2f} ms/image | "
+              f"p95 {timings[int(len(timings) * 0.95) - 1] / args.batch * 1000:6.2f} ms/image | "
+              f"traced peak {peak / 1024:8.1f} KB per batch")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hazard service benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    workers_parser = subparsers.add_parser("workers", help="memory and throughput of the API versus worker count")
+    workers_parser.add_argument("image", help="image sent with every request")
+    workers_parser.add_argument("--hazard-type", default="crack", help="hazard_type sent with each request")
+    workers_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to test")
+    workers_parser.add_argument("--launchers", nargs="+", default=["prefork", "uvicorn"], choices=["prefork", "uvicorn"],
+                                help="prefork.py (shared models) and/or uvicorn --workers (models per worker)")
+    workers_parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    workers_parser.add_argument("--duration", type=float, default=20, help="seconds of load per configuration")
+    workers_parser.add_argument("--port", type=int, default=8099, help="port for the benchmarked server")
+    workers_parser.add_argument("--timeout", type=float, default=180, help="seconds to wait for the server to start")
+    workers_parser.set_defaults(func=benchmark_workers)
+
+    encode_parser = subparsers.add_parser("encode", help="response encode time and payload size per outputs/encoding")
+    encode_parser.add_argument("image", help="image run through the model once")
+    encode_parser.add_argument("--hazard-type", default="crack", help="detector whose result is encoded")
+    encode_parser.add_argument("--configs", nargs="+", default=list(ENCODE_CONFIGS), choices=list(ENCODE_CONFIGS),
+                               help="encodings to compare (legacy = seven base64 3-channel PNGs)")
+    encode_parser.add_argument("--repeat", type=int, default=50, help="encodes per configuration")
+    encode_parser.add_argument("--quality", type=int, default=80, help="JPEG/WebP quality")
+    encode_parser.set_defaults(func=benchmark_encode)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="DeepCrack preprocessing time and allocations")
+    preprocess_parser.add_argument("image", help="decoded once and preprocessed repeatedly")
+    preprocess_parser.add_argument("--batch", type=int, default=4, help="images per batch")
+    preprocess_parser.add_argument("--size", type=int, default=512, help="model input width and height")
+    preprocess_parser.add_argument("--repeat", type=int, default=100, help="batches per pipeline")
+    preprocess_parser.set_defaults(func=benchmark_preprocess)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
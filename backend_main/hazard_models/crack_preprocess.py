@@ -0,0 +1,72 @@
+"""
+DeepCrack input preprocessing.
+
+The model takes N x 3 x H x W float32 RGB in [-1, 1]. This used to be built
+per image as cv2.cvtColor -> cv2.resize -> Image.fromarray(img.copy()) ->
+ToTensor -> Normalize, with a new transforms.Compose on every call: a PIL
+round trip and six full-size intermediate images, then torch.stack copied
+the batch once more.
+
+`to_crack_batch` goes from decoded uint8 BGR frames straight to the model
+input. Each frame is resized into a reused uint8 scratch image (skipped when
+it already has the model's size), and one pass swaps BGR to RGB, reorders
+HWC to CHW and scales to x / 127.5 - 1, writing into its slot of the batch.
+`CrackInputBuffer` keeps the scratch image and the batch allocated between
+calls, one set per thread, so a crack worker allocates nothing per image.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+import torch
+
+SCALE = np.float32(1 / 127.5)   # [0, 255] -> [0, 2]; minus 1 gives the model's [-1, 1]
+
+
+def to_crack_batch(images: list, dim=(512, 512), out: np.ndarray = None, scratch: np.ndarray = None) -> torch.Tensor:
+    """N x 3 x H x W float32 DeepCrack input from decoded uint8 BGR images
+
+    Parameters:
+        images (list)        -- H x W x 3 uint8 BGR arrays, any size
+        dim (tuple)          -- model input (width, height); (0, 0) keeps the size of the images, which must then match
+        out (np.ndarray)     -- optional float32 array of at least len(images) x 3 x H x W to write the batch into
+        scratch (np.ndarray) -- optional H x W x 3 uint8 array for the resized frame
+    """
+    w, h = dim
+    if w <= 0 or h <= 0:
+        h, w = images[0].shape[:2]
+    if out is None:
+        out = np.empty((len(images), 3, h, w), dtype=np.float32)
+    if scratch is None or scratch.shape != (h, w, 3):
+        scratch = np.empty((h, w, 3), dtype=np.uint8)
+
+    for i, img in enumerate(images):
+        if img.shape[:2] != (h, w):
+            img = cv2.resize(img, (w, h), dst=scratch, interpolation=cv2.INTER_CUBIC)
+        # Channel swap and HWC -> CHW are strided views; the one write is the scaled float copy
+        np.multiply(img[:, :, ::-1].transpose(2, 0, 1), SCALE, out=out[i])
+        np.subtract(out[i], np.float32(1), out=out[i])
+    return torch.from_numpy(out[:len(images)])
+
+
+class CrackInputBuffer:
+    """Batch and resize buffers for `to_crack_batch`, allocated once per thread and reused
+
+    The tensor returned by `batch` is overwritten by the next call on the same
+    thread, so it must be consumed (run through the model) before then.
+    """
+
+    def __init__(self, max_batch: int, dim=(512, 512)):
+        self.max_batch = max(1, int(max_batch))
+        self.dim = dim
+        self._local = threading.local()
+
+    def batch(self, images: list) -> torch.Tensor:
+        """N x 3 x H x W model input for `images`, in this thread's buffer"""
+        w, h = self.dim
+        out = getattr(self._local, "out", None)
+        if out is None or out.shape[0] < len(images):
+            out = self._local.out = np.empty((max(self.max_batch, len(images)), 3, h, w), dtype=np.float32)
+            self._local.scratch = np.empty((h, w, 3), dtype=np.uint8)
+        return to_crack_batch(images, self.dim, out, self._local.scratch)
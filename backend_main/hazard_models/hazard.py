@@ -13,22 +13,28 @@ Supports: Fire detection (YOLO) and Crack segmentation (DeepCrack)
 """
 
 import os
+import sys
+import asyncio
 import io
+import queue
+import time
 import cv2
-import base64
 import torch
 import numpy as np
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+
+# Modules shared with the PPE service live in backend_main/shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import APIRouter, FastAPI, File, UploadFile, Form, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
-from PIL import Image
-import torchvision.transforms as transforms
 
 # Import ultralytics for fire model
 from ultralytics import YOLO
@@ -36,6 +42,31 @@ from ultralytics import YOLO
 # Import DeepCrack model utilities
 from models.deepcrack_model import DeepCrackModel
 
+# BGR frames -> normalized DeepCrack input batch in reused buffers
+from crack_preprocess import CrackInputBuffer
+
+# Per-stage latency metrics
+from metrics import (
+    BATCH_SIZE, IN_FLIGHT, QUALITY_REJECTIONS, QUEUE_DEPTH, QUEUE_WAIT_SECONDS, REQUEST_SECONDS, REQUESTS_TOTAL,
+    SHED_REQUESTS, UPLOAD_REJECTIONS, observe_stage, observe_yolo_speed, stage_timer
+)
+from shared.metrics_export import render_latest
+
+# Uncompressed frames from edge devices
+from shared.raw_frame import RawFrameError, to_bgr as raw_frame_to_bgr
+
+# Per-model batching queues with priority classes in front of the models
+from scheduler import PRIORITIES, DeadlineExceededError, InferenceScheduler, QueueFullError
+
+# Rejects frames too dark, overexposed or blurred to be worth a model pass
+from shared.quality import QualityThresholds, assess_quality, retake_response
+
+# Multipart parsing that refuses oversized or non-image uploads while they stream in
+from shared.upload_stream import UploadLimits, image_upload_route
+
+# Per-request choice of returned images and their encodings (PNG/JPEG/WebP, RLE/bit-packed masks, multipart)
+from response_encoding import OutputSpec, encode_result, multipart_body, output_spec
+
 # ===========================
 # Configuration
 # ===========================
@@ -57,6 +88,45 @@ class CrackModelOptions:
         self.lambda_fused = 1.0
 
 
+# Image quality gate (a threshold of 0 disables that check)
+QUALITY_GATE = os.getenv("HAZARD_QUALITY_GATE", "true").lower() in ("1", "true", "yes")
+QUALITY_SIZE = int(os.getenv("HAZARD_QUALITY_SIZE", 320))
+QUALITY_THRESHOLDS = QualityThresholds(
+    min_brightness=float(os.getenv("HAZARD_QUALITY_MIN_BRIGHTNESS", 30)),
+    max_brightness=float(os.getenv("HAZARD_QUALITY_MAX_BRIGHTNESS", 240)),
+    max_dark_fraction=float(os.getenv("HAZARD_QUALITY_MAX_DARK_FRACTION", 0.85)),
+    max_clipped_fraction=float(os.getenv("HAZARD_QUALITY_MAX_CLIPPED_FRACTION", 0.4)),
+    min_sharpness=float(os.getenv("HAZARD_QUALITY_MIN_SHARPNESS", 15)),
+)
+
+
+# Deadlines and queueing
+DEFAULT_DEADLINE_MS = float(os.getenv("HAZARD_DEFAULT_DEADLINE_MS", 0))  # for requests without one; 0 = none
+MAX_QUEUE = int(os.getenv("HAZARD_MAX_QUEUE", 32))
+RETRY_AFTER_SECONDS = int(os.getenv("HAZARD_RETRY_AFTER_SECONDS", 2))
+PRIORITY = os.getenv("HAZARD_DEFAULT_PRIORITY", "interactive")  # for requests that send none
+BATCH_WAIT_MS = float(os.getenv("HAZARD_BATCH_WAIT_MS", 5))  # longest a queued image waits for its batch to fill
+FIRE_WORKERS = int(os.getenv("HAZARD_FIRE_WORKERS", 1))  # fire batches run at once (one YOLO instance each)
+FIRE_MAX_BATCH = int(os.getenv("HAZARD_FIRE_MAX_BATCH", 4))
+CRACK_WORKERS = int(os.getenv("HAZARD_CRACK_WORKERS", 1))  # crack batches run at once (the model is shared)
+CRACK_MAX_BATCH = int(os.getenv("HAZARD_CRACK_MAX_BATCH", 4))
+RAW_MAX_PIXELS = int(os.getenv("HAZARD_RAW_MAX_PIXELS", 1920 * 1080))  # largest frame for /predict/raw
+
+
+# Upload limits for /predict, checked while the body streams in (0 = no limit)
+MAX_UPLOAD_BYTES = int(os.getenv("HAZARD_MAX_UPLOAD_BYTES", 32 * 1024 * 1024))
+MAX_UPLOAD_PIXELS = int(os.getenv("HAZARD_MAX_UPLOAD_PIXELS", 50_000_000))
+
+
+# Images returned by /predict and their encodings when the request does not choose (see response_encoding.py)
+OUTPUT_DEFAULTS = output_spec(
+    OutputSpec(quality=int(os.getenv("HAZARD_IMAGE_QUALITY", 80))),
+    outputs=os.getenv("HAZARD_DEFAULT_OUTPUTS", "preview"),
+    image_format=os.getenv("HAZARD_IMAGE_FORMAT", "png"),
+    mask_format=os.getenv("HAZARD_MASK_FORMAT", "png"),
+)
+
+
 # ===========================
 # Response Model
 # ===========================
@@ -64,8 +134,13 @@ class HazardResponse(BaseModel):
     hazard_type: str
     severity_label: str
     severity_percent: float
-    processed_image: str  # base64 encoded
+    processed_image: Optional[str] = None  # base64 encoded, or a multipart part name
     extra_outputs: Optional[dict] = None
+    encodings: Optional[dict] = None  # format of every image sent, e.g. {"processed_image": "png"}
+
+
+# Severity labels from least to most severe (ranks multi-hazard results)
+SEVERITY_LABELS = ("LOW", "MEDIUM", "HIGH", "CRITICAL")
 
 
 # ===========================
@@ -86,20 +161,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_arrival(request: Request, call_next):
+    """Client deadlines count from here, before the upload is received and parsed"""
+    if request.url.path.startswith("/predict"):
+        request.state.received_at = time.monotonic()
+    return await call_next(request)
+
+# /predict parses its multipart body as it streams in; OpenCV cannot decode GIF, so it is refused up front
+image_uploads = APIRouter(route_class=image_upload_route(UploadLimits(
+    max_file_bytes=MAX_UPLOAD_BYTES,
+    max_pixels=MAX_UPLOAD_PIXELS,
+    max_files=1,
+    formats=("jpeg", "png", "webp", "bmp", "tiff"),
+    on_reject=lambda reason: UPLOAD_REJECTIONS.labels(reason).inc(),
+)))
+
 # Global model instances
 fire_model = None
 crack_model = None
 crack_opt = None
 device = None
+models_loaded = False
+
+fire_instances = []             # one YOLO instance per fire worker
+fire_pool = queue.SimpleQueue()  # instances not in use right now
+crack_inputs = CrackInputBuffer(CRACK_MAX_BATCH, dim=(512, 512))  # one input batch per crack worker thread
+
+# Model calls run on per-model worker threads: interactive before bulk, then nearest deadline first
+scheduler = InferenceScheduler(
+    on_shed=lambda hazard_type, stage: SHED_REQUESTS.labels(hazard_type, stage).inc(),
+    on_depth=lambda hazard_type, depth: QUEUE_DEPTH.labels(hazard_type).set(depth),
+    on_wait=lambda hazard_type, priority, seconds: QUEUE_WAIT_SECONDS.labels(hazard_type, priority).observe(seconds),
+    on_batch=lambda hazard_type, size: BATCH_SIZE.labels(hazard_type).observe(size)
+)
 
 
 # ===========================
 # Model Loading
 # ===========================
-@app.on_event("startup")
-async def load_models():
-    """Load both Fire (YOLO) and Crack (DeepCrack) models on startup"""
-    global fire_model, crack_model, crack_opt, device
+def load_all_models():
+    """Load both Fire (YOLO) and Crack (DeepCrack) models into the module globals"""
+    global fire_model, crack_model, crack_opt, device, models_loaded
     
     print("=" * 80)
     print("LOADING HAZARD DETECTION MODELS")
@@ -120,7 +224,10 @@ async def load_models():
         fire_model_path = os.path.join(script_dir, 'fire_model.pt')
         fire_model = YOLO(fire_model_path)
         fire_model.to(device)
-        print("✓ Fire model loaded successfully!")
+        fire_instances[:] = [fire_model] + [YOLO(fire_model_path).to(device) for _ in range(FIRE_WORKERS - 1)]
+        for instance in fire_instances:
+            fire_pool.put(instance)
+        print(f"✓ Fire model loaded successfully! ({len(fire_instances)} instance(s))")
     except Exception as e:
         print(f"✗ Failed to load fire model: {e}")
         fire_model = None
@@ -156,173 +263,261 @@ async def load_models():
     print(f"Fire Model: {'✓ Ready' if fire_model else '✗ Not Available'}")
     print(f"Crack Model: {'✓ Ready' if crack_model else '✗ Not Available'}")
     print("=" * 80 + "\n")
+    models_loaded = True
+
+
+def warm_up_models():
+    """Run one blank image through both models so the fused YOLO layers and
+    first-call allocations exist before prefork.py forks the workers"""
+    for instance in fire_instances:
+        instance(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+    if crack_model is not None:
+        crack_model.predict(torch.zeros(1, 3, 512, 512))
+
+
+@app.on_event("startup")
+async def load_models():
+    """Load the models on startup, unless prefork.py already loaded them before forking"""
+    if not models_loaded:
+        load_all_models()
+    scheduler.start()
+    for name, model_queue in scheduler.queues.items():
+        print(f"📦 {name} queue: {model_queue.workers} worker(s), batches of up to {model_queue.max_batch}, "
+              f"waiting at most {BATCH_WAIT_MS:g} ms")
+
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    scheduler.stop()
 
 
 # ===========================
 # Helper Functions
 # ===========================
-def numpy_to_base64(img: np.ndarray) -> str:
-    """Convert numpy array to base64 encoded PNG"""
-    if img is None:
-        return ""
-    _, buffer = cv2.imencode('.png', img)
-    return base64.b64encode(buffer).decode('utf-8')
+def tensor_to_gray(input_image: torch.Tensor) -> np.ndarray:
+    """Single-channel uint8 map of a 1 x 1 x H x W DeepCrack visual in [-1, 1]"""
+    image_numpy = input_image[0, 0].cpu().float().numpy()
+    return ((image_numpy + 1) / 2.0 * 255.0).astype(np.uint8)
 
 
-def tensor2im(input_image, imtype=np.uint8):
-    """Convert tensor to numpy image"""
-    if not isinstance(input_image, np.ndarray):
-        if isinstance(input_image, torch.Tensor):
-            image_tensor = input_image.data
-        else:
-            return input_image
-        image_numpy = image_tensor[0].cpu().float().numpy()
-        if image_numpy.shape[0] == 1:
-            image_numpy = np.tile(image_numpy, (3, 1, 1))
-        image_numpy = (np.transpose(image_numpy, (1, 2, 0)) + 1) / 2.0 * 255.0
-    else:
-        image_numpy = input_image
-    return image_numpy.astype(imtype)
+def request_deadline(request: Request, header_ms, form_ms):
+    """time.monotonic() deadline from X-Deadline-Ms or deadline_ms (milliseconds the client will wait,
+    counted from when the request arrived), HAZARD_DEFAULT_DEADLINE_MS, or None"""
+    budget_ms = header_ms if header_ms is not None else form_ms
+    if budget_ms is None and DEFAULT_DEADLINE_MS > 0:
+        budget_ms = DEFAULT_DEADLINE_MS
+    if budget_ms is None:
+        return None
+    if budget_ms <= 0:
+        raise HTTPException(status_code=400, detail="deadline_ms must be a positive number of milliseconds")
+    received_at = getattr(request.state, "received_at", None) or time.monotonic()
+    return received_at + budget_ms / 1000.0
 
 
-def preprocess_image_for_crack(img_bytes: bytes, dim=(512, 512)) -> torch.Tensor:
-    """Preprocess image for DeepCrack model"""
-    img_transforms = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
-    ])
-    
-    img = np.frombuffer(img_bytes, np.uint8)
-    img = cv2.imdecode(img, cv2.IMREAD_COLOR)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    w, h = dim
-    if w > 0 and h > 0:
-        img = cv2.resize(img, (w, h), interpolation=cv2.INTER_CUBIC)
-    
-    img = img_transforms(Image.fromarray(img.copy()))
+def deadline_exceeded_error() -> HTTPException:
+    return HTTPException(status_code=504, detail="Deadline passed before the image could be analysed")
+
+
+def request_priority(priority) -> str:
+    """Priority class of a request: `priority` or HAZARD_DEFAULT_PRIORITY (400 if unknown)"""
+    priority = (priority or PRIORITY).lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid priority. Valid priorities: {', '.join(PRIORITIES)}")
+    return priority
+
+
+def request_output_spec(outputs, image_format, mask_format, response_format) -> OutputSpec:
+    """Images to return and their encodings: the request's choices over OUTPUT_DEFAULTS (400 if invalid)"""
+    try:
+        return output_spec(OUTPUT_DEFAULTS, outputs, image_format, mask_format, response_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def run_model(hazard_type: str, img: np.ndarray, deadline=None, priority: str = "interactive") -> dict:
+    """Queue an image on the model's scheduler queue and wait for its result"""
+    try:
+        return await scheduler.run(hazard_type, img, deadline, priority)
+    except QueueFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="Hazard detection is busy. Please retry shortly.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    except DeadlineExceededError:
+        raise deadline_exceeded_error()
+
+
+def decode_upload(img_bytes: bytes, hazard_type: str) -> np.ndarray:
+    """Decode uploaded bytes into a BGR array (400 if they are not an image)"""
+    with stage_timer(hazard_type, "decode"):
+        img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Invalid image file")
     return img
 
 
+def decode_raw_upload(frame: bytes, hazard_type: str) -> np.ndarray:
+    """BGR view of a /predict/raw body without any image decoding (400 if the frame is malformed)"""
+    with stage_timer(hazard_type, "decode"):
+        try:
+            return raw_frame_to_bgr(frame, RAW_MAX_PIXELS)
+        except RawFrameError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+def assess_upload_quality(img: np.ndarray, hazard_type: str):
+    """QualityReport of a decoded upload if it is too dark, overexposed or blurred to analyse, else None"""
+    if not QUALITY_GATE:
+        return None
+    with stage_timer(hazard_type, "quality_check"):
+        report = assess_quality(img, QUALITY_THRESHOLDS, QUALITY_SIZE)
+    if not report.problems:
+        return None
+    for problem in report.problems:
+        QUALITY_REJECTIONS.labels(hazard_type, problem).inc()
+    return report
+
+
 # ===========================
 # Fire Detection Logic
 # ===========================
-def detect_fire(img_bytes: bytes) -> dict:
-    """Run fire detection using YOLO model"""
+def detect_fire_batch(images: list) -> list:
+    """Run fire detection using YOLO model on a batch of decoded BGR images"""
     if fire_model is None:
         raise HTTPException(status_code=503, detail="Fire model not loaded")
     
-    # Decode image
-    nparr = np.frombuffer(img_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Run YOLO inference
-    results = fire_model(img, verbose=False)
-    
-    # Extract detections
-    detections = results[0].boxes
-    max_confidence = 0.0
-    
-    if len(detections) > 0:
-        confidences = detections.conf.cpu().numpy()
-        max_confidence = float(np.max(confidences))
-    
-    # Determine severity based on confidence
-    if max_confidence < 0.30:
-        severity_label = "LOW"
-    elif max_confidence < 0.60:
-        severity_label = "MEDIUM"
-    elif max_confidence < 0.85:
-        severity_label = "HIGH"
-    else:
-        severity_label = "CRITICAL"
+    # Each fire worker borrows its own YOLO instance: the ultralytics predictor is not thread-safe
+    model = fire_pool.get()
+    try:
+        # Run YOLO inference (preprocess/inference/NMS timings come from ultralytics)
+        results = model(images, verbose=False)
+    finally:
+        fire_pool.put(model)
+    return [fire_result(result) for result in results]
+
+
+def fire_result(result) -> dict:
+    """Response for one image from its ultralytics result"""
+    observe_yolo_speed("fire", result.speed)
     
-    # Draw boxes on image
-    annotated_img = results[0].plot()
+    with stage_timer("fire", "postprocess"):
+        # Extract detections
+        detections = result.boxes
+        max_confidence = 0.0
+        
+        if len(detections) > 0:
+            confidences = detections.conf.cpu().numpy()
+            max_confidence = float(np.max(confidences))
+        
+        # Determine severity based on confidence
+        if max_confidence < 0.30:
+            severity_label = "LOW"
+        elif max_confidence < 0.60:
+            severity_label = "MEDIUM"
+        elif max_confidence < 0.85:
+            severity_label = "HIGH"
+        else:
+            severity_label = "CRITICAL"
     
     return {
         "hazard_type": "fire",
         "severity_label": severity_label,
         "severity_percent": round(max_confidence * 100, 2),
-        "processed_image": numpy_to_base64(annotated_img),
         "extra_outputs": {
             "num_detections": len(detections),
             "max_confidence": round(max_confidence, 4)
-        }
+        },
+        # Unencoded images for encode_result; the boxes are only drawn if the preview is requested
+        "images": {"processed_image": result.plot}
     }
 
 
 # ===========================
 # Crack Detection Logic
 # ===========================
-def detect_crack(img_bytes: bytes) -> dict:
-    """Run crack detection using DeepCrack model"""
+def detect_crack_batch(images: list) -> list:
+    """Run crack detection using DeepCrack model on a batch of decoded BGR images"""
     if crack_model is None:
         raise HTTPException(status_code=503, detail="Crack model not loaded")
     
-    # Preprocess image (resize to 512x512 as per requirements)
-    image_tensor = preprocess_image_for_crack(img_bytes, dim=(512, 512))
-    image_tensor = image_tensor.unsqueeze(0)  # Add batch dimension
+    # Preprocess images (resize to 512x512 as per requirements) straight into this worker's batch buffer
+    start = time.perf_counter()
+    image_tensor = crack_inputs.batch(images)
+    observe_stage("crack", "preprocess", (time.perf_counter() - start) / len(images))
     
-    # Set input for model
-    crack_model.set_input({
-        'image': image_tensor,
-        'label': torch.zeros_like(image_tensor),
-        'A_paths': 'uploaded_image'
-    })
+    start = time.perf_counter()
+    # Stateless call: nothing is stored on the shared model, so crack workers can run side by side
+    visuals = crack_model.to_visuals(crack_model.predict(image_tensor))
+    observe_stage("crack", "inference", (time.perf_counter() - start) / len(images))
     
-    # Run inference
-    crack_model.test()
-    
-    # Get visual results
-    visuals = crack_model.get_current_visuals()
-    
-    # Convert fused output to numpy
-    fused_output = tensor2im(visuals['fused'])
-    
-    # Convert to grayscale for analysis
-    fused_gray = cv2.cvtColor(fused_output, cv2.COLOR_BGR2GRAY)
-    
-    # Calculate severity percentage
-    binary_mask = (fused_gray > 90).astype(np.uint8) * 255
-    total_pixels = binary_mask.size
-    crack_pixels = np.sum(binary_mask) / 255
-    severity_percent = (crack_pixels / total_pixels) * 100
-    
-    # Determine severity label based on crack pixel percentage
-    if severity_percent < 1.0:
-        severity_label = "LOW"
-    elif severity_percent < 5.0:
-        severity_label = "MEDIUM"
-    elif severity_percent < 10.0:
-        severity_label = "HIGH"
-    else:
-        severity_label = "CRITICAL"
-    
-    # Prepare extra outputs with all side outputs and fused mask
-    extra_outputs = {
-        "fused": numpy_to_base64(fused_output),
-        "binary_mask": numpy_to_base64(binary_mask),
-        "crack_pixels": int(crack_pixels),
-        "total_pixels": int(total_pixels)
-    }
+    return [crack_result({name: output[i:i + 1] for name, output in visuals.items()}) for i in range(len(images))]
+
+
+def crack_result(visuals: dict) -> dict:
+    """Response for one image from its fused and side maps"""
+    with stage_timer("crack", "postprocess"):
+        # Convert fused output to a grayscale map
+        fused_gray = tensor_to_gray(visuals['fused'])
+        
+        # Calculate severity percentage
+        binary_mask = (fused_gray > 90).astype(np.uint8) * 255
+        total_pixels = binary_mask.size
+        crack_pixels = np.sum(binary_mask) / 255
+        severity_percent = (crack_pixels / total_pixels) * 100
+        
+        # Determine severity label based on crack pixel percentage
+        if severity_percent < 1.0:
+            severity_label = "LOW"
+        elif severity_percent < 5.0:
+            severity_label = "MEDIUM"
+        elif severity_percent < 10.0:
+            severity_label = "HIGH"
+        else:
+            severity_label = "CRITICAL"
     
-    # Add all side outputs
-    if crack_opt.display_sides:
-        for i in range(1, 6):
-            side_key = f'side{i}'
-            if side_key in visuals:
-                extra_outputs[side_key] = numpy_to_base64(tensor2im(visuals[side_key]))
+    # Unencoded maps for encode_result: the preview is the fused map, side outputs are converted on request
+    images = {"processed_image": fused_gray, "fused": fused_gray, "binary_mask": binary_mask}
+    for i in range(1, 6):
+        side_key = f'side{i}'
+        if side_key in visuals:
+            images[side_key] = lambda side=visuals[side_key]: tensor_to_gray(side)
     
     return {
         "hazard_type": "crack",
         "severity_label": severity_label,
         "severity_percent": round(severity_percent, 2),
-        "processed_image": numpy_to_base64(fused_output),
-        "extra_outputs": extra_outputs
+        "extra_outputs": {
+            "crack_pixels": int(crack_pixels),
+            "total_pixels": int(total_pixels)
+        },
+        "images": images
     }
 
 
+# ===========================
+# Detector Registry
+# ===========================
+def register_detector(hazard_type: str, run_batch, **queue_options):
+    """Serve `hazard_type` with `run_batch` (list of decoded BGR images -> one result dict each,
+    with its unencoded images under "images", see response_encoding.encode_result)
+
+    Every detector gets its own scheduler queue, so a backlog of crack surveys never
+    delays a fire check, and is run by hazard_type=all. Hazard types without a detector
+    (gas, obstruction, ...) answer "Model under development".
+    """
+    options = {"max_wait_ms": BATCH_WAIT_MS, "max_queue": MAX_QUEUE, **queue_options}
+    scheduler.add_model(hazard_type, run_batch, **options)
+
+
+def registered_hazards() -> list:
+    return list(scheduler.queues)
+
+
+register_detector("fire", detect_fire_batch, workers=FIRE_WORKERS, max_batch=FIRE_MAX_BATCH)
+register_detector("crack", detect_crack_batch, workers=CRACK_WORKERS, max_batch=CRACK_MAX_BATCH)
+
+
 # ===========================
 # API Endpoints
 # ===========================
@@ -336,7 +531,10 @@ async def root():
         "models": {
             "fire": fire_model is not None,
             "crack": crack_model is not None
-        }
+        },
+        "hazard_types": registered_hazards(),
+        "quality_gate": {"size": QUALITY_SIZE, **QUALITY_THRESHOLDS._asdict()} if QUALITY_GATE else None,
+        "upload_limits": {"max_bytes": MAX_UPLOAD_BYTES, "max_pixels": MAX_UPLOAD_PIXELS}
     }
 
 
@@ -346,6 +544,8 @@ async def health_check():
     return {
         "status": "healthy",
         "device": str(device),
+        "queue_depth": scheduler.depth,
+        "queues": scheduler.stats(),
         "models_loaded": {
             "fire": fire_model is not None,
             "crack": crack_model is not None
@@ -353,54 +553,208 @@ async def health_check():
     }
 
 
-@app.post("/predict")
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms and in-flight requests"""
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
+
+@image_uploads.post("/predict")
 async def predict(
+    request: Request,
     file: UploadFile = File(...),
-    hazard_type: str = Form(...)
+    hazard_type: str = Form(...),
+    deadline_ms: float = Form(None),
+    priority: str = Form(None),
+    outputs: str = Form(None),
+    image_format: str = Form(None),
+    mask_format: str = Form(None),
+    response_format: str = Form(None),
+    x_deadline_ms: float = Header(None)
 ):
     """
     Unified hazard detection endpoint
     
     Args:
         file: Uploaded image file
-        hazard_type: Type of hazard ("fire", "crack", "gas", "obstruction", etc.)
+        hazard_type: Type of hazard ("fire", "crack", "gas", "obstruction", etc.), a comma-separated
+            list of them, or "all" to run every available model on the one upload
+        deadline_ms (or X-Deadline-Ms header): how long the client will wait; requests still
+            queued when it passes are dropped before inference and answered with 504
+        priority: "interactive" (someone is waiting for the answer, the default) or "bulk"
+            (survey uploads); interactive images are always run first
+        outputs: images to return: "preview", "fused", "mask", "sides", a comma-separated list
+            of them, "all" or "none" (default HAZARD_DEFAULT_OUTPUTS, "preview")
+        image_format: "png", "jpeg" or "webp" for the preview, fused and side maps
+        mask_format: "png", "rle" or "bitpack" for the binary mask
+        response_format: "json" (base64 images) or "multipart" (raw image parts, no base64)
+    
+    Returns:
+        JSON response with detection results or development status,
+        or 422 with retake_photo=true when the photo is too dark, overexposed or blurred to analyse
+    """
+    return await predict_image(request, file.read, decode_upload, hazard_type, deadline_ms, x_deadline_ms, priority,
+                               (outputs, image_format, mask_format, response_format))
+
+
+@app.post("/predict/raw")
+async def predict_raw(
+    request: Request,
+    hazard_type: str,
+    deadline_ms: float = None,
+    priority: str = None,
+    outputs: str = None,
+    image_format: str = None,
+    mask_format: str = None,
+    response_format: str = None,
+    x_deadline_ms: float = Header(None)
+):
+    """
+    Hazard detection for uncompressed frames from edge devices
+    
+    Args:
+        body: one raw frame (application/octet-stream): 16-byte RAWF header, then
+            GRAY8/RGB24/BGR24 pixels (see shared/raw_frame.py)
+        hazard_type, deadline_ms, priority, outputs, image_format, mask_format, response_format:
+            query parameters, as for /predict
     
     Returns:
-        JSON response with detection results or development status
+        The same responses as /predict
     """
+    return await predict_image(request, request.body, decode_raw_upload, hazard_type, deadline_ms, x_deadline_ms, priority,
+                               (outputs, image_format, mask_format, response_format))
+
+
+def requested_hazards(hazard_type: str) -> list:
+    """Hazard types asked for: one type, a comma-separated list, or "all" registered detectors"""
+    hazard_type = hazard_type.strip().lower()
+    if hazard_type == "all":
+        return registered_hazards()
+    hazards = list(dict.fromkeys(h.strip() for h in hazard_type.split(",") if h.strip()))
+    if not hazards:
+        raise HTTPException(status_code=400, detail="hazard_type must name at least one hazard")
+    return hazards
+
+
+def under_development(hazard_type: str) -> dict:
+    """Placeholder result for hazard types without a model yet (gas, obstruction, etc.)"""
+    return {"hazard_type": hazard_type, "message": "Model under development"}
+
+
+async def detect_hazard(hazard_type: str, img: np.ndarray, deadline, priority: str) -> dict:
+    """One entry of a multi-hazard response: the model's result, or the error it ran into"""
+    if hazard_type not in scheduler.queues:
+        return under_development(hazard_type)
     try:
+        return await run_model(hazard_type, img, deadline, priority)
+    except HTTPException as e:
+        return {"hazard_type": hazard_type, "status_code": e.status_code, "detail": e.detail}
+
+
+def combined_response(hazard_type: str, results: list) -> dict:
+    """Multi-hazard response: every result keyed by hazard type, plus the most severe finding"""
+    scored = [r for r in results if r.get("severity_label") in SEVERITY_LABELS]
+    top = max(scored, key=lambda r: (SEVERITY_LABELS.index(r["severity_label"]), r["severity_percent"]),
+              default=None)
+    return {
+        "hazard_type": hazard_type,
+        "results": {r["hazard_type"]: r for r in results},
+        "top_hazard": top["hazard_type"] if top else None,
+        "severity_label": top["severity_label"] if top else None,
+        "severity_percent": top["severity_percent"] if top else None
+    }
+
+
+def encoded_response(hazard_type: str, results: list, spec: OutputSpec, multi: bool) -> Response:
+    """JSON or multipart response with the requested images of `results` encoded as asked"""
+    parts = []
+    results = [encode_result(result, spec, parts) for result in results]
+    content = combined_response(hazard_type, results) if multi else results[0]
+    if spec.response_format == "multipart":
+        body, content_type = multipart_body(content, parts)
+        return Response(content=body, media_type=content_type)
+    return JSONResponse(content=content)
+
+
+async def predict_image(request: Request, read_body, decode, hazard_type: str, deadline_ms=None, x_deadline_ms=None, priority=None,
+                        output_options=(None, None, None, None)):
+    """Shared body of /predict and /predict/raw: `read_body()` returns the upload, `decode` turns it into BGR,
+    `output_options` are the request's (outputs, image_format, mask_format, response_format)"""
+    # Normalize hazard type to lowercase
+    hazard_type_lower = hazard_type.strip().lower()
+    hazards = requested_hazards(hazard_type)
+    multi = hazard_type_lower == "all" or len(hazards) > 1
+    if multi:
+        metric_label = "all"
+    else:
+        metric_label = hazards[0] if hazards[0] in scheduler.queues else "other"
+    modelled = [h for h in hazards if h in scheduler.queues]
+    start = time.perf_counter()
+    status = 500
+    IN_FLIGHT.inc()
+    
+    try:
+        deadline = request_deadline(request, x_deadline_ms, deadline_ms)
+        priority = request_priority(priority)
+        spec = request_output_spec(*output_options)
+        
         # Read uploaded file
-        contents = await file.read()
+        with stage_timer(metric_label, "upload_read"):
+            contents = await read_body()
         
-        # Normalize hazard type to lowercase
-        hazard_type_lower = hazard_type.lower()
+        # Decode once for every model; unusable photos are sent back before paying for a model pass
+        img = None
+        if modelled:
+            if deadline is not None and time.monotonic() >= deadline:
+                SHED_REQUESTS.labels(metric_label, "admission").inc()
+                raise deadline_exceeded_error()
+            img = decode(contents, metric_label)
+            report = assess_upload_quality(img, metric_label)
+            if report is not None:
+                status = 422
+                return JSONResponse(
+                    status_code=422,
+                    content={"hazard_type": hazard_type_lower, **retake_response(report)}
+                )
         
-        # Route to appropriate model
-        if hazard_type_lower == "fire":
-            result = detect_fire(contents)
-            return JSONResponse(content=result)
+        if multi:
+            # Fan out: the same decoded array goes to every model's queue, and the models run side by side
+            results = await asyncio.gather(*(detect_hazard(h, img, deadline, priority) for h in hazards))
+            # Image encoding is CPU work: keep it off the event loop
+            with stage_timer(metric_label, "serialization"):
+                response = await run_in_threadpool(encoded_response, hazard_type_lower, results, spec, True)
+            status = 200
+            return response
         
-        elif hazard_type_lower == "crack":
-            result = detect_crack(contents)
-            return JSONResponse(content=result)
+        # Route to appropriate model
+        if modelled:
+            result = await run_model(metric_label, img, deadline, priority)
+            with stage_timer(metric_label, "serialization"):
+                response = await run_in_threadpool(encoded_response, metric_label, [result], spec, False)
+            status = 200
+            return response
         
         else:
             # Placeholder for models under development (gas, obstruction, etc.)
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "hazard_type": hazard_type,
-                    "message": "Model under development"
-                }
-            )
+            status = 200
+            return JSONResponse(status_code=200, content=under_development(hazard_type))
     
     except HTTPException as he:
+        status = he.status_code
         raise he
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Prediction failed: {str(e)}"
         )
+    finally:
+        IN_FLIGHT.dec()
+        REQUEST_SECONDS.labels(metric_label).observe(time.perf_counter() - start)
+        REQUESTS_TOTAL.labels(metric_label, str(status)).inc()
+
+
+app.include_router(image_uploads)
 
 
 if __name__ == "__main__":
@@ -6,7 +6,7 @@ import numpy as np
 from PIL import Image
 from io import BytesIO
 from cv2_utils import getContours
-import torchvision.transforms as transforms
+from crack_preprocess import to_crack_batch
 from models.deepcrack_model import DeepCrackModel
 
 def tensor2im(input_image, imtype=np.uint8):
@@ -34,21 +34,11 @@ def bytes_to_array(b: bytes) -> np.ndarray:
     return np.load(np_bytes, allow_pickle=True)
 
 def read_image(bytesImg, dim=(256, 256)):
-    img_transforms = transforms.Compose([transforms.ToTensor(),
-                                                transforms.Normalize((0.5, 0.5, 0.5),
-                                                                       (0.5, 0.5, 0.5))])
-    img = np.fromstring(bytesImg, np.uint8)
+    img = np.frombuffer(bytesImg, np.uint8)
     img = cv2.imdecode(img, cv2.IMREAD_COLOR)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     
-    # adjust the image size
-    w, h = dim
-    if w > 0 or h > 0:
-        img = cv2.resize(img, (w, h), interpolation=cv2.INTER_CUBIC)
-    
-    # apply the transform to both A and B
-    img = img_transforms(Image.fromarray(img.copy()))   
-    return img    
+    # resize, BGR -> RGB and normalize to [-1, 1] in one pass (3 x H x W)
+    return to_crack_batch([img], dim)[0]
 
 def create_model(opt, cp_path='pretrained_net_G.pth'):
     model = DeepCrackModel(opt)      # create a model given opt.model and other options
@@ -99,10 +89,7 @@ def inference(model, bytesImg, dim, unit):
     image = read_image(bytesImg)
     # batchify
     image = image.unsqueeze(0)
-    # hacky way to pass ground truth label
-    model.set_input({'image': image, 'label': torch.zeros_like(image), 'A_paths':''}) 
-    model.test()           # run inference
-    visuals = model.get_current_visuals()  # get image results
+    visuals = model.to_visuals(model.predict(image))  # run inference; no label or model state needed
     confidence = visuals['fused'].max()
 
     # fused for final prediction
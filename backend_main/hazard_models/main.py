@@ -185,18 +185,8 @@ async def predict(file: UploadFile = File(...)):
         image_tensor = read_image(contents, dim=(256, 256))
         image_tensor = image_tensor.unsqueeze(0)  # Add batch dimension
         
-        # Set input for the model
-        model.set_input({
-            'image': image_tensor, 
-            'label': torch.zeros_like(image_tensor), 
-            'A_paths': file.filename
-        })
-        
-        # Run inference
-        model.test()
-        
-        # Get visual results
-        visuals = model.get_current_visuals()
+        # Run inference (stateless, so concurrent requests cannot see each other's results)
+        visuals = model.to_visuals(model.predict(image_tensor))
         
         # Extract confidence from fused output
         confidence = visuals['fused'].max().item()
@@ -0,0 +1,90 @@
+"""
+Prometheus metrics for the hazard detection API.
+
+Requests are timed per stage (upload read, decode, preprocess, inference,
+postprocess, serialization) and labelled with the hazard type, so fire and
+crack latency can be compared on the same dashboard. Served at /metrics
+(multi-worker merging is in shared/metrics_export.py).
+"""
+
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+STAGE_SECONDS = Histogram(
+    "hazard_stage_seconds",
+    "Time spent in each stage of a hazard prediction",
+    ["hazard_type", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "hazard_request_seconds",
+    "End-to-end latency of /predict requests",
+    ["hazard_type"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_TOTAL = Counter(
+    "hazard_requests_total",
+    "Hazard predictions by hazard type and HTTP status",
+    ["hazard_type", "status"],
+)
+QUALITY_REJECTIONS = Counter(
+    "hazard_quality_rejections_total",
+    "Uploads answered with a retake-photo response, by hazard type and quality problem",
+    ["hazard_type", "problem"],
+)
+UPLOAD_REJECTIONS = Counter(
+    "hazard_upload_rejections_total",
+    "Uploads refused while streaming in: too_large, too_many_pixels or unsupported_format",
+    ["reason"],
+)
+SHED_REQUESTS = Counter(
+    "hazard_shed_requests_total",
+    "Predictions dropped unrun: the client's deadline passed, or a more urgent call displaced them",
+    ["hazard_type", "stage"],
+)
+QUEUE_DEPTH = Gauge(
+    "hazard_queue_depth",
+    "Images waiting in a model's inference queue",
+    ["hazard_type"],
+    multiprocess_mode="livesum",
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "hazard_queue_wait_seconds",
+    "Time from queueing to the start of the model batch, by model and priority class",
+    ["hazard_type", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+BATCH_SIZE = Histogram(
+    "hazard_batch_size",
+    "Images per model batch",
+    ["hazard_type"],
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+IN_FLIGHT = Gauge("hazard_in_flight_requests", "Predictions currently being processed", multiprocess_mode="livesum")
+
+
+@contextmanager
+def stage_timer(hazard_type: str, stage: str):
+    """Time the enclosed block as one stage of a prediction"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(hazard_type, stage).observe(time.perf_counter() - start)
+
+
+def observe_stage(hazard_type: str, stage: str, seconds: float):
+    STAGE_SECONDS.labels(hazard_type, stage).observe(seconds)
+
+
+def observe_yolo_speed(hazard_type: str, speed: dict):
+    """Record ultralytics' preprocess/inference/postprocess timings (reported in milliseconds)"""
+    for stage in ("preprocess", "inference", "postprocess"):
+        if speed.get(stage) is not None:
+            STAGE_SECONDS.labels(hazard_type, stage).observe(speed[stage] / 1000.0)
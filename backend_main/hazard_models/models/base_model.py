@@ -106,6 +106,15 @@ class BaseModel(ABC):
             self.forward()
             self.compute_visuals()
 
+    @abstractmethod
+    def predict(self, images):
+        """Inference without side effects: return the network outputs for a batch of <images>.
+
+        Unlike <set_input> + <test>, nothing is stored on the model, so one instance can
+        serve several threads at once.
+        """
+        pass
+
     def compute_visuals(self):
         """Calculate additional output images for visdom and HTML visualization"""
         pass
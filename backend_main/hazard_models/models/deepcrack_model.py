@@ -3,6 +3,7 @@
 import torch
 import numpy as np
 import itertools
+from collections import OrderedDict
 from .base_model import BaseModel
 from .deepcrack_networks import define_deepcrack, BinaryFocalLoss
 
@@ -93,6 +94,28 @@ class DeepCrackModel(BaseModel):
             self.side4 = (torch.sigmoid(self.outputs[3])-0.5)/0.5
             self.side5 = (torch.sigmoid(self.outputs[4])-0.5)/0.5
 
+    def predict(self, images):
+        """Stateless inference on a batch; safe to call concurrently on a shared model.
+
+        Parameters:
+            images (tensor) -- N x 3 x H x W batch normalized to [-1, 1]
+
+        Returns:
+            OrderedDict of N x 1 x H x W logits: 'fused', then 'side1'..'side5' when display_sides is set
+        """
+        with torch.no_grad():
+            outputs = self.netG(images.to(self.device))
+        logits = OrderedDict(fused=outputs[-1])
+        if self.display_sides:
+            for i, side in enumerate(outputs[:-1], 1):
+                logits['side%d' % i] = side
+        return logits
+
+    @staticmethod
+    def to_visuals(logits):
+        """Map <predict> logits to the [-1, 1] maps returned by <get_current_visuals>"""
+        return OrderedDict((name, (torch.sigmoid(out) - 0.5) / 0.5) for name, out in logits.items())
+
     def backward(self):
         """Calculate the loss"""
         lambda_side = self.opt.lambda_side
@@ -3,6 +3,7 @@
 import torch
 import numpy as np
 import itertools
+from collections import OrderedDict
 from .base_model import BaseModel
 import torch.nn.functional as F
 from .roadnet_networks import define_roadnet
@@ -90,6 +91,19 @@ class RoadNetModel(BaseModel):
         centerlines_fused = (torch.sigmoid(self.centerlines[-1])-0.5)/0.5
         self.label_pred = torch.cat([centerlines_fused, edge_fused, segment_fused], dim=1)
 
+    def predict(self, images):
+        """Stateless inference on a batch; safe to call concurrently on a shared model.
+
+        Parameters:
+            images (tensor) -- N x 3 x H x W batch normalized to [-1, 1]
+
+        Returns:
+            OrderedDict of N x 1 x H x W fused logits: 'segment', 'edge' and 'centerline'
+        """
+        with torch.no_grad():
+            segments, edges, centerlines = self.netG(images.to(self.device))
+        return OrderedDict(segment=segments[-1], edge=edges[-1], centerline=centerlines[-1])
+
     def backward(self):
         """Calculate the loss"""
         self.loss_segment = torch.mean((torch.sigmoid(self.segments[-1])-self.segment_gt)**2) * 0.5
@@ -0,0 +1,42 @@
+"""
+Pre-fork multi-worker serving for the Hazard Detection API.
+
+With `uvicorn hazard:app --workers N` every worker runs the startup event
+and loads the fire YOLO model and DeepCrack on its own. This launcher loads
+and warms both models once in the parent and forks the workers from it
+(see shared/prefork.py); their startup event sees the models already loaded
+and skips loading.
+
+Usage:
+    HAZARD_WORKERS=4 python prefork.py
+"""
+
+import os
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Modules shared with the PPE service live in backend_main/shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.prefork import serve
+
+WORKERS = max(1, int(os.getenv("HAZARD_WORKERS", 2)))
+TORCH_THREADS = int(os.getenv("HAZARD_TORCH_THREADS", 0))  # 0 = split the cores evenly
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8080))
+
+
+def load_app():
+    """Import hazard.py, load both models and warm them up"""
+    import hazard
+    hazard.load_all_models()
+    hazard.warm_up_models()
+    return hazard.app
+
+
+if __name__ == "__main__":
+    serve(load_app, "Hazard Detection API", int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS, HOST, PORT,
+          torch_threads=TORCH_THREADS, metrics_prefix="hazard-metrics-")
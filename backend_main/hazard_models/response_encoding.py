@@ -0,0 +1,185 @@
+"""
+Response encoding for hazard predictions.
+
+A crack prediction used to PNG-encode and base64 seven 512x512 images
+(processed image, fused map, binary mask and five side outputs), each
+expanded to three channels from single-channel data. That was most of the
+response time and of the mobile data used, for images the app never shows.
+Detectors now return their maps unencoded, and the request chooses:
+
+- `outputs`: which images to send. "preview" (processed_image), "fused",
+  "mask" (binary_mask) and "sides" (side1..side5), a comma-separated list,
+  "all" or "none". Scalars (severity, pixel counts, detections) are always sent.
+- `image_format`: "png", "jpeg" or "webp" for the preview, fused and side
+  maps. Single-channel maps stay single-channel in every format.
+- `mask_format`: "png", "rle" or "bitpack" for the binary mask.
+    rle      {"encoding": "rle", "size": [h, w], "counts": [...]}: lengths
+             of alternating runs over the row-major mask, starting with a
+             run of background (which may be 0)
+    bitpack  {"encoding": "bitpack", "size": [h, w], "bits": ...}: one bit
+             per pixel, row-major, most significant bit first
+- `response_format`: "json" (images as base64 strings) or "multipart": a
+  multipart/form-data body whose "result" part is the JSON and whose other
+  parts are the raw image bytes, referenced from the JSON by part name
+  ("crack.fused") instead of base64.
+
+Every response lists the format of each image sent under "encodings".
+"""
+
+import base64
+import json
+import uuid
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+# Selector -> response fields, in response order
+OUTPUT_FIELDS = {
+    "preview": ("processed_image",),
+    "fused": ("fused",),
+    "mask": ("binary_mask",),
+    "sides": tuple(f"side{i}" for i in range(1, 6)),
+}
+MASK_FIELDS = frozenset({"binary_mask"})
+
+IMAGE_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+MASK_FORMATS = ("png", "rle", "bitpack")
+RESPONSE_FORMATS = ("json", "multipart")
+
+
+class OutputSpec(NamedTuple):
+    outputs: frozenset = frozenset({"preview"})
+    image_format: str = "png"
+    mask_format: str = "png"
+    response_format: str = "json"
+    quality: int = 80       # JPEG / WebP quality
+
+
+def parse_outputs(value: str) -> frozenset:
+    """Output selector: a comma-separated list of OUTPUT_FIELDS names, "all" or "none" (ValueError if unknown)"""
+    names = {name.strip() for name in value.lower().split(",") if name.strip()}
+    if names == {"all"}:
+        return frozenset(OUTPUT_FIELDS)
+    if names <= {"none"}:
+        return frozenset()
+    unknown = names - set(OUTPUT_FIELDS)
+    if unknown:
+        raise ValueError(f"Invalid outputs: {', '.join(sorted(unknown))}. "
+                         f"Valid outputs: {', '.join(OUTPUT_FIELDS)}, all, none")
+    return frozenset(names)
+
+
+def output_spec(defaults: OutputSpec, outputs=None, image_format=None, mask_format=None,
+                response_format=None) -> OutputSpec:
+    """`defaults` with the request's choices applied (ValueError for unknown values)"""
+    spec = defaults._replace(
+        outputs=defaults.outputs if outputs is None else parse_outputs(outputs),
+        image_format=(image_format or defaults.image_format).lower(),
+        mask_format=(mask_format or defaults.mask_format).lower(),
+        response_format=(response_format or defaults.response_format).lower(),
+    )
+    if spec.image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Invalid image_format. Valid formats: {', '.join(IMAGE_FORMATS)}")
+    if spec.mask_format not in MASK_FORMATS:
+        raise ValueError(f"Invalid mask_format. Valid formats: {', '.join(MASK_FORMATS)}")
+    if spec.response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Invalid response_format. Valid formats: {', '.join(RESPONSE_FORMATS)}")
+    return spec
+
+
+def encode_image(img: np.ndarray, image_format: str, quality: int = 80) -> bytes:
+    """PNG, JPEG or WebP bytes of a BGR or single-channel image"""
+    if image_format == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif image_format == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = []
+    ok, buffer = cv2.imencode(f".{image_format}", img, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {image_format}")
+    return buffer.tobytes()
+
+
+def rle_counts(mask: np.ndarray) -> list:
+    """Alternating background/foreground run lengths of a mask, row-major, starting with background"""
+    flat = mask.reshape(-1) > 0
+    if flat.size == 0:
+        return []
+    edges = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], edges, [flat.size])))
+    return ([0] if flat[0] else []) + counts.tolist()
+
+
+def bitpack(mask: np.ndarray) -> bytes:
+    """One bit per pixel, row-major, most significant bit first"""
+    return np.packbits(mask.reshape(-1) > 0).tobytes()
+
+
+def encode_result(result: dict, spec: OutputSpec, parts: list) -> dict:
+    """Response body of one detector result, its unencoded "images" replaced by the requested encodings
+
+    For multipart responses the encoded bytes are appended to `parts` as
+    (name, media type, bytes) and the response references them by name.
+    """
+    images = result.get("images")
+    if images is None:
+        return result
+    response = {key: value for key, value in result.items() if key != "images"}
+    extra_outputs = dict(response.get("extra_outputs") or {})
+    encodings = {}
+
+    def attach(field: str, data: bytes, media_type: str) -> str:
+        if spec.response_format == "multipart":
+            name = f"{result['hazard_type']}.{field}"
+            parts.append((name, media_type, data))
+            return name
+        return base64.b64encode(data).decode("ascii")
+
+    for output, fields in OUTPUT_FIELDS.items():
+        if output not in spec.outputs:
+            continue
+        for field in fields:
+            if field not in images:
+                continue
+            # Maps that are costly to produce are passed as callables and only built when requested
+            img = images[field]() if callable(images[field]) else images[field]
+            if field not in MASK_FIELDS or spec.mask_format == "png":
+                image_format = "png" if field in MASK_FIELDS else spec.image_format
+                value = attach(field, encode_image(img, image_format, spec.quality), IMAGE_FORMATS[image_format])
+                encodings[field] = image_format
+            elif spec.mask_format == "rle":
+                value = {"encoding": "rle", "size": list(img.shape[:2]), "counts": rle_counts(img)}
+                encodings[field] = "rle"
+            else:
+                value = {"encoding": "bitpack", "size": list(img.shape[:2]),
+                         "bits": attach(field, bitpack(img), "application/octet-stream")}
+                encodings[field] = "bitpack"
+            if field == "processed_image":
+                response[field] = value
+            else:
+                extra_outputs[field] = value
+
+    response["extra_outputs"] = extra_outputs
+    response["encodings"] = encodings
+    return response
+
+
+def multipart_body(payload: dict, parts: list) -> tuple:
+    """(body, content type) of a multipart/form-data response: the JSON "result" part, then `parts`"""
+    boundary = uuid.uuid4().hex
+    chunks = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="result"\r\n'
+        f'Content-Type: application/json\r\n\r\n'.encode(),
+        json.dumps(payload, separators=(",", ":")).encode(),
+    ]
+    for name, media_type, data in parts:
+        extension = media_type.split("/")[-1] if media_type.startswith("image/") else "bin"
+        chunks.append(
+            f'\r\n--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}.{extension}"\r\n'
+            f'Content-Type: {media_type}\r\n\r\n'.encode()
+        )
+        chunks.append(data)
+    chunks.append(f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(chunks), f"multipart/form-data; boundary={boundary}"
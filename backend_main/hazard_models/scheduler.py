@@ -0,0 +1,323 @@
+"""
+Per-model inference queues for the hazard detection API.
+
+/predict used to run the models inline in the request handler, and then
+through one shared queue, so a miner's fire check could sit behind a pile
+of bulk crack survey images. Every model now has its own `ModelQueue`:
+
+- its own worker threads (the model's concurrency limit), so a backlog on
+  one model never delays another;
+- batching: a worker takes up to `max_batch` queued calls of one priority
+  class and runs them as one batch, waiting at most `max_wait_ms` for the
+  batch to fill;
+- priority classes: "interactive" calls (a worker at the face waiting for
+  the answer) always go before "bulk" calls (survey uploads), and within a
+  class the nearest deadline goes first;
+- calls whose deadline has passed while queued are failed with
+  `DeadlineExceededError` instead of being run, because the client has
+  already given up on them;
+- the queue is bounded; when it is full an interactive call displaces the
+  least urgent bulk call (which fails with `QueueFullError`), otherwise
+  `submit` raises `QueueFullError`.
+
+A batch is flushed early enough for its most urgent call to be answered in
+time: at that call's deadline minus the recent average batch run time.
+
+Calls without a deadline are ordered as if due `undated_slack_ms` after they
+were queued, so they are not starved within their class, and they are
+never shed. Recent queue waits are kept per priority class for `stats()`.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+PRIORITIES = ("interactive", "bulk")   # highest first
+WAIT_WINDOW = 256                      # recent queue waits kept per priority class for stats()
+BATCH_TIME_SMOOTHING = 0.2             # weight of the latest batch in the average batch run time
+
+
+class QueueFullError(Exception):
+    """Raised when a model queue already holds `max_queue` calls"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised for calls whose deadline passed before they reached a model"""
+
+
+class ModelQueue:
+    """Batching queue and worker threads for one model.
+
+    Parameters:
+        name (str)               -- model name, used for thread names and passed to the hooks
+        run_batch (callable)     -- takes a list of queued items and returns one result per item
+        workers (int)            -- worker threads, i.e. batches of this model allowed to run at once
+        max_batch (int)          -- most items passed to one `run_batch` call
+        max_wait_ms (float)      -- longest the most urgent queued call waits for its batch to fill
+        max_queue (int)          -- queued calls allowed before `submit` raises QueueFullError
+        on_shed (callable)       -- optional hook(name, stage) for every call dropped unrun: stage "queue" when
+                                    its deadline passed, "displaced" when a more urgent call took its place
+        on_depth (callable)      -- optional hook(name, depth) whenever the queue depth changes
+        on_wait (callable)       -- optional hook(name, priority, seconds) with the queue wait of every call run
+        on_batch (callable)      -- optional hook(name, size) for every batch run
+        undated_slack_ms (float) -- queue position of calls without a deadline, as if due this long after queueing
+    """
+
+    def __init__(self, name, run_batch, workers=1, max_batch=1, max_wait_ms=0.0, max_queue=32, on_shed=None,
+                 on_depth=None, on_wait=None, on_batch=None, undated_slack_ms=1000.0):
+        self.name = name
+        self.run_batch = run_batch
+        self.workers = max(1, int(workers))
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.on_shed = on_shed
+        self.on_depth = on_depth
+        self.on_wait = on_wait
+        self.on_batch = on_batch
+        self.undated_slack = max(0.0, float(undated_slack_ms)) / 1000.0
+        # Heap of [rank, due, sequence, item, future, deadline, enqueued_at, priority];
+        # the sequence keeps equal dues FIFO
+        self._pending = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._busy = 0
+        self._waits = {priority: deque(maxlen=WAIT_WINDOW) for priority in PRIORITIES}
+        self._batch_seconds = None  # moving average of run_batch time, None before the first batch
+
+    @property
+    def depth(self) -> int:
+        """Number of calls waiting for a worker"""
+        return len(self._pending)
+
+    def _depth_changed(self):
+        """Report the queue depth (called with the lock held)"""
+        if self.on_depth is not None:
+            self.on_depth(self.name, len(self._pending))
+
+    @property
+    def estimated_batch_seconds(self) -> float:
+        """Recent average run time of one batch, kept free before the head call's deadline when flushing"""
+        return self._batch_seconds or 0.0
+
+    def _observe_batch_time(self, seconds: float):
+        if self._batch_seconds is None:
+            self._batch_seconds = seconds
+        else:
+            self._batch_seconds += BATCH_TIME_SMOOTHING * (seconds - self._batch_seconds)
+
+    def _shed(self, stage: str = "queue"):
+        if self.on_shed is not None:
+            self.on_shed(self.name, stage)
+
+    def start(self):
+        """Start the worker threads"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the workers and fail every call that is still queued"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        with self._cond:
+            while self._pending:
+                future = heapq.heappop(self._pending)[4]
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(RuntimeError(f"{self.name} queue stopped"))
+            self._depth_changed()
+
+    def submit(self, item, deadline: float = None, priority: str = "interactive") -> Future:
+        """Queue `item` for the next batch and return a future for its result
+
+        Parameters:
+            item              -- one input for `run_batch` (e.g. a decoded image)
+            deadline (float)  -- time.monotonic() after which the result is no longer wanted
+            priority (str)    -- "interactive" or "bulk"
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        future = Future()
+        with self._cond:
+            if not self._running:
+                raise RuntimeError(f"{self.name} queue is not running")
+            now = time.monotonic()
+            if deadline is not None and deadline <= now:
+                self._shed()
+                raise DeadlineExceededError(f"deadline passed before the {self.name} queue")
+            due = now + self.undated_slack if deadline is None else deadline
+            entry = [PRIORITIES.index(priority), due, next(self._sequence), item, future, deadline, now, priority]
+            if len(self._pending) >= self.max_queue:
+                self._displace(entry)
+            heapq.heappush(self._pending, entry)
+            self._depth_changed()
+            self._cond.notify()
+        return future
+
+    def _displace(self, entry):
+        """Make room for `entry` in a full queue by failing the least urgent call of a lower class"""
+        index = max(range(len(self._pending)), key=lambda i: self._pending[i][:3])
+        victim = self._pending[index]
+        if victim[0] <= entry[0]:
+            raise QueueFullError(f"{self.name} queue is full ({self.max_queue} calls waiting)")
+        self._pending[index] = self._pending[-1]
+        self._pending.pop()
+        heapq.heapify(self._pending)
+        self._depth_changed()
+        if victim[4].set_running_or_notify_cancel():
+            victim[4].set_exception(QueueFullError(f"{self.name} queue is full; displaced by an {entry[7]} call"))
+            self._shed("displaced")
+
+    async def run(self, item, deadline: float = None, priority: str = "interactive"):
+        """Queue `item` and wait for its result without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(item, deadline, priority))
+
+    def _next_batch(self):
+        """Block until a batch is ready; returns None once the queue is stopped"""
+        with self._cond:
+            while True:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return None
+                # The most urgent call waits at most max_wait for company, and never so long that
+                # its batch could no longer finish before its deadline
+                head = self._pending[0]
+                flush_at = head[6] + self.max_wait
+                if head[5] is not None:
+                    flush_at = min(flush_at, head[5] - self.estimated_batch_seconds)
+                while self._running and len(self._pending) < self.max_batch:
+                    remaining = flush_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._running:
+                    return None
+
+                batch = []
+                now = time.monotonic()
+                # A batch holds one priority class: interactive calls never wait for bulk images in their batch
+                rank = self._pending[0][0]
+                while self._pending and self._pending[0][0] == rank and len(batch) < self.max_batch:
+                    _, _, _, item, future, deadline, enqueued_at, priority = heapq.heappop(self._pending)
+                    # Callers that went away while queued are dropped before inference
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    if deadline is not None and deadline <= now:
+                        future.set_exception(DeadlineExceededError(f"deadline passed in the {self.name} queue"))
+                        self._shed()
+                        continue
+                    wait = now - enqueued_at
+                    self._waits[priority].append(wait)
+                    if self.on_wait is not None:
+                        self.on_wait(self.name, priority, wait)
+                    batch.append((item, future))
+                self._depth_changed()
+                if batch:
+                    self._busy += 1
+                    return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            started = time.monotonic()
+            try:
+                if self.on_batch is not None:
+                    self.on_batch(self.name, len(batch))
+                results = self.run_batch([item for item, _ in batch])
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._observe_batch_time(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        """Queue depth per priority class, busy workers, average batch run time and recent queue waits (ms)"""
+        with self._cond:
+            waiting = {priority: 0 for priority in PRIORITIES}
+            for entry in self._pending:
+                waiting[entry[7]] += 1
+            waits = {priority: sorted(samples) for priority, samples in self._waits.items()}
+            busy = self._busy
+            batch_ms = round(self.estimated_batch_seconds * 1000, 2)
+        return {
+            "depth": sum(waiting.values()),
+            "waiting": waiting,
+            "busy_workers": busy,
+            "workers": self.workers,
+            "max_batch": self.max_batch,
+            "batch_ms": batch_ms,
+            "wait_ms": {priority: _summary_ms(samples) for priority, samples in waits.items()},
+        }
+
+
+def _summary_ms(samples: list) -> dict:
+    """Mean, 95th percentile and max of sorted waits (seconds), in milliseconds"""
+    if not samples:
+        return {"samples": 0, "mean": None, "p95": None, "max": None}
+    return {
+        "samples": len(samples),
+        "mean": round(sum(samples) / len(samples) * 1000, 2),
+        "p95": round(samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000, 2),
+        "max": round(samples[-1] * 1000, 2),
+    }
+
+
+class InferenceScheduler:
+    """The per-model queues of one process, started, stopped and inspected together
+
+    Hooks given here (on_shed, on_depth, on_wait, on_batch) are passed to every queue added.
+    """
+
+    def __init__(self, **hooks):
+        self.hooks = hooks
+        self.queues = {}
+
+    def add_model(self, name, run_batch, **options) -> ModelQueue:
+        """Create the queue for one model; `options` are ModelQueue parameters"""
+        self.queues[name] = ModelQueue(name, run_batch, **{**self.hooks, **options})
+        return self.queues[name]
+
+    @property
+    def depth(self) -> int:
+        """Calls waiting across all models"""
+        return sum(queue.depth for queue in self.queues.values())
+
+    def start(self):
+        for queue in self.queues.values():
+            queue.start()
+
+    def stop(self, timeout: float = 5.0):
+        for queue in self.queues.values():
+            queue.stop(timeout)
+
+    async def run(self, model: str, item, deadline: float = None, priority: str = "interactive"):
+        """Queue `item` for `model` and wait for its result"""
+        return await self.queues[model].run(item, deadline, priority)
+
+    def stats(self) -> dict:
+        return {name: queue.stats() for name, queue in self.queues.items()}
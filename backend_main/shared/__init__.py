@@ -0,0 +1,5 @@
+"""
+Modules used by both the PPE service (backend_ppe) and the hazard service
+(hazard_models). Each service puts backend_main on sys.path at startup and
+imports them as `shared.<module>`.
+"""
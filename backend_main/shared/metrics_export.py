@@ -0,0 +1,23 @@
+"""
+/metrics rendering shared by the PPE and hazard services.
+
+Under prefork.py PROMETHEUS_MULTIPROC_DIR is set before the service is
+imported: every worker writes its samples to files in that directory and a
+scrape merges all workers, whichever one answers it.
+"""
+
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def render_latest():
+    """(body, content_type) for the /metrics endpoint"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,158 @@
+"""
+Pre-fork multi-worker serving, used by the prefork.py launcher of each service.
+
+`uvicorn <module>:app --workers N` starts N independent processes that each
+import the service, so the weights are held N times and every worker pays
+the cold load. Here the parent process loads and warms the app once, binds
+the listening socket and only then forks the workers. The workers start
+with the parent's memory as shared copy-on-write pages; inference never
+writes to the weights, so they stay shared for the life of the process.
+
+CPU threads are split between workers: each one gets
+`available cores // workers` torch intra-op threads unless the launcher
+asks for a fixed number, so N workers do not fight over the same cores. The
+parent loads single-threaded because OpenMP thread pools do not survive a
+fork; batcher and watcher threads are started by each worker's startup
+event, after the fork. Apps whose runtime cannot be inherited across a fork
+(`share=False`) are loaded by every worker after forking instead.
+
+The parent supervises the workers: a worker that dies is replaced from the
+already-loaded parent (no reload), and SIGTERM/SIGINT stop all of them.
+"""
+
+import gc
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import traceback
+
+import torch
+
+
+def available_cpus() -> int:
+    """Cores this process may run on (respects taskset/cgroup CPU affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def threads_per_worker(workers: int, requested: int = 0) -> int:
+    if requested > 0:
+        return requested
+    return max(1, available_cpus() // max(1, workers))
+
+
+def prepare_metrics_dir(workers: int, prefix: str = "metrics-"):
+    """Give all workers one Prometheus multiprocess directory (must happen before the app is imported)"""
+    if workers < 2:
+        return
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # Samples of a previous run would otherwise be merged into this one
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix=prefix)
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, load_app, sock: socket.socket, threads: int, log_level: str = "info"):
+    """Worker process body: serve the shared socket until told to stop"""
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+    if app is None:
+        app = load_app()
+    uvicorn.Server(uvicorn.Config(app, log_level=log_level)).run(sockets=[sock])
+
+
+def serve(load_app, name: str, workers: int, host: str, port: int, torch_threads: int = 0,
+          share: bool = True, metrics_prefix: str = "metrics-", log_level: str = "info"):
+    """Load the app with `load_app()` (in the parent when `share`), fork `workers` workers and supervise them
+
+    Parameters:
+        load_app (callable) -- imports and warms up the service, returns its ASGI app
+        name (str)          -- service name for the log lines
+        torch_threads (int) -- intra-op threads per worker, 0 = split the cores evenly
+        share (bool)        -- load once in the parent and share copy-on-write, otherwise load in every worker
+    """
+    prepare_metrics_dir(workers, metrics_prefix)
+    threads = threads_per_worker(workers, torch_threads)
+
+    # No parallel torch work before the fork: the workers could not reuse the pool
+    torch.set_num_threads(1)
+    app = load_app() if share else None
+    if app is not None:
+        # Keep the garbage collector from writing to (and so un-sharing) the loaded objects
+        gc.collect()
+        gc.freeze()
+    sock = bind_socket(host, port)
+
+    print(f"🚀 Starting {name} on port {port} with {workers} workers "
+          f"x {threads} torch threads ({'shared' if share else 'per-worker'} model)")
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, load_app, sock, threads, log_level)
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+            os._exit(0)
+        children[pid] = time.monotonic()
+        print(f"👷 Worker {pid} started")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None:
+            continue
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+        if stopping:
+            continue
+        print(f"⚠️  Worker {pid} exited (status {status}), starting a replacement")
+        # Do not spin if workers die right after starting (e.g. port, config or model file problems)
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)
+        spawn()
+
+    sock.close()
+    print("👋 All workers stopped")
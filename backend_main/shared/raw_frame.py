@@ -0,0 +1,99 @@
+"""
+Raw frame ingest for edge clients (smart helmets, gate kiosks).
+
+Devices that already hold an uncompressed, pre-resized frame can post it as
+is instead of JPEG-encoding it on a microcontroller and having the server
+decode it again. The request body is a 16-byte header followed by the
+pixels, row by row:
+
+    offset  size  field
+    0       4     magic b"RAWF"
+    4       2     width in pixels (little-endian)
+    6       2     height in pixels
+    8       4     stride: bytes per row including padding (0 = width * channels)
+    12      1     pixel format: 0 = GRAY8, 1 = RGB24, 2 = BGR24
+    13      3     reserved, zero
+
+BGR frames are used in place: `np.frombuffer` views the request body, padded
+rows included, without copying a byte. RGB and grayscale frames take one
+OpenCV conversion to BGR.
+"""
+
+import struct
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+MAGIC = b"RAWF"
+HEADER = struct.Struct("<4sHHIB3x")
+
+# Pixel format code -> (name, channels)
+PIXEL_FORMATS = {0: ("gray", 1), 1: ("rgb", 3), 2: ("bgr", 3)}
+FORMAT_CODES = {name: code for code, (name, _) in PIXEL_FORMATS.items()}
+
+
+class RawFrameError(ValueError):
+    """The body is not a valid raw frame"""
+
+
+class RawFrameHeader(NamedTuple):
+    width: int
+    height: int
+    stride: int
+    pixel_format: str
+    channels: int
+
+
+def read_header(buffer, max_pixels: int = 0) -> RawFrameHeader:
+    """Parse and validate the header of a raw frame without touching the pixels"""
+    if len(buffer) < HEADER.size:
+        raise RawFrameError(f"Raw frame is shorter than its {HEADER.size}-byte header")
+    magic, width, height, stride, code = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise RawFrameError("Raw frame must start with the magic bytes 'RAWF'")
+    if code not in PIXEL_FORMATS:
+        raise RawFrameError(f"Unknown pixel format {code}; use 0 (gray), 1 (RGB) or 2 (BGR)")
+    if width == 0 or height == 0:
+        raise RawFrameError("Raw frame width and height must be positive")
+    if max_pixels and width * height > max_pixels:
+        raise RawFrameError(f"Raw frame has {width}x{height} pixels; at most {max_pixels} are accepted")
+    name, channels = PIXEL_FORMATS[code]
+    row_bytes = width * channels
+    stride = stride or row_bytes
+    if stride < row_bytes:
+        raise RawFrameError(f"Stride {stride} is smaller than a row of {row_bytes} bytes")
+    expected = HEADER.size + stride * (height - 1) + row_bytes
+    if len(buffer) < expected:
+        raise RawFrameError(f"Raw frame body has {len(buffer)} bytes; its header needs {expected}")
+    return RawFrameHeader(width, height, stride, name, channels)
+
+
+def frame_view(buffer, header: RawFrameHeader) -> np.ndarray:
+    """Zero-copy (height, width[, channels]) view of the pixels; read-only for a bytes body"""
+    rows = np.frombuffer(buffer, np.uint8, count=header.stride * (header.height - 1) + header.width * header.channels,
+                         offset=HEADER.size)
+    # Rows start `stride` bytes apart; padding at the end of each row is skipped by the strides
+    shape = (header.height, header.width, header.channels)
+    view = np.lib.stride_tricks.as_strided(rows, shape, (header.stride, header.channels, 1), writeable=False)
+    return view[:, :, 0] if header.channels == 1 else view
+
+
+def to_bgr(buffer, max_pixels: int = 0) -> np.ndarray:
+    """BGR image of a raw frame: the body itself for BGR frames, one conversion for RGB and gray"""
+    header = read_header(buffer, max_pixels)
+    view = frame_view(buffer, header)
+    if header.pixel_format == "rgb":
+        return cv2.cvtColor(view, cv2.COLOR_RGB2BGR)
+    if header.pixel_format == "gray":
+        return cv2.cvtColor(view, cv2.COLOR_GRAY2BGR)
+    return view
+
+
+def pack_frame(image: np.ndarray, pixel_format: str = "bgr") -> bytes:
+    """Encode an array as a raw frame (for clients, gateways and benchmarks)"""
+    if pixel_format not in FORMAT_CODES:
+        raise ValueError(f"pixel_format must be one of {', '.join(FORMAT_CODES)}")
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    return HEADER.pack(MAGIC, width, height, 0, FORMAT_CODES[pixel_format]) + image.tobytes()
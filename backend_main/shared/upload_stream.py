@@ -0,0 +1,301 @@
+"""
+Streaming multipart parsing for image uploads.
+
+Starlette's form parser spools every file part into a SpooledTemporaryFile
+(rolled to disk past 1 MB) and `await file.read()` copies it back out, so a
+50 MB upload was received in full, twice, before we found out it was a PDF
+or a 20000x20000 PNG. Routes built with `image_upload_route` parse the body
+while it is still arriving instead:
+
+- a Content-Length above the limits is refused before the body is read;
+- the first bytes of every file are matched against the JPEG, PNG, WebP,
+  BMP, TIFF and GIF signatures, and anything else is refused with 415;
+- the width and height are read from the image header (JPEG SOF, PNG IHDR,
+  WebP VP8/VP8L/VP8X, BMP, GIF) as soon as it has arrived, and images over
+  the pixel limit are refused with 413, as are files over the byte limit.
+
+A refused upload is not read any further: the error response goes out and
+the rest of the body is never taken off the socket.
+
+Accepted files keep references to the received chunks and are joined into
+one `bytes` object when their part ends. That join is the only copy: the
+UploadFile handed to the endpoint reads back that same object, and the
+decoders wrap it with `np.frombuffer` / `BytesIO` without copying again.
+"""
+
+import io
+import struct
+from typing import Callable, NamedTuple, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.routing import APIRoute
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.datastructures import FormData, Headers, UploadFile
+
+SIGNATURE_BYTES = 12          # enough to tell every supported format apart
+SNIFF_BYTES = 256 * 1024      # JPEG EXIF/ICC segments can push the SOF marker this far in
+MAX_FIELD_BYTES = 64 * 1024   # per text field
+MAX_FIELDS = 1000
+FORM_OVERHEAD_BYTES = 1024 * 1024   # text fields and part headers on top of the files
+
+FORMAT_NAMES = ("jpeg", "png", "webp", "bmp", "tiff", "gif")
+
+# JPEG start-of-frame markers (DHT, JPG and DAC share the range but carry no size)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class UploadLimits(NamedTuple):
+    max_file_bytes: int = 32 * 1024 * 1024     # per file; 0 = no limit
+    max_pixels: int = 50_000_000               # width x height per image; 0 = no limit
+    max_files: int = 1
+    formats: tuple = FORMAT_NAMES
+    on_reject: Optional[Callable[[str], None]] = None   # called with "too_large", "too_many_pixels" or "unsupported_format"
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Image format from the first bytes of a file; None when no supported signature matches"""
+    if head[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:2] == b"BM":
+        return "bmp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def _jpeg_size(head: bytes):
+    i = 2
+    while i + 9 <= len(head):
+        if head[i] != 0xFF:
+            return None     # not at a marker: leave it to the decoder
+        marker = head[i + 1]
+        if marker == 0xFF:
+            i += 1          # fill byte
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2          # markers without a length
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", head, i + 5)
+            return width, height
+        else:
+            i += 2 + struct.unpack_from(">H", head, i + 2)[0]
+    return None
+
+
+def _webp_size(head: bytes):
+    chunk = head[12:16]
+    if chunk == b"VP8 " and len(head) >= 30:
+        width, height = struct.unpack_from("<HH", head, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(head) >= 25:
+        bits = struct.unpack_from("<I", head, 21)[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(head) >= 30:
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
+def sniff_size(image_format: str, head: bytes):
+    """(width, height) from an image header, or None if `head` does not reach it (TIFF: never)"""
+    if image_format == "jpeg":
+        return _jpeg_size(head)
+    if image_format == "png" and len(head) >= 24 and head[12:16] == b"IHDR":
+        return struct.unpack_from(">II", head, 16)
+    if image_format == "webp":
+        return _webp_size(head)
+    if image_format == "bmp" and len(head) >= 26:
+        if struct.unpack_from("<I", head, 14)[0] == 12:     # OS/2 BITMAPCOREHEADER
+            return struct.unpack_from("<HH", head, 18)
+        width, height = struct.unpack_from("<ii", head, 18)
+        return abs(width), abs(height)
+    if image_format == "gif" and len(head) >= 10:
+        return struct.unpack_from("<HH", head, 6)
+    return None
+
+
+class StreamedUpload(UploadFile):
+    """An uploaded image, received into a single `bytes` object"""
+
+    def __init__(self, data: bytes, filename: str, headers: Headers, image_format: str, dimensions):
+        super().__init__(io.BytesIO(data), size=len(data), filename=filename, headers=headers)
+        self.data = data
+        self.image_format = image_format
+        self.dimensions = dimensions    # (width, height), or None when the header did not say
+
+    async def read(self, size: int = -1) -> bytes:
+        # Already in memory; a full read returns `data` itself rather than a copy
+        return self.file.read(size)
+
+
+class ImageFormParser:
+    """Incremental multipart/form-data parser that vets file parts as they arrive"""
+
+    def __init__(self, boundary: bytes, limits: UploadLimits):
+        self.limits = limits
+        self.items = []
+        self.files = 0
+        self.fields = 0
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        })
+
+    def reject(self, status_code: int, reason: str, detail: str):
+        if self.limits.on_reject is not None:
+            self.limits.on_reject(reason)
+        raise HTTPException(status_code=status_code, detail=detail)
+
+    def _part_begin(self):
+        self._headers = []
+        self._field = b""
+        self._value = b""
+        self._name = ""
+        self._filename = None
+        self._text = bytearray()
+        self._chunks = []
+        self._received = 0
+        self._head = bytearray()
+        self._format = None
+        self._dimensions = None
+
+    def _header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._headers.append((self._field.lower(), self._value))
+        self._field = b""
+        self._value = b""
+
+    def _headers_finished(self):
+        disposition, options = parse_options_header(dict(self._headers).get(b"content-disposition", b""))
+        if disposition != b"form-data" or b"name" not in options:
+            raise HTTPException(status_code=400, detail="Every multipart part needs a form-data name.")
+        self._name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" not in options:
+            self.fields += 1
+            if self.fields > MAX_FIELDS:
+                raise HTTPException(status_code=400, detail=f"Too many form fields. At most {MAX_FIELDS}.")
+            return
+        self.files += 1
+        if self.files > self.limits.max_files:
+            raise HTTPException(status_code=400,
+                                detail=f"Too many files. At most {self.limits.max_files} images per request.")
+        self._filename = options[b"filename"].decode("utf-8", "replace")
+
+    def _part_data(self, data, start, end):
+        if self._filename is None:
+            self._text += data[start:end]
+            if len(self._text) > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Form field '{self._name}' is too large.")
+            return
+        # The parser passes slices of the received chunks (or a fresh bytes object); keep views, not copies
+        chunk = memoryview(data)[start:end] if isinstance(data, bytes) else bytes(data[start:end])
+        self._received += len(chunk)
+        if self.limits.max_file_bytes and self._received > self.limits.max_file_bytes:
+            self.reject(413, "too_large", f"'{self._filename}' is larger than the "
+                                          f"{self.limits.max_file_bytes // (1024 * 1024)} MB upload limit.")
+        self._chunks.append(chunk)
+        if self._dimensions is None and len(self._head) < SNIFF_BYTES:
+            self._head += chunk[:SNIFF_BYTES - len(self._head)]
+            self._sniff(self._head, final=False)
+
+    def _sniff(self, head, final: bool):
+        if self._format is None:
+            if len(head) < SIGNATURE_BYTES and not final:
+                return
+            self._format = sniff_format(head)
+            if self._format is None or self._format not in self.limits.formats:
+                self.reject(415, "unsupported_format",
+                            f"'{self._filename}' is not a supported image. "
+                            f"Accepted formats: {', '.join(self.limits.formats)}.")
+        self._dimensions = sniff_size(self._format, head)
+        if self._dimensions is not None and self.limits.max_pixels:
+            width, height = self._dimensions
+            if width * height > self.limits.max_pixels:
+                self.reject(413, "too_many_pixels",
+                            f"'{self._filename}' is {width}x{height} pixels; "
+                            f"at most {self.limits.max_pixels} pixels are accepted.")
+
+    def _part_end(self):
+        if self._filename is None:
+            self.items.append((self._name, self._text.decode("utf-8", "replace")))
+            return
+        data = b"".join(self._chunks)
+        self._chunks = []
+        if self._format is None:
+            self._sniff(data, final=True)
+        elif self._dimensions is None and len(self._head) >= SNIFF_BYTES:
+            # Header longer than the sniff window: look again now that the whole file is here
+            self._sniff(data, final=True)
+        self.items.append((self._name, StreamedUpload(
+            data, self._filename, Headers(raw=self._headers), self._format, self._dimensions)))
+
+    def write(self, chunk: bytes):
+        self._parser.write(chunk)
+
+    def finish(self) -> FormData:
+        self._parser.finalize()
+        return FormData(self.items)
+
+
+async def read_image_form(request: Request, limits: UploadLimits) -> FormData:
+    """Parse a multipart/form-data body while it streams in, refusing unusable images early"""
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing boundary in multipart/form-data.")
+    parser = ImageFormParser(boundary, limits)
+
+    length = request.headers.get("content-length", "")
+    if limits.max_file_bytes and length.isdigit() and \
+            int(length) > limits.max_files * limits.max_file_bytes + FORM_OVERHEAD_BYTES:
+        parser.reject(413, "too_large", f"Upload of {int(length) // (1024 * 1024)} MB exceeds the "
+                                        f"{limits.max_file_bytes // (1024 * 1024)} MB per image limit.")
+
+    async for chunk in request.stream():
+        parser.write(chunk)
+    return parser.finish()
+
+
+class ImageUploadRequest(Request):
+    """Request whose multipart form is parsed by ImageFormParser"""
+
+    def __init__(self, scope, receive, limits: UploadLimits):
+        super().__init__(scope, receive)
+        self.upload_limits = limits
+
+    async def _get_form(self, *, max_files=1000, max_fields=1000) -> FormData:
+        if self._form is None:
+            content_type, _ = parse_options_header(self.headers.get("content-type", ""))
+            if content_type != b"multipart/form-data":
+                return await super()._get_form(max_files=max_files, max_fields=max_fields)
+            self._form = await read_image_form(self, self.upload_limits)
+        return self._form
+
+
+def image_upload_route(limits: UploadLimits) -> type:
+    """APIRoute class for endpoints taking image uploads; use it as an APIRouter's `route_class`"""
+
+    class ImageUploadRoute(APIRoute):
+        def get_route_handler(self):
+            handler = super().get_route_handler()
+
+            async def parse_while_streaming(request: Request):
+                return await handler(ImageUploadRequest(request.scope, request.receive, limits))
+
+            return parse_while_streaming
+
+    return ImageUploadRoute
@@ -0,0 +1,132 @@
+"""
+Memory and throughput versus worker count, for the `workers` subcommand of
+each service's benchmark.py.
+
+Every configuration is started as its own server (prefork.py or
+`uvicorn --workers`), warmed up, then loaded by concurrent clients. Memory
+is reported as RSS, which counts pages shared copy-on-write once per worker,
+and PSS, which splits them between the processes that share them.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+
+class Service(NamedTuple):
+    """What differs between the benchmarked services"""
+    directory: str      # folder holding prefork.py and the app module
+    app: str            # uvicorn import string, e.g. "main:app"
+    workers_env: str    # env var prefork.py reads the worker count from
+    ready_path: str     # GET path that answers once the app is up
+    endpoint: str       # POST path that is load tested
+    form: dict          # form fields sent with every upload
+    env: dict = {}      # extra environment for the server, e.g. to turn a result cache off
+
+
+def process_tree(pid: int) -> list:
+    """`pid` and all of its descendants (Linux /proc)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def memory_mb(pids) -> tuple:
+    """(summed RSS, summed PSS) in MB; PSS splits shared pages between the processes using them"""
+    rss = pss = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Rss:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("Pss:"):
+                        pss += int(line.split()[1])
+        except OSError:
+            pass
+    return rss / 1024, pss / 1024
+
+
+def launch_server(service: Service, launcher: str, workers: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(port), **{service.workers_env: str(workers)}, **service.env)
+    if launcher == "prefork":
+        command = [sys.executable, "prefork.py", str(workers)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", service.app, "--host", "127.0.0.1",
+                   "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=service.directory, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def wait_until_ready(service: Service, url: str, proc: subprocess.Popen, processes: int, timeout: float) -> float:
+    """Seconds until the server answers and all of its processes are up"""
+    import requests
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with status {proc.returncode}")
+        try:
+            if requests.get(url + service.ready_path, timeout=1).ok and len(process_tree(proc.pid)) >= processes:
+                return time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"server not ready after {timeout:.0f} s")
+
+
+def load_test(service: Service, url: str, payload: bytes, concurrency: int, duration: float) -> tuple:
+    """(successful, failed) request latencies in seconds from `concurrency` clients over `duration` seconds"""
+    import requests
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = session.post(url + service.endpoint, files={"file": ("image.jpg", payload, "image/jpeg")},
+                                    data=service.form, timeout=60)
+            (latencies if response.ok else errors).append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def compare_launchers(service: Service, payload: bytes, launchers, worker_counts, port: int, timeout: float,
+                      concurrency: int, duration: float, unit: str = "req/s"):
+    """Print start-up time, memory, throughput and p95 latency for every launcher and worker count"""
+    url = f"http://127.0.0.1:{port}"
+    for launcher in launchers:
+        for workers in worker_counts:
+            proc = launch_server(service, launcher, workers, port)
+            try:
+                # A supervisor plus the workers, except single-worker uvicorn which serves in-process
+                processes = 1 if launcher == "uvicorn" and workers == 1 else workers + 1
+                ready = wait_until_ready(service, url, proc, processes, timeout)
+                load_test(service, url, payload, concurrency, 2.0)  # warm-up
+                rss, pss = memory_mb(process_tree(proc.pid))
+                latencies, errors = load_test(service, url, payload, concurrency, duration)
+                rss_after, pss_after = memory_mb(process_tree(proc.pid))
+            finally:
+                os.killpg(proc.pid, signal.SIGTERM)
+                proc.wait()
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else float("nan")
+            print(f"  {launcher:>7} x{workers}: ready {ready:5.1f} s | "
+                  f"RSS {rss:6.0f} -> {rss_after:6.0f} MB | PSS {pss:6.0f} -> {pss_after:6.0f} MB | "
+                  f"{len(latencies) / duration:6.2f} {unit} | p95 {p95 * 1000:7.0f} ms | errors {len(errors)}")
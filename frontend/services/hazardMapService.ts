@@ -350,21 +350,23 @@ export interface FireDetectionResult {
   hazard_type: 'fire';
   severity_label: 'LOW' | 'MEDIUM' | 'HIGH' | 'CRITICAL';
   severity_percent: number;
-  processed_image: string; // base64
+  processed_image?: string; // base64; sent unless outputs excludes "preview"
   extra_outputs: {
     num_detections: number;
     max_confidence: number;
   };
+  encodings?: Record<string, string>;
 }
 
 export interface CrackDetectionResult {
   hazard_type: 'crack';
   severity_label: 'LOW' | 'MEDIUM' | 'HIGH' | 'CRITICAL';
   severity_percent: number;
-  processed_image: string; // base64
+  processed_image?: string; // base64; sent unless outputs excludes "preview"
   extra_outputs: {
-    fused: string;
-    binary_mask: string;
+    // Only sent when requested with outputs=fused,mask,sides
+    fused?: string;
+    binary_mask?: string | { encoding: 'rle' | 'bitpack'; size: [number, number]; counts?: number[]; bits?: string };
     side1?: string;
     side2?: string;
     side3?: string;
@@ -373,6 +375,7 @@ export interface CrackDetectionResult {
     crack_pixels: number;
     total_pixels: number;
   };
+  encodings?: Record<string, string>;
 }
 
 export const detectFire = async (imageUri: string): Promise<FireDetectionResult> => {